@@ -0,0 +1,130 @@
+"""
+Business: Пул соединений с PostgreSQL, переживающий тёплые вызовы контейнера
+Args: DATABASE_URL - строка подключения, DB_POOL_MAX - лимит соединений на контейнер,
+      DB_POOL_CHECK_AFTER - через сколько секунд простоя проверять соединение
+Returns: контекстный менеджер connection() и счётчики stats(); соединения с трассировкой запросов (tracing.py)
+"""
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Tuple
+import psycopg2
+import psycopg2.extensions
+
+import tracing
+
+MAX_CONNECTIONS = int(os.environ.get('DB_POOL_MAX', '4'))
+CHECK_AFTER_SECONDS = float(os.environ.get('DB_POOL_CHECK_AFTER', '30'))
+ACQUIRE_TIMEOUT_SECONDS = float(os.environ.get('DB_POOL_ACQUIRE_TIMEOUT', '10'))
+
+_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(MAX_CONNECTIONS)
+_idle: List[Tuple[psycopg2.extensions.connection, float]] = []
+_stats: Dict[str, int] = {
+    'hits': 0,
+    'connects': 0,
+    'reconnects': 0,
+    'discarded': 0,
+}
+
+
+class PoolExhausted(Exception):
+    pass
+
+
+def stats() -> Dict[str, int]:
+    with _lock:
+        snapshot = dict(_stats)
+        snapshot['idle'] = len(_idle)
+    return snapshot
+
+
+def _connect() -> psycopg2.extensions.connection:
+    return psycopg2.connect(os.environ['DATABASE_URL'], connection_factory=tracing.TracingConnection)
+
+
+def _is_alive(conn: psycopg2.extensions.connection) -> bool:
+    try:
+        with conn.cursor() as cur:
+            cur.execute('SELECT 1')
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+
+def _discard(conn: psycopg2.extensions.connection) -> None:
+    try:
+        conn.close()
+    except psycopg2.Error:
+        pass
+    with _lock:
+        _stats['discarded'] += 1
+
+
+def _checkout() -> psycopg2.extensions.connection:
+    while True:
+        with _lock:
+            if not _idle:
+                _stats['connects'] += 1
+                break
+            conn, released_at = _idle.pop()
+
+        if conn.closed:
+            _discard(conn)
+            with _lock:
+                _stats['reconnects'] += 1
+            continue
+
+        if time.monotonic() - released_at > CHECK_AFTER_SECONDS and not _is_alive(conn):
+            _discard(conn)
+            with _lock:
+                _stats['reconnects'] += 1
+            continue
+
+        with _lock:
+            _stats['hits'] += 1
+        return conn
+
+    return _connect()
+
+
+def _checkin(conn: psycopg2.extensions.connection, broken: bool) -> None:
+    if not broken and not conn.closed:
+        try:
+            if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+        except psycopg2.Error:
+            broken = True
+
+    if broken or conn.closed:
+        _discard(conn)
+        return
+
+    with _lock:
+        _idle.append((conn, time.monotonic()))
+
+
+@contextmanager
+def connection() -> Iterator[psycopg2.extensions.connection]:
+    with tracing.phase('db_acquire'):
+        if not _slots.acquire(timeout=ACQUIRE_TIMEOUT_SECONDS):
+            raise PoolExhausted(f'No free database connection after {ACQUIRE_TIMEOUT_SECONDS}s')
+
+        try:
+            conn = _checkout()
+        except Exception:
+            _slots.release()
+            raise
+
+    broken = False
+    try:
+        yield conn
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        broken = True
+        raise
+    finally:
+        _checkin(conn, broken)
+        _slots.release()
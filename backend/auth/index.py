@@ -7,16 +7,42 @@ Returns: HTTP ответ с токеном или ошибкой
 
 import json
 import os
-import hashlib
 import secrets
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
 from typing import Dict, Any
-import psycopg2
 from psycopg2.extras import RealDictCursor
 
+import db
+from outbox import drain, enqueue
+from passwords import DUMMY_HASH, KdfBusy, hash_password, verify_password
+from ratelimit import TokenBucketLimiter
+from sessions import authenticate, issue_token, revoke
+import tracing
+
+limiter = TokenBucketLimiter()
+
+def client_ip(event: Dict[str, Any]) -> str:
+    identity = (event.get('requestContext') or {}).get('identity') or {}
+    headers = event.get('headers') or {}
+    forwarded = headers.get('X-Forwarded-For') or headers.get('x-forwarded-for') or ''
+    return identity.get('sourceIp') or forwarded.split(',')[0].strip() or 'unknown'
+
+@tracing.traced
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    # Пул scrypt переполнен: просим повторить позже, а не отвечаем 500
+    try:
+        return handle(event, context)
+    except KdfBusy:
+        return {
+            'statusCode': 503,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*',
+                'Retry-After': '5'
+            },
+            'body': json.dumps({'error': 'Сервис перегружен, попробуйте позже'})
+        }
+
+def handle(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'GET')
     
     if method == 'OPTIONS':
@@ -25,7 +51,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Auth-Token',
+                'Access-Control-Allow-Headers': 'Content-Type, X-Auth-Token, Authorization',
                 'Access-Control-Max-Age': '86400'
             },
             'body': ''
@@ -35,27 +61,22 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         body_data = json.loads(event.get('body', '{}'))
         action = body_data.get('action')
         
-        conn = psycopg2.connect(os.environ['DATABASE_URL'])
-        cur = conn.cursor(cursor_factory=RealDictCursor)
-        
-        if action == 'register':
-            email = body_data.get('email')
-            password = body_data.get('password')
-            username = body_data.get('username', email.split('@')[0])
-            
-            password_hash = hashlib.sha256(password.encode()).hexdigest()
-            
-            cur.execute(
-                "INSERT INTO users (email, password_hash, username) VALUES (%s, %s, %s) RETURNING id, email, username, avatar_url",
-                (email, password_hash, username)
-            )
-            user = dict(cur.fetchone())
-            conn.commit()
+        # drain() сам берёт соединения из пула только на время выборки и записи статусов:
+        # SMTP идёт без удержанного соединения, поэтому обрабатываем до db.connection()
+        if action == 'send_outbox':
+            headers = event.get('headers') or {}
+            provided_secret = headers.get('X-Cron-Secret') or headers.get('x-cron-secret') or ''
+            cron_secret = os.environ.get('CRON_SECRET', '')
             
-            token = secrets.token_urlsafe(32)
-            
-            cur.close()
-            conn.close()
+            if not cron_secret or not secrets.compare_digest(provided_secret, cron_secret):
+                return {
+                    'statusCode': 403,
+                    'headers': {
+                        'Content-Type': 'application/json',
+                        'Access-Control-Allow-Origin': '*'
+                    },
+                    'body': json.dumps({'error': 'Доступ запрещён'})
+                }
             
             return {
                 'statusCode': 200,
@@ -63,51 +84,97 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'Content-Type': 'application/json',
                     'Access-Control-Allow-Origin': '*'
                 },
-                'body': json.dumps({
-                    'user': user,
-                    'token': token
-                })
+                'body': json.dumps(drain())
             }
         
-        elif action == 'reset_password':
-            email = body_data.get('email')
+        limit_keys = []
+        if action in ('login', 'reset_password'):
+            limit_keys = [
+                f'{action}:ip:{client_ip(event)}',
+                f"{action}:email:{(body_data.get('email') or '').strip().lower()}"
+            ]
+            if not limiter.allow_local(limit_keys):
+                return {
+                    'statusCode': 429,
+                    'headers': {
+                        'Content-Type': 'application/json',
+                        'Access-Control-Allow-Origin': '*',
+                        'Retry-After': '60'
+                    },
+                    'body': json.dumps({'error': 'Слишком много попыток, попробуйте позже'})
+                }
+        
+        with db.connection() as conn:
+            cur = conn.cursor(cursor_factory=RealDictCursor)
             
-            cur.execute(
-                "SELECT id FROM users WHERE email = %s",
-                (email,)
-            )
-            user = cur.fetchone()
+            if limit_keys and not limiter.allow_shared(conn, limit_keys):
+                cur.close()
+                return {
+                    'statusCode': 429,
+                    'headers': {
+                        'Content-Type': 'application/json',
+                        'Access-Control-Allow-Origin': '*',
+                        'Retry-After': '60'
+                    },
+                    'body': json.dumps({'error': 'Слишком много попыток, попробуйте позже'})
+                }
             
-            if not user:
+            if action == 'register':
+                email = body_data.get('email')
+                password = body_data.get('password')
+                username = body_data.get('username', email.split('@')[0])
+                
+                password_hash = hash_password(password)
+                
+                cur.execute(
+                    "INSERT INTO users (email, password_hash, username) VALUES (%s, %s, %s) RETURNING id, email, username, avatar_url",
+                    (email, password_hash, username)
+                )
+                user = dict(cur.fetchone())
+                conn.commit()
+                
+                token = issue_token(user['id'])
+                
                 cur.close()
-                conn.close()
+                
                 return {
-                    'statusCode': 404,
+                    'statusCode': 200,
                     'headers': {
                         'Content-Type': 'application/json',
                         'Access-Control-Allow-Origin': '*'
                     },
-                    'body': json.dumps({'error': 'Пользователь не найден'})
+                    'body': json.dumps({
+                        'user': user,
+                        'token': token
+                    })
                 }
             
-            reset_token = secrets.token_urlsafe(32)
-            
-            cur.execute(
-                "UPDATE users SET reset_token = %s, reset_token_expires = NOW() + INTERVAL '1 hour' WHERE email = %s",
-                (reset_token, email)
-            )
-            conn.commit()
-            
-            smtp_host = os.environ.get('SMTP_HOST', 'smtp.gmail.com')
-            smtp_port = int(os.environ.get('SMTP_PORT', '587'))
-            smtp_user = os.environ.get('SMTP_USER', '')
-            smtp_password = os.environ.get('SMTP_PASSWORD', '')
-            
-            if smtp_user and smtp_password:
-                msg = MIMEMultipart('alternative')
-                msg['Subject'] = 'Восстановление пароля CotoVideo'
-                msg['From'] = smtp_user
-                msg['To'] = email
+            elif action == 'reset_password':
+                email = body_data.get('email')
+                
+                cur.execute(
+                    "SELECT id FROM users WHERE email = %s",
+                    (email,)
+                )
+                user = cur.fetchone()
+                
+                if not user:
+                    cur.close()
+                    return {
+                        'statusCode': 404,
+                        'headers': {
+                            'Content-Type': 'application/json',
+                            'Access-Control-Allow-Origin': '*'
+                        },
+                        'body': json.dumps({'error': 'Пользователь не найден'})
+                    }
+                
+                reset_token = secrets.token_urlsafe(32)
+                
+                cur.execute(
+                    "UPDATE users SET reset_token = %s, reset_token_expires = NOW() + INTERVAL '1 hour' WHERE email = %s",
+                    (reset_token, email)
+                )
                 
                 reset_link = f"https://preview--coto-video-network.poehali.dev/reset?token={reset_token}"
                 html = f"""
@@ -122,98 +189,117 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 </html>
                 """
                 
-                part = MIMEText(html, 'html')
-                msg.attach(part)
+                enqueue(cur, email, 'Восстановление пароля CotoVideo', html)
+                conn.commit()
+                
+                cur.close()
                 
-                with smtplib.SMTP(smtp_host, smtp_port) as server:
-                    server.starttls()
-                    server.login(smtp_user, smtp_password)
-                    server.send_message(msg)
-            
-            cur.close()
-            conn.close()
-            
-            return {
-                'statusCode': 200,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'body': json.dumps({'message': 'Письмо с инструкциями отправлено на email'})
-            }
-        
-        elif action == 'confirm_reset':
-            token = body_data.get('token')
-            new_password = body_data.get('password')
-            
-            password_hash = hashlib.sha256(new_password.encode()).hexdigest()
-            
-            cur.execute(
-                "UPDATE users SET password_hash = %s, reset_token = NULL, reset_token_expires = NULL WHERE reset_token = %s AND reset_token_expires > NOW() RETURNING id, email, username, avatar_url",
-                (password_hash, token)
-            )
-            user = cur.fetchone()
-            conn.commit()
-            
-            cur.close()
-            conn.close()
-            
-            if user:
                 return {
                     'statusCode': 200,
                     'headers': {
                         'Content-Type': 'application/json',
                         'Access-Control-Allow-Origin': '*'
                     },
-                    'body': json.dumps({'message': 'Пароль успешно изменен'})
-                }
-            else:
-                return {
-                    'statusCode': 400,
-                    'headers': {
-                        'Content-Type': 'application/json',
-                        'Access-Control-Allow-Origin': '*'
-                    },
-                    'body': json.dumps({'error': 'Неверный или истекший токен'})
+                    'body': json.dumps({'message': 'Письмо с инструкциями отправлено на email'})
                 }
-        
-        elif action == 'login':
-            email = body_data.get('email')
-            password = body_data.get('password')
-            
-            password_hash = hashlib.sha256(password.encode()).hexdigest()
-            
-            cur.execute(
-                "SELECT id, email, username, avatar_url FROM users WHERE email = %s AND password_hash = %s",
-                (email, password_hash)
-            )
-            user = cur.fetchone()
             
-            cur.close()
-            conn.close()
+            elif action == 'confirm_reset':
+                token = body_data.get('token')
+                new_password = body_data.get('password')
+                
+                password_hash = hash_password(new_password)
+                
+                cur.execute(
+                    "UPDATE users SET password_hash = %s, reset_token = NULL, reset_token_expires = NULL WHERE reset_token = %s AND reset_token_expires > NOW() RETURNING id, email, username, avatar_url",
+                    (password_hash, token)
+                )
+                user = cur.fetchone()
+                conn.commit()
+                
+                cur.close()
+                
+                if user:
+                    return {
+                        'statusCode': 200,
+                        'headers': {
+                            'Content-Type': 'application/json',
+                            'Access-Control-Allow-Origin': '*'
+                        },
+                        'body': json.dumps({'message': 'Пароль успешно изменен'})
+                    }
+                else:
+                    return {
+                        'statusCode': 400,
+                        'headers': {
+                            'Content-Type': 'application/json',
+                            'Access-Control-Allow-Origin': '*'
+                        },
+                        'body': json.dumps({'error': 'Неверный или истекший токен'})
+                    }
             
-            if user:
-                token = secrets.token_urlsafe(32)
+            elif action == 'logout':
+                claims = authenticate(event, conn)
+                if claims:
+                    revoke(conn, claims)
+                
+                cur.close()
+                
                 return {
                     'statusCode': 200,
                     'headers': {
                         'Content-Type': 'application/json',
                         'Access-Control-Allow-Origin': '*'
                     },
-                    'body': json.dumps({
-                        'user': dict(user),
-                        'token': token
-                    })
-                }
-            else:
-                return {
-                    'statusCode': 401,
-                    'headers': {
-                        'Content-Type': 'application/json',
-                        'Access-Control-Allow-Origin': '*'
-                    },
-                    'body': json.dumps({'error': 'Неверный email или пароль'})
+                    'body': json.dumps({'success': True})
                 }
+            
+            elif action == 'login':
+                email = body_data.get('email')
+                password = body_data.get('password')
+                
+                cur.execute(
+                    """SELECT id, email, username, avatar_url, password_hash,
+                              COALESCE(is_premium, false) AND (premium_until IS NULL OR premium_until > NOW()) AS is_premium,
+                              premium_until
+                       FROM users WHERE email = %s""",
+                    (email,)
+                )
+                user = cur.fetchone()
+                
+                valid, needs_rehash = verify_password(password, user['password_hash'] if user else DUMMY_HASH)
+                if user and needs_rehash:
+                    cur.execute(
+                        "UPDATE users SET password_hash = %s WHERE id = %s",
+                        (hash_password(password), user['id'])
+                    )
+                    conn.commit()
+                
+                cur.close()
+                
+                if user and valid:
+                    user = dict(user)
+                    del user['password_hash']
+                    token = issue_token(user['id'], user['is_premium'], user.pop('premium_until'))
+                    return {
+                        'statusCode': 200,
+                        'headers': {
+                            'Content-Type': 'application/json',
+                            'Access-Control-Allow-Origin': '*'
+                        },
+                        'body': json.dumps({
+                            'user': user,
+                            'token': token
+                        })
+                    }
+                else:
+                    return {
+                        'statusCode': 401,
+                        'headers': {
+                            'Content-Type': 'application/json',
+                            'Access-Control-Allow-Origin': '*'
+                        },
+                        'body': json.dumps({'error': 'Неверный email или пароль'})
+                    }
     
     return {
         'statusCode': 405,
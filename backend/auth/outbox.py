@@ -0,0 +1,168 @@
+"""
+Business: Отправка писем из таблицы email_outbox пачками через одно SMTP-соединение
+Args: SMTP_HOST, SMTP_PORT, SMTP_USER, SMTP_PASSWORD, SMTP_STARTTLS (true/false), MAIL_FROM;
+      запуск: python outbox.py [--batch N] [--once]; локально можно поднять
+      python -m aiosmtpd -n -l localhost:8025 и задать SMTP_PORT=8025 SMTP_STARTTLS=false
+Returns: enqueue() для записи письма и drain() для отправки пачки
+"""
+
+import argparse
+import os
+import smtplib
+import time
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from typing import Any, Dict, List
+from psycopg2.extras import RealDictCursor, execute_values
+
+import db
+import tracing
+
+BATCH_SIZE = int(os.environ.get('OUTBOX_BATCH_SIZE', '50'))
+RETRY_BASE_SECONDS = int(os.environ.get('OUTBOX_RETRY_BASE', '60'))
+STALE_AFTER_MINUTES = int(os.environ.get('OUTBOX_STALE_AFTER', '10'))
+
+
+def enqueue(cur, recipient: str, subject: str, html: str) -> None:
+    cur.execute(
+        "INSERT INTO email_outbox (recipient, subject, html) VALUES (%s, %s, %s)",
+        (recipient, subject, html)
+    )
+
+
+def _claim(batch_size: int) -> List[Dict[str, Any]]:
+    with db.connection() as conn:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        cur.execute(
+            """
+            UPDATE email_outbox
+            SET status = 'pending', locked_at = NULL
+            WHERE status = 'sending' AND locked_at < NOW() - make_interval(mins => %s)
+            """,
+            (STALE_AFTER_MINUTES,)
+        )
+        cur.execute(
+            """
+            UPDATE email_outbox
+            SET status = 'sending', locked_at = NOW(), attempts = attempts + 1
+            WHERE id IN (
+                SELECT id FROM email_outbox
+                WHERE status = 'pending' AND next_attempt_at <= NOW()
+                ORDER BY next_attempt_at, id
+                FOR UPDATE SKIP LOCKED
+                LIMIT %s
+            )
+            RETURNING id, recipient, subject, html, attempts, max_attempts
+            """,
+            (batch_size,)
+        )
+        rows = [dict(row) for row in cur.fetchall()]
+        conn.commit()
+        cur.close()
+    return rows
+
+
+def _build_message(sender: str, row: Dict[str, Any]) -> MIMEMultipart:
+    msg = MIMEMultipart('alternative')
+    msg['Subject'] = row['subject']
+    msg['From'] = sender
+    msg['To'] = row['recipient']
+    msg.attach(MIMEText(row['html'], 'html'))
+    return msg
+
+
+def _open_smtp() -> smtplib.SMTP:
+    with tracing.phase('smtp'):
+        server = smtplib.SMTP(os.environ.get('SMTP_HOST', 'smtp.gmail.com'), int(os.environ.get('SMTP_PORT', '587')), timeout=30)
+        if os.environ.get('SMTP_STARTTLS', 'true').lower() == 'true':
+            server.starttls()
+        smtp_user = os.environ.get('SMTP_USER', '')
+        smtp_password = os.environ.get('SMTP_PASSWORD', '')
+        if smtp_user and smtp_password:
+            server.login(smtp_user, smtp_password)
+        return server
+
+
+def _record(sent: List[int], failed: List[Dict[str, Any]]) -> None:
+    with db.connection() as conn:
+        cur = conn.cursor()
+        if sent:
+            cur.execute(
+                "UPDATE email_outbox SET status = 'sent', sent_at = NOW(), locked_at = NULL, last_error = NULL WHERE id = ANY(%s)",
+                (sent,)
+            )
+        if failed:
+            execute_values(
+                cur,
+                """
+                UPDATE email_outbox o
+                SET status = CASE WHEN o.attempts >= o.max_attempts THEN 'dead' ELSE 'pending' END,
+                    next_attempt_at = NOW() + make_interval(secs => f.retry_base * power(2, o.attempts - 1)),
+                    locked_at = NULL,
+                    last_error = f.error
+                FROM (VALUES %s) AS f(id, error, retry_base)
+                WHERE o.id = f.id
+                """,
+                [(row['id'], row['error'][:2000], RETRY_BASE_SECONDS) for row in failed]
+            )
+        conn.commit()
+        cur.close()
+
+
+def drain(batch_size: int = BATCH_SIZE) -> Dict[str, int]:
+    rows = _claim(batch_size)
+    if not rows:
+        return {'sent': 0, 'failed': 0}
+
+    sender = os.environ.get('MAIL_FROM') or os.environ.get('SMTP_USER') or 'noreply@cotovideo.ru'
+    sent: List[int] = []
+    failed: List[Dict[str, Any]] = []
+
+    try:
+        server = _open_smtp()
+    except (smtplib.SMTPException, OSError) as exc:
+        _record([], [{'id': row['id'], 'error': f'connect: {exc}'} for row in rows])
+        return {'sent': 0, 'failed': len(rows)}
+
+    try:
+        for row in rows:
+            try:
+                with tracing.phase('smtp'):
+                    server.send_message(_build_message(sender, row))
+                sent.append(row['id'])
+            except smtplib.SMTPServerDisconnected as exc:
+                failed.append({'id': row['id'], 'error': str(exc)})
+                server = _open_smtp()
+            except smtplib.SMTPException as exc:
+                failed.append({'id': row['id'], 'error': str(exc)})
+    except (smtplib.SMTPException, OSError) as exc:
+        done = set(sent) | {row['id'] for row in failed}
+        failed.extend({'id': row['id'], 'error': f'connect: {exc}'} for row in rows if row['id'] not in done)
+    finally:
+        try:
+            server.quit()
+        except (smtplib.SMTPException, OSError):
+            pass
+        _record(sent, failed)
+
+    return {'sent': len(sent), 'failed': len(failed)}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='CotoVideo email outbox sender')
+    parser.add_argument('--batch', type=int, default=BATCH_SIZE)
+    parser.add_argument('--once', action='store_true', help='отправить одну пачку и выйти')
+    parser.add_argument('--interval', type=float, default=5.0)
+    args = parser.parse_args()
+
+    while True:
+        result = drain(args.batch)
+        print(result)
+        if args.once:
+            return
+        if not result['sent'] and not result['failed']:
+            time.sleep(args.interval)
+
+
+if __name__ == '__main__':
+    main()
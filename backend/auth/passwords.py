@@ -0,0 +1,77 @@
+"""
+Business: Хеширование паролей через scrypt с настраиваемой стоимостью и прозрачным обновлением старых SHA-256 хешей
+Args: PASSWORD_SCRYPT_N / _R / _P - параметры scrypt, PASSWORD_KDF_WORKERS - размер пула потоков для KDF
+Returns: функции hash_password() и verify_password(); KdfBusy, если пул KDF не успел за PASSWORD_KDF_TIMEOUT
+"""
+
+import base64
+import hashlib
+import hmac
+import os
+import secrets
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Tuple
+
+SCRYPT_N = int(os.environ.get('PASSWORD_SCRYPT_N', str(2 ** 14)))
+SCRYPT_R = int(os.environ.get('PASSWORD_SCRYPT_R', '8'))
+SCRYPT_P = int(os.environ.get('PASSWORD_SCRYPT_P', '1'))
+KDF_TIMEOUT_SECONDS = float(os.environ.get('PASSWORD_KDF_TIMEOUT', '5'))
+DKLEN = 32
+
+_kdf_pool = ThreadPoolExecutor(
+    max_workers=int(os.environ.get('PASSWORD_KDF_WORKERS', '2')),
+    thread_name_prefix='kdf'
+)
+
+
+class KdfBusy(Exception):
+    pass
+
+
+def _b64(data: bytes) -> str:
+    return base64.b64encode(data).decode()
+
+
+def _scrypt(password: str, salt: bytes, n: int, r: int, p: int) -> bytes:
+    return hashlib.scrypt(
+        password.encode(), salt=salt, n=n, r=r, p=p,
+        maxmem=256 * n * r + 1024 * 1024, dklen=DKLEN
+    )
+
+
+def _run(fn, *args):
+    future = _kdf_pool.submit(fn, *args)
+    try:
+        return future.result(timeout=KDF_TIMEOUT_SECONDS)
+    except FutureTimeoutError:
+        # Задача ещё в очереди - снимаем её, чтобы не копить работу за ушедшими клиентами
+        future.cancel()
+        raise KdfBusy(f'Password KDF queue did not finish in {KDF_TIMEOUT_SECONDS}s')
+
+
+def hash_password(password: str) -> str:
+    salt = secrets.token_bytes(16)
+    digest = _run(_scrypt, password, salt, SCRYPT_N, SCRYPT_R, SCRYPT_P)
+    return f'scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${_b64(salt)}${_b64(digest)}'
+
+
+def verify_password(password: str, stored_hash: str) -> Tuple[bool, bool]:
+    """Возвращает (пароль верный, хеш нужно пересчитать с текущими параметрами)."""
+    if not stored_hash.startswith('scrypt$'):
+        legacy = hashlib.sha256(password.encode()).hexdigest()
+        ok = hmac.compare_digest(legacy, stored_hash)
+        return ok, ok
+
+    try:
+        _, n, r, p, salt, digest = stored_hash.split('$')
+        n, r, p = int(n), int(r), int(p)
+        expected = base64.b64decode(digest)
+        actual = _run(_scrypt, password, base64.b64decode(salt), n, r, p)
+    except ValueError:
+        return False, False
+
+    ok = hmac.compare_digest(actual, expected)
+    return ok, ok and (n, r, p) != (SCRYPT_N, SCRYPT_R, SCRYPT_P)
+
+
+DUMMY_HASH = f'scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${_b64(bytes(16))}${_b64(bytes(DKLEN))}'
@@ -0,0 +1,114 @@
+"""
+Business: Token bucket для входа и сброса пароля: локальный в памяти контейнера и общий в PostgreSQL
+Args: RATE_LIMIT_CAPACITY - размер корзины, RATE_LIMIT_REFILL_PER_MINUTE - пополнение в минуту,
+      RATE_LIMIT_PRUNE_INTERVAL - как часто контейнер удаляет из базы корзины, успевшие наполниться
+Returns: класс TokenBucketLimiter
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Tuple
+from psycopg2.extras import execute_values
+
+CAPACITY = float(os.environ.get('RATE_LIMIT_CAPACITY', '10'))
+REFILL_PER_SECOND = float(os.environ.get('RATE_LIMIT_REFILL_PER_MINUTE', '5')) / 60
+MAX_LOCAL_KEYS = 10000
+PRUNE_INTERVAL_SECONDS = float(os.environ.get('RATE_LIMIT_PRUNE_INTERVAL', '300'))
+PRUNE_BATCH = 1000
+
+
+class TokenBucketLimiter:
+    def __init__(self, capacity: float = CAPACITY, refill_per_second: float = REFILL_PER_SECOND):
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self._buckets: 'OrderedDict[str, Tuple[float, float]]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._last_prune = 0.0
+
+    def allow_local(self, keys: List[str]) -> bool:
+        """Дешёвая проверка без базы: отсекает всплески, пришедшие в этот контейнер."""
+        now = time.monotonic()
+        with self._lock:
+            levels = {}
+            for key in keys:
+                tokens, updated_at = self._buckets.get(key, (self.capacity, now))
+                levels[key] = min(self.capacity, tokens + (now - updated_at) * self.refill_per_second)
+
+            # Вытесняем давно не тронутые ключи, а не все сразу: поток новых email/IP не должен
+            # обнулять корзину атакуемого аккаунта; отказ тоже освежает ключ, иначе его вытеснят первым
+            if any(level < 1 for level in levels.values()):
+                for key in levels:
+                    if key in self._buckets:
+                        self._buckets.move_to_end(key)
+                return False
+
+            for key, level in levels.items():
+                self._buckets[key] = (level - 1, now)
+                self._buckets.move_to_end(key)
+            while len(self._buckets) > MAX_LOCAL_KEYS:
+                self._buckets.popitem(last=False)
+            return True
+
+    def allow_shared(self, conn, keys: List[str]) -> bool:
+        """Общий лимит для всех контейнеров: один UPSERT на все ключи запроса."""
+        with conn.cursor() as cur:
+            rows = execute_values(
+                cur,
+                """
+                INSERT INTO auth_rate_limits AS b (bucket_key, tokens, capacity, refill_per_second, updated_at)
+                VALUES %s
+                ON CONFLICT (bucket_key) DO UPDATE
+                SET tokens = GREATEST(
+                        LEAST(
+                            b.tokens + EXTRACT(EPOCH FROM NOW() - b.updated_at) * EXCLUDED.refill_per_second,
+                            EXCLUDED.capacity
+                        ) - 1,
+                        -1
+                    ),
+                    capacity = EXCLUDED.capacity,
+                    refill_per_second = EXCLUDED.refill_per_second,
+                    updated_at = NOW()
+                RETURNING tokens
+                """,
+                [(key, self.capacity - 1, self.capacity, self.refill_per_second) for key in keys],
+                template='(%s, %s, %s, %s, NOW())',
+                fetch=True
+            )
+        conn.commit()
+        self.prune_if_due(conn)
+        return all(row[0] >= 0 for row in rows)
+
+    def prune_if_due(self, conn) -> int:
+        with self._lock:
+            if time.monotonic() - self._last_prune < PRUNE_INTERVAL_SECONDS:
+                return 0
+            self._last_prune = time.monotonic()
+        try:
+            return self.prune_shared(conn)
+        except Exception as exc:
+            conn.rollback()
+            print(f'rate limit prune failed, will retry: {exc}')
+            return 0
+
+    def prune_shared(self, conn) -> int:
+        """Удаляет корзины, которые простояли дольше полного пополнения: новая корзина для ключа будет такой же."""
+        # Из -1 до capacity - столько секунд простоя, после которых строка ничего не ограничивает
+        idle_seconds = (self.capacity + 1) / self.refill_per_second
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                DELETE FROM auth_rate_limits
+                WHERE bucket_key IN (
+                    SELECT bucket_key FROM auth_rate_limits
+                    WHERE updated_at < NOW() - make_interval(secs => %s)
+                    ORDER BY updated_at
+                    LIMIT %s
+                )
+                """,
+                (idle_seconds, PRUNE_BATCH)
+            )
+            pruned = cur.rowcount
+        conn.commit()
+        return pruned
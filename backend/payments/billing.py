@@ -0,0 +1,114 @@
+"""
+Business: Платежи и премиум-подписка: идемпотентный приём вебхука по transaction_id с продлением premium_until
+          одним запросом и пакетное снятие истёкших подписок
+Args: курсор или соединение psycopg2; PREMIUM_EXPIRE_BATCH - сколько пользователей снимать за одну транзакцию
+Returns: parse_payment(), ingest() и expire_premium()
+"""
+
+import os
+import re
+from decimal import Decimal, InvalidOperation
+from typing import Any, Dict, Optional, Tuple
+
+from pagination import parse_id
+
+EXPIRE_BATCH = int(os.environ.get('PREMIUM_EXPIRE_BATCH', '1000'))
+MAX_SUBSCRIPTION_MONTHS = 36
+STATUSES = ('pending', 'succeeded', 'canceled')
+CURRENCY_PATTERN = re.compile(r'^[A-Z]{3}$')
+
+# Одна инструкция: вставка платежа или переход pending -> итоговый статус, и продление подписки только
+# если эта доставка перевела платёж в succeeded. Повтор того же вебхука упирается в ON CONFLICT ... WHERE,
+# ничего не возвращает и подписку не трогает; параллельные доставки сериализует уникальный индекс transaction_id
+INGEST_SQL = """
+WITH payment AS (
+    INSERT INTO payments AS p (user_id, amount, currency, payment_method, status, transaction_id, subscription_months)
+    VALUES (%(user_id)s, %(amount)s, %(currency)s, %(payment_method)s, %(status)s, %(transaction_id)s, %(months)s)
+    ON CONFLICT (transaction_id) DO UPDATE
+    SET status = EXCLUDED.status,
+        updated_at = NOW()
+    WHERE p.status = 'pending' AND EXCLUDED.status <> 'pending'
+    RETURNING p.user_id, p.status, p.subscription_months
+),
+extended AS (
+    UPDATE users u
+    SET is_premium = TRUE,
+        subscription_type = 'premium',
+        premium_until = CASE
+            WHEN COALESCE(u.is_premium, FALSE) AND u.premium_until IS NULL THEN NULL
+            ELSE GREATEST(COALESCE(u.premium_until, NOW()), NOW()) + make_interval(months => payment.subscription_months)
+        END
+    FROM payment
+    WHERE u.id = payment.user_id AND payment.status = 'succeeded'
+    RETURNING u.premium_until
+)
+SELECT (SELECT COUNT(*) FROM payment) AS applied, (SELECT premium_until FROM extended) AS premium_until
+"""
+
+
+def parse_payment(body: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    transaction_id = body.get('transaction_id')
+    if not isinstance(transaction_id, str) or not 0 < len(transaction_id) <= 255:
+        return None
+
+    user_id = parse_id(body.get('user_id'))
+    if user_id is None:
+        return None
+
+    try:
+        amount = Decimal(str(body.get('amount')))
+        months = int(body.get('subscription_months', 1))
+    except (TypeError, ValueError, InvalidOperation):
+        return None
+
+    currency = str(body.get('currency') or 'RUB').upper()
+    status = body.get('status')
+    if not amount.is_finite() or amount <= 0 or not 1 <= months <= MAX_SUBSCRIPTION_MONTHS:
+        return None
+    if status not in STATUSES or not CURRENCY_PATTERN.match(currency):
+        return None
+
+    return {
+        'transaction_id': transaction_id,
+        'user_id': user_id,
+        'amount': amount,
+        'currency': currency,
+        'payment_method': str(body.get('payment_method') or '')[:50] or None,
+        'status': status,
+        'months': months,
+    }
+
+
+def ingest(cur, payment: Dict[str, Any]) -> Tuple[bool, Any]:
+    """Возвращает (применён ли вебхук, новый premium_until или None)."""
+    cur.execute(INGEST_SQL, payment)
+    applied, premium_until = cur.fetchone()
+    return bool(applied), premium_until
+
+
+def expire_premium(conn) -> int:
+    # Пачками с SKIP LOCKED: строки, которые сейчас продлевает вебхук, пропускаем до следующего прогона,
+    # повторная проверка premium_until во внешнем WHERE не даёт снять только что продлённую подписку
+    expired = 0
+    while True:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                UPDATE users
+                SET is_premium = FALSE, subscription_type = 'free'
+                WHERE id IN (
+                    SELECT id FROM users
+                    WHERE is_premium AND premium_until < NOW()
+                    ORDER BY premium_until
+                    LIMIT %s
+                    FOR UPDATE SKIP LOCKED
+                )
+                AND is_premium AND premium_until < NOW()
+                """,
+                (EXPIRE_BATCH,)
+            )
+            batch = cur.rowcount
+        conn.commit()
+        expired += batch
+        if batch < EXPIRE_BATCH:
+            return expired
@@ -0,0 +1,148 @@
+"""
+Business: Приём вебхуков платёжного провайдера и снятие истёкших премиум-подписок по расписанию
+Args: event - HTTP событие: вебхук с подписью X-Webhook-Signature (HMAC-SHA256 тела на PAYMENT_WEBHOOK_SECRET)
+      или action=expire_premium с X-Cron-Secret
+      context - контекст с request_id
+Returns: HTTP ответ с результатом приёма платежа или числом снятых подписок
+"""
+
+import hashlib
+import hmac
+import json
+import os
+import secrets
+from typing import Dict, Any
+import psycopg2
+
+import billing
+import db
+import tracing
+
+@tracing.traced
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    method: str = event.get('httpMethod', 'GET')
+    
+    if method == 'OPTIONS':
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Access-Control-Allow-Origin': '*',
+                'Access-Control-Allow-Methods': 'POST, OPTIONS',
+                'Access-Control-Allow-Headers': 'Content-Type, X-Webhook-Signature, X-Cron-Secret',
+                'Access-Control-Max-Age': '86400'
+            },
+            'body': ''
+        }
+    
+    if method != 'POST':
+        return {
+            'statusCode': 405,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': json.dumps({'error': 'Метод не поддерживается'})
+        }
+    
+    headers = event.get('headers') or {}
+    raw_body = event.get('body') or '{}'
+    try:
+        body_data = json.loads(raw_body)
+    except ValueError:
+        body_data = None
+    
+    if not isinstance(body_data, dict):
+        return {
+            'statusCode': 400,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': json.dumps({'error': 'Некорректные данные платежа'})
+        }
+    
+    if body_data.get('action') == 'expire_premium':
+        provided_secret = headers.get('X-Cron-Secret') or headers.get('x-cron-secret') or ''
+        cron_secret = os.environ.get('CRON_SECRET', '')
+        
+        if not cron_secret or not secrets.compare_digest(provided_secret, cron_secret):
+            return {
+                'statusCode': 403,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'body': json.dumps({'error': 'Доступ запрещён'})
+            }
+        
+        with db.connection() as conn:
+            expired = billing.expire_premium(conn)
+        
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': json.dumps({'success': True, 'expired': expired})
+        }
+    
+    # Подпись считается по телу в том виде, в каком его отправил провайдер, до разбора JSON
+    webhook_secret = os.environ.get('PAYMENT_WEBHOOK_SECRET', '')
+    provided_signature = headers.get('X-Webhook-Signature') or headers.get('x-webhook-signature') or ''
+    expected_signature = hmac.new(webhook_secret.encode(), raw_body.encode(), hashlib.sha256).hexdigest()
+    
+    if not webhook_secret or not hmac.compare_digest(provided_signature.lower().encode(), expected_signature.encode()):
+        return {
+            'statusCode': 403,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': json.dumps({'error': 'Доступ запрещён'})
+        }
+    
+    payment = billing.parse_payment(body_data)
+    if payment is None:
+        return {
+            'statusCode': 400,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': json.dumps({'error': 'Некорректные данные платежа'})
+        }
+    
+    with db.connection() as conn:
+        cur = conn.cursor()
+        
+        try:
+            applied, premium_until = billing.ingest(cur, payment)
+        except psycopg2.IntegrityError:
+            conn.rollback()
+            cur.close()
+            return {
+                'statusCode': 404,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'body': json.dumps({'error': 'Пользователь не найден'})
+            }
+        
+        conn.commit()
+        cur.close()
+    
+    # Повторная доставка - тоже 200, иначе провайдер будет слать её снова
+    return {
+        'statusCode': 200,
+        'headers': {
+            'Content-Type': 'application/json',
+            'Access-Control-Allow-Origin': '*'
+        },
+        'body': json.dumps({
+            'success': True,
+            'duplicate': not applied,
+            'premium_until': premium_until.isoformat() if premium_until else None
+        })
+    }
@@ -7,12 +7,32 @@ Returns: HTTP ответ с данными трансляции или спис
 
 import json
 import os
+import re
 import secrets
 from typing import Dict, Any
 from datetime import datetime
-import psycopg2
 from psycopg2.extras import RealDictCursor
 
+import db
+import lifecycle
+from cache import cache_key, respond, responses
+from pagination import decode_cursor, decode_rank_cursor, encode_cursor, encode_rank_cursor, parse_id, parse_limit
+from presence import HEARTBEAT_INTERVAL_SECONDS, PresenceBuffer
+from sessions import authenticate
+import tracing
+
+VIEWER_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{8,48}$')
+
+presence = PresenceBuffer()
+
+def viewer_key_for(user_id, viewer_id) -> str:
+    if user_id:
+        return f'u:{user_id}'
+    if viewer_id and VIEWER_ID_PATTERN.match(str(viewer_id)):
+        return f'a:{viewer_id}'
+    return ''
+
+@tracing.traced
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'GET')
     
@@ -22,128 +42,267 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id',
+                'Access-Control-Allow-Headers': 'Content-Type, X-Auth-Token, Authorization',
                 'Access-Control-Max-Age': '86400'
             },
             'body': ''
         }
     
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    
     if method == 'GET':
-        cur.execute(
-            """
-            SELECT s.*, u.username as channel_name, u.avatar_url as channel_avatar
-            FROM streams s
-            LEFT JOIN users u ON s.user_id = u.id
-            WHERE s.is_live = true
-            ORDER BY s.started_at DESC
-            LIMIT 20
-            """
-        )
-        streams = [dict(row) for row in cur.fetchall()]
+        live_key = cache_key('streams', event.get('queryStringParameters') or {})
+        cached = responses.get(live_key)
+        if cached:
+            return respond(event, cached)
+    
+    with db.connection() as conn:
+        presence.flush_if_due(conn)
         
-        cur.close()
-        conn.close()
+        stale = lifecycle.sweep_if_due(conn)
+        if stale:
+            for stream_id in stale:
+                presence.forget_stream(conn, stream_id)
+            conn.commit()
+            responses.clear()
         
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({'streams': streams}, default=str)
-        }
-    
-    elif method == 'POST':
-        body_data = json.loads(event.get('body', '{}'))
-        action = body_data.get('action')
+        cur = conn.cursor(cursor_factory=RealDictCursor)
         
-        if action == 'start':
-            user_id = body_data.get('user_id')
-            title = body_data.get('title')
-            description = body_data.get('description', '')
+        if method == 'GET':
+            params = event.get('queryStringParameters', {}) or {}
+            by_viewers = params.get('sort') == 'viewers'
+            limit = parse_limit(params.get('limit'), 20, 50)
             
-            stream_key = secrets.token_urlsafe(32)
-            rtmp_url = f"rtmp://stream.cotovideo.ru/live/{stream_key}"
+            try:
+                cursor = (decode_rank_cursor if by_viewers else decode_cursor)(params.get('cursor'))
+            except ValueError:
+                cur.close()
+                return {
+                    'statusCode': 400,
+                    'headers': {
+                        'Content-Type': 'application/json',
+                        'Access-Control-Allow-Origin': '*'
+                    },
+                    'body': json.dumps({'error': 'Неверный курсор'})
+                }
             
-            cur.execute(
-                """
-                INSERT INTO streams (user_id, title, description, stream_key, rtmp_url, is_live, started_at)
-                VALUES (%s, %s, %s, %s, %s, true, NOW())
-                RETURNING id, title, stream_key, rtmp_url, is_live
-                """,
-                (user_id, title, description, stream_key, rtmp_url)
-            )
+            sort_columns = 'viewers_count, stream_id' if by_viewers else 'started_at, stream_id'
+            sort_order = 'viewers_count DESC, stream_id DESC' if by_viewers else 'started_at DESC, stream_id DESC'
+            query = """
+                SELECT stream_id AS id, user_id, title, thumbnail_url, channel_name, channel_avatar,
+                       viewers_count, started_at, true AS is_live
+                FROM live_streams
+            """
+            query_params: list = []
+            if cursor:
+                query += f" WHERE ({sort_columns}) < (%s, %s)"
+                query_params.extend(cursor)
+            query += f" ORDER BY {sort_order} LIMIT %s"
+            query_params.append(limit + 1)
             
-            stream = dict(cur.fetchone())
-            conn.commit()
+            cur.execute(query, query_params)
+            rows = [dict(row) for row in cur.fetchall()]
+            streams = rows[:limit]
+            
+            next_cursor = None
+            if len(rows) > limit:
+                last = streams[-1]
+                if by_viewers:
+                    next_cursor = encode_rank_cursor(last['viewers_count'], last['id'])
+                else:
+                    next_cursor = encode_cursor(last['started_at'], last['id'])
             
             cur.close()
-            conn.close()
             
-            return {
-                'statusCode': 200,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'body': json.dumps({
-                    'success': True,
-                    'stream': stream
-                }, default=str)
-            }
+            with tracing.phase('serialize'):
+                body = json.dumps({'streams': streams, 'next_cursor': next_cursor}, default=str)
+            return respond(event, responses.put(live_key, body))
         
-        elif action == 'stop':
-            stream_id = body_data.get('stream_id')
+        elif method == 'POST':
+            try:
+                callback = lifecycle.parse_callback(event)
+            except ValueError:
+                cur.close()
+                return {
+                    'statusCode': 400,
+                    'headers': {
+                        'Content-Type': 'application/json',
+                        'Access-Control-Allow-Origin': '*'
+                    },
+                    'body': json.dumps({'code': 400, 'error': 'Некорректное тело запроса'})
+                }
             
-            cur.execute(
-                "UPDATE streams SET is_live = false, ended_at = NOW() WHERE id = %s",
-                (stream_id,)
-            )
-            conn.commit()
+            if callback:
+                cur.close()
+                headers = event.get('headers') or {}
+                params = event.get('queryStringParameters', {}) or {}
+                provided_secret = headers.get('X-Ingest-Secret') or headers.get('x-ingest-secret') or params.get('secret') or ''
+                ingest_secret = os.environ.get('INGEST_SECRET', '')
+                
+                if not ingest_secret or not secrets.compare_digest(provided_secret, ingest_secret):
+                    return {
+                        'statusCode': 403,
+                        'headers': {
+                            'Content-Type': 'application/json',
+                            'Access-Control-Allow-Origin': '*'
+                        },
+                        'body': json.dumps({'code': 403, 'error': 'Доступ запрещён'})
+                    }
+                
+                with conn.cursor() as ingest_cur:
+                    stream_id = lifecycle.lookup(ingest_cur, callback['stream_key'])
+                    allowed = stream_id is not None
+                    
+                    if allowed and callback['call'] == 'publish':
+                        allowed = lifecycle.go_live(ingest_cur, stream_id)
+                    elif allowed and callback['call'] == 'heartbeat':
+                        allowed = lifecycle.heartbeat(ingest_cur, stream_id)
+                    elif allowed and lifecycle.end_streams(ingest_cur, [stream_id]):
+                        presence.forget_stream(conn, stream_id)
+                conn.commit()
+                
+                if callback['call'] != 'heartbeat':
+                    responses.clear()
+                
+                if not allowed:
+                    return {
+                        'statusCode': 403,
+                        'headers': {
+                            'Content-Type': 'application/json',
+                            'Access-Control-Allow-Origin': '*'
+                        },
+                        'body': json.dumps({'code': 403, 'error': 'Публикация запрещена'})
+                    }
+                
+                return {
+                    'statusCode': 200,
+                    'headers': {
+                        'Content-Type': 'application/json',
+                        'Access-Control-Allow-Origin': '*'
+                    },
+                    'body': json.dumps({'code': 0})
+                }
             
-            cur.close()
-            conn.close()
+            body_data = json.loads(event.get('body', '{}'))
+            action = body_data.get('action')
+            session = authenticate(event, conn)
+            user_id = session['uid'] if session else None
             
-            return {
-                'statusCode': 200,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'body': json.dumps({'success': True})
-            }
-        
-        elif action == 'join':
-            stream_id = body_data.get('stream_id')
-            user_id = body_data.get('user_id')
+            if action in ('start', 'stop') and not user_id:
+                cur.close()
+                return {
+                    'statusCode': 401,
+                    'headers': {
+                        'Content-Type': 'application/json',
+                        'Access-Control-Allow-Origin': '*'
+                    },
+                    'body': json.dumps({'error': 'Необходима авторизация'})
+                }
             
-            cur.execute(
-                "INSERT INTO stream_viewers (stream_id, user_id) VALUES (%s, %s) ON CONFLICT DO NOTHING",
-                (stream_id, user_id)
-            )
-            cur.execute(
-                "UPDATE streams SET viewers_count = viewers_count + 1 WHERE id = %s",
-                (stream_id,)
-            )
-            conn.commit()
+            if action == 'start':
+                title = body_data.get('title')
+                description = body_data.get('description', '')
+                
+                stream_key = secrets.token_urlsafe(32)
+                rtmp_url = f"rtmp://stream.cotovideo.ru/live/{stream_key}"
+                
+                cur.execute(
+                    """
+                    INSERT INTO streams (user_id, title, description, stream_key, rtmp_url, is_live, started_at)
+                    VALUES (%s, %s, %s, %s, %s, true, NOW())
+                    RETURNING id, title, stream_key, rtmp_url, is_live
+                    """,
+                    (user_id, title, description, stream_key, rtmp_url)
+                )
+                
+                stream = dict(cur.fetchone())
+                lifecycle.add_to_directory(cur, stream['id'])
+                conn.commit()
+                responses.clear()
+                
+                cur.close()
+                
+                return {
+                    'statusCode': 200,
+                    'headers': {
+                        'Content-Type': 'application/json',
+                        'Access-Control-Allow-Origin': '*'
+                    },
+                    'body': json.dumps({
+                        'success': True,
+                        'stream': stream
+                    }, default=str)
+                }
             
-            cur.close()
-            conn.close()
+            elif action == 'stop':
+                stream_id = parse_id(body_data.get('stream_id'))
+                
+                if stream_id is None:
+                    cur.close()
+                    return {
+                        'statusCode': 400,
+                        'headers': {
+                            'Content-Type': 'application/json',
+                            'Access-Control-Allow-Origin': '*'
+                        },
+                        'body': json.dumps({'error': 'Неверный id трансляции'})
+                    }
+                
+                if lifecycle.stop_stream(cur, stream_id, user_id):
+                    presence.forget_stream(conn, stream_id)
+                conn.commit()
+                responses.clear()
+                
+                cur.close()
+                
+                return {
+                    'statusCode': 200,
+                    'headers': {
+                        'Content-Type': 'application/json',
+                        'Access-Control-Allow-Origin': '*'
+                    },
+                    'body': json.dumps({'success': True})
+                }
             
-            return {
-                'statusCode': 200,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'body': json.dumps({'success': True})
-            }
-    
-    cur.close()
-    conn.close()
+            elif action in ('join', 'heartbeat', 'leave'):
+                cur.close()
+                
+                stream_id = parse_id(body_data.get('stream_id'))
+                
+                viewer_id = body_data.get('viewer_id')
+                if action == 'join' and not user_id and not viewer_id:
+                    viewer_id = secrets.token_urlsafe(16)
+                viewer_key = viewer_key_for(user_id, viewer_id)
+                
+                if stream_id is None or not viewer_key:
+                    return {
+                        'statusCode': 400,
+                        'headers': {
+                            'Content-Type': 'application/json',
+                            'Access-Control-Allow-Origin': '*'
+                        },
+                        'body': json.dumps({'error': 'Не указана трансляция или зритель'})
+                    }
+                
+                if action == 'join':
+                    presence.join(stream_id, viewer_key, user_id)
+                elif action == 'heartbeat':
+                    presence.heartbeat(stream_id, viewer_key)
+                else:
+                    presence.leave(stream_id, viewer_key)
+                
+                return {
+                    'statusCode': 200,
+                    'headers': {
+                        'Content-Type': 'application/json',
+                        'Access-Control-Allow-Origin': '*'
+                    },
+                    'body': json.dumps({
+                        'success': True,
+                        'viewer_id': None if user_id else viewer_id,
+                        'heartbeat_interval': HEARTBEAT_INTERVAL_SECONDS
+                    })
+                }
+        
+        cur.close()
     
     return {
         'statusCode': 405,
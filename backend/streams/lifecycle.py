@@ -0,0 +1,249 @@
+"""
+Business: Жизненный цикл трансляций для RTMP-сервера: разбор колбэков on_publish/on_publish_done/heartbeat
+          (nginx-rtmp и SRS), кэш stream_key -> id, поддержка каталога live_streams и снятие зависших эфиров
+Args: STREAM_STALE_AFTER - секунд без heartbeat до снятия эфира, STREAM_PUBLISH_GRACE - сколько ждать первую
+      публикацию после start (только когда задан INGEST_SECRET и RTMP-сервер шлёт колбэки; без него эфир
+      из интерфейса живёт до action=stop), STREAM_RESUME_WINDOW - в течение скольких секунд после обрыва
+      можно переподключиться (остановленный автором эфир не возобновляется)
+Returns: parse_callback(), stream_keys, go_live(), heartbeat(), end_streams(), stop_stream(), sweep_if_due()
+"""
+
+import base64
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs
+
+STALE_AFTER_SECONDS = int(os.environ.get('STREAM_STALE_AFTER', '90'))
+PUBLISH_GRACE_SECONDS = int(os.environ.get('STREAM_PUBLISH_GRACE', '600'))
+RESUME_WINDOW_SECONDS = int(os.environ.get('STREAM_RESUME_WINDOW', '600'))
+HEARTBEAT_WRITE_INTERVAL = float(os.environ.get('STREAM_HEARTBEAT_WRITE_INTERVAL', '15'))
+SWEEP_INTERVAL_SECONDS = float(os.environ.get('STREAM_SWEEP_INTERVAL', '30'))
+KEY_CACHE_TTL = float(os.environ.get('STREAM_KEY_CACHE_TTL', '60'))
+KEY_CACHE_NEGATIVE_TTL = 5.0
+KEY_CACHE_MAX_ENTRIES = int(os.environ.get('STREAM_KEY_CACHE_MAX_ENTRIES', '10000'))
+
+CALLS = {
+    'publish': 'publish',
+    'on_publish': 'publish',
+    'publish_done': 'publish_done',
+    'on_publish_done': 'publish_done',
+    'on_unpublish': 'publish_done',
+    'update_publish': 'heartbeat',
+    'on_heartbeat': 'heartbeat',
+}
+
+
+def parse_callback(event: Dict[str, Any]) -> Optional[Dict[str, str]]:
+    """None - это не колбэк RTMP-сервера; ValueError - тело с isBase64Encoded не декодируется."""
+    headers = event.get('headers') or {}
+    content_type = (headers.get('Content-Type') or headers.get('content-type') or '').lower()
+    raw = event.get('body') or ''
+    if event.get('isBase64Encoded'):
+        # binascii.Error и UnicodeDecodeError - подклассы ValueError
+        raw = base64.b64decode(raw, validate=True).decode()
+
+    if 'application/x-www-form-urlencoded' in content_type:
+        fields = {name: values[0] for name, values in parse_qs(raw).items()}
+        call, stream_key = fields.get('call'), fields.get('name')
+    else:
+        try:
+            fields = json.loads(raw or '{}')
+        except ValueError:
+            return None
+        if not isinstance(fields, dict):
+            return None
+        call, stream_key = fields.get('action'), fields.get('stream') or fields.get('stream_key')
+
+    call = CALLS.get(call or '')
+    if not call:
+        return None
+    return {'call': call, 'stream_key': str(stream_key or '')}
+
+
+class StreamKeyCache:
+    def __init__(self, ttl_seconds: float, negative_ttl_seconds: float, max_entries: int):
+        self.ttl_seconds = ttl_seconds
+        self.negative_ttl_seconds = negative_ttl_seconds
+        self.max_entries = max_entries
+        self._entries: 'OrderedDict[str, Tuple[float, Optional[int]]]' = OrderedDict()
+        self._heartbeats: Dict[int, float] = {}
+        self._lock = threading.Lock()
+
+    def get(self, stream_key: str) -> Tuple[bool, Optional[int]]:
+        with self._lock:
+            entry = self._entries.get(stream_key)
+            if entry is None:
+                return False, None
+            expires_at, stream_id = entry
+            if expires_at < time.monotonic():
+                del self._entries[stream_key]
+                return False, None
+            self._entries.move_to_end(stream_key)
+            return True, stream_id
+
+    def put(self, stream_key: str, stream_id: Optional[int]) -> None:
+        ttl = self.ttl_seconds if stream_id is not None else self.negative_ttl_seconds
+        with self._lock:
+            self._entries[stream_key] = (time.monotonic() + ttl, stream_id)
+            self._entries.move_to_end(stream_key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def discard(self, stream_key: str) -> None:
+        with self._lock:
+            self._entries.pop(stream_key, None)
+
+    def heartbeat_due(self, stream_id: int) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            if now - self._heartbeats.get(stream_id, 0.0) < HEARTBEAT_WRITE_INTERVAL:
+                return False
+            self._heartbeats[stream_id] = now
+            return True
+
+    def forget_heartbeats(self, stream_ids: List[int]) -> None:
+        with self._lock:
+            for stream_id in stream_ids:
+                self._heartbeats.pop(stream_id, None)
+
+
+stream_keys = StreamKeyCache(KEY_CACHE_TTL, KEY_CACHE_NEGATIVE_TTL, KEY_CACHE_MAX_ENTRIES)
+_last_sweep = 0.0
+_sweep_lock = threading.Lock()
+
+
+def lookup(cur, stream_key: str) -> Optional[int]:
+    if not stream_key:
+        return None
+    hit, stream_id = stream_keys.get(stream_key)
+    if hit:
+        return stream_id
+
+    cur.execute("SELECT id FROM streams WHERE stream_key = %s", (stream_key,))
+    row = cur.fetchone()
+    stream_id = row[0] if row else None
+    stream_keys.put(stream_key, stream_id)
+    return stream_id
+
+
+def add_to_directory(cur, stream_id: int) -> None:
+    cur.execute(
+        """
+        INSERT INTO live_streams
+        (stream_id, user_id, title, thumbnail_url, channel_name, channel_avatar, viewers_count, started_at)
+        SELECT s.id, s.user_id, s.title, s.thumbnail_url, u.username, u.avatar_url,
+               COALESCE(s.viewers_count, 0), s.started_at
+        FROM streams s
+        LEFT JOIN users u ON s.user_id = u.id
+        WHERE s.id = %s AND s.is_live = true
+        ON CONFLICT (stream_id) DO NOTHING
+        """,
+        (stream_id,)
+    )
+
+
+def go_live(cur, stream_id: int) -> bool:
+    cur.execute(
+        """
+        UPDATE streams
+        SET is_live = true,
+            ended_at = NULL,
+            started_at = COALESCE(started_at, NOW()),
+            last_heartbeat_at = NOW()
+        WHERE id = %s
+          AND NOT stopped_by_user
+          AND (ended_at IS NULL OR ended_at > NOW() - make_interval(secs => %s))
+        """,
+        (stream_id, RESUME_WINDOW_SECONDS)
+    )
+    if not cur.rowcount:
+        return False
+    add_to_directory(cur, stream_id)
+    return True
+
+
+def heartbeat(cur, stream_id: int) -> bool:
+    if not stream_keys.heartbeat_due(stream_id):
+        # Запись ещё не нужна, но эфир мог остановить автор или снять sweep в другом контейнере:
+        # чтение по первичному ключу дешевле записи, а неживой эфир идёт по обычному пути через go_live
+        cur.execute("SELECT is_live FROM streams WHERE id = %s", (stream_id,))
+        row = cur.fetchone()
+        if row and row[0]:
+            return True
+    cur.execute(
+        "UPDATE streams SET last_heartbeat_at = NOW() WHERE id = %s AND is_live = true",
+        (stream_id,)
+    )
+    if cur.rowcount:
+        return True
+    return go_live(cur, stream_id)
+
+
+def end_streams(cur, stream_ids: List[int]) -> List[int]:
+    if not stream_ids:
+        return []
+    cur.execute(
+        "UPDATE streams SET is_live = false, ended_at = NOW() WHERE id = ANY(%s) AND is_live = true RETURNING id",
+        (stream_ids,)
+    )
+    ended = [row[0] for row in cur.fetchall()]
+    cur.execute("DELETE FROM live_streams WHERE stream_id = ANY(%s)", (stream_ids,))
+    stream_keys.forget_heartbeats(stream_ids)
+    return ended
+
+
+def stop_stream(cur, stream_id: int, user_id: int) -> bool:
+    cur.execute(
+        """
+        UPDATE streams
+        SET is_live = false, ended_at = COALESCE(ended_at, NOW()), stopped_by_user = true
+        WHERE id = %s AND user_id = %s
+        """,
+        (stream_id, user_id)
+    )
+    if not cur.rowcount:
+        return False
+    cur.execute("DELETE FROM live_streams WHERE stream_id = %s", (stream_id,))
+    stream_keys.forget_heartbeats([stream_id])
+    return True
+
+
+def sweep_due() -> bool:
+    return time.monotonic() - _last_sweep >= SWEEP_INTERVAL_SECONDS
+
+
+def sweep_stale(conn) -> List[int]:
+    global _last_sweep
+    with _sweep_lock:
+        _last_sweep = time.monotonic()
+
+    # Без INGEST_SECRET колбэков от RTMP-сервера не бывает: эфиры без heartbeat по сроку публикации не снимаем
+    ingest_enabled = bool(os.environ.get('INGEST_SECRET'))
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT id FROM streams
+            WHERE is_live = true
+              AND (last_heartbeat_at + make_interval(secs => %s) < NOW()
+                   OR (%s AND last_heartbeat_at IS NULL AND started_at + make_interval(secs => %s) < NOW()))
+            """,
+            (STALE_AFTER_SECONDS, ingest_enabled, PUBLISH_GRACE_SECONDS)
+        )
+        ended = end_streams(cur, [row[0] for row in cur.fetchall()])
+    conn.commit()
+    return ended
+
+
+def sweep_if_due(conn) -> List[int]:
+    if not sweep_due():
+        return []
+    try:
+        return sweep_stale(conn)
+    except Exception as exc:
+        conn.rollback()
+        print(f'stale stream sweep failed, will retry: {exc}')
+        return []
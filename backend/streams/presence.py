@@ -0,0 +1,178 @@
+"""
+Business: Присутствие зрителей трансляций: join/heartbeat/leave копятся в памяти контейнера
+          и пачкой сбрасываются в нежурналируемую таблицу stream_presence, streams.viewers_count
+          и каталог live_streams
+Args: PRESENCE_TTL - через сколько секунд без heartbeat зритель считается ушедшим,
+      PRESENCE_FLUSH_INTERVAL - максимум секунд между сбросами, PRESENCE_FLUSH_MAX_EVENTS - размер буфера
+Returns: объект PresenceBuffer
+"""
+
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, Set, Tuple
+from psycopg2.extras import execute_values
+
+from pagination import parse_id
+
+PRESENCE_TTL_SECONDS = int(os.environ.get('PRESENCE_TTL', '45'))
+HEARTBEAT_INTERVAL_SECONDS = max(5, PRESENCE_TTL_SECONDS // 3)
+FLUSH_INTERVAL_SECONDS = float(os.environ.get('PRESENCE_FLUSH_INTERVAL', '3'))
+MAX_EVENTS = int(os.environ.get('PRESENCE_FLUSH_MAX_EVENTS', '2000'))
+SWEEP_INTERVAL_SECONDS = float(os.environ.get('PRESENCE_SWEEP_INTERVAL', '15'))
+
+
+class PresenceBuffer:
+    def __init__(self):
+        self._seen: Dict[Tuple[int, str], datetime] = {}
+        self._left: Set[Tuple[int, str]] = set()
+        self._joined_users: Set[Tuple[int, int]] = set()
+        self._oldest_at = 0.0
+        self._last_sweep = 0.0
+        self._lock = threading.Lock()
+
+    def _touch(self) -> None:
+        if not self._seen and not self._left:
+            self._oldest_at = time.monotonic()
+
+    def join(self, stream_id: int, viewer_key: str, user_id) -> None:
+        with self._lock:
+            self._touch()
+            key = (int(stream_id), viewer_key)
+            self._left.discard(key)
+            self._seen[key] = datetime.now(timezone.utc)
+            if user_id:
+                self._joined_users.add((int(stream_id), int(user_id)))
+
+    def heartbeat(self, stream_id: int, viewer_key: str) -> None:
+        with self._lock:
+            self._touch()
+            key = (int(stream_id), viewer_key)
+            if key not in self._left:
+                self._seen[key] = datetime.now(timezone.utc)
+
+    def leave(self, stream_id: int, viewer_key: str) -> None:
+        with self._lock:
+            self._touch()
+            key = (int(stream_id), viewer_key)
+            self._seen.pop(key, None)
+            self._left.add(key)
+
+    def due(self) -> bool:
+        with self._lock:
+            now = time.monotonic()
+            pending = len(self._seen) + len(self._left)
+            if pending and (pending >= MAX_EVENTS or now - self._oldest_at >= FLUSH_INTERVAL_SECONDS):
+                return True
+            return now - self._last_sweep >= SWEEP_INTERVAL_SECONDS
+
+    def flush(self, conn) -> int:
+        with self._lock:
+            seen, left, joined = self._seen, self._left, self._joined_users
+            self._seen, self._left, self._joined_users = {}, set(), set()
+            sweep = time.monotonic() - self._last_sweep >= SWEEP_INTERVAL_SECONDS
+            if sweep:
+                self._last_sweep = time.monotonic()
+
+        touched = {stream_id for stream_id, _ in seen} | {stream_id for stream_id, _ in left}
+
+        try:
+            with conn.cursor() as cur:
+                if seen:
+                    execute_values(
+                        cur,
+                        """INSERT INTO stream_presence (stream_id, viewer_key, last_seen)
+                           SELECT v.stream_id, v.viewer_key, v.last_seen
+                           FROM (VALUES %s) AS v(stream_id, viewer_key, last_seen)
+                           JOIN streams s ON s.id = v.stream_id AND s.is_live = true
+                           ON CONFLICT (stream_id, viewer_key)
+                           DO UPDATE SET last_seen = GREATEST(stream_presence.last_seen, EXCLUDED.last_seen)""",
+                        sorted((stream_id, viewer_key, seen_at) for (stream_id, viewer_key), seen_at in seen.items()),
+                        template='(%s, %s, %s AT TIME ZONE \'UTC\')',
+                        page_size=1000
+                    )
+                if left:
+                    execute_values(
+                        cur,
+                        """DELETE FROM stream_presence p
+                           USING (VALUES %s) AS l(stream_id, viewer_key)
+                           WHERE p.stream_id = l.stream_id AND p.viewer_key = l.viewer_key""",
+                        sorted(left),
+                        page_size=1000
+                    )
+                if joined:
+                    execute_values(
+                        cur,
+                        """INSERT INTO stream_viewers (stream_id, user_id)
+                           SELECT v.stream_id, v.user_id
+                           FROM (VALUES %s) AS v(stream_id, user_id)
+                           JOIN streams s ON s.id = v.stream_id
+                           ON CONFLICT DO NOTHING""",
+                        sorted(joined),
+                        page_size=1000
+                    )
+                if sweep:
+                    cur.execute(
+                        """WITH expired AS (
+                               DELETE FROM stream_presence
+                               WHERE last_seen < (NOW() AT TIME ZONE 'UTC') - make_interval(secs => %s)
+                               RETURNING stream_id
+                           )
+                           SELECT DISTINCT stream_id FROM expired""",
+                        (PRESENCE_TTL_SECONDS,)
+                    )
+                    touched.update(row[0] for row in cur.fetchall())
+                if touched:
+                    cur.execute(
+                        """WITH counts AS (
+                               SELECT t.id, COUNT(p.viewer_key) AS viewers
+                               FROM unnest(%s::int[]) AS t(id)
+                               LEFT JOIN stream_presence p
+                                      ON p.stream_id = t.id
+                                     AND p.last_seen >= (NOW() AT TIME ZONE 'UTC') - make_interval(secs => %s)
+                               GROUP BY t.id
+                           ), updated AS (
+                               UPDATE streams s SET viewers_count = c.viewers
+                               FROM counts c
+                               WHERE s.id = c.id AND s.is_live = true AND s.viewers_count IS DISTINCT FROM c.viewers
+                               RETURNING s.id, s.viewers_count
+                           )
+                           UPDATE live_streams l SET viewers_count = u.viewers_count
+                           FROM updated u
+                           WHERE l.stream_id = u.id""",
+                        (sorted(touched), PRESENCE_TTL_SECONDS)
+                    )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            # Назад в буфер - только ключи с допустимым int4 id: ключ, который база не примет никогда,
+            # иначе ломал бы каждый следующий сброс и подсчёт зрителей во всём контейнере
+            seen = {key: seen_at for key, seen_at in seen.items() if parse_id(key[0]) is not None}
+            left = {key for key in left if parse_id(key[0]) is not None}
+            joined = {key for key in joined if parse_id(key[0]) is not None and parse_id(key[1]) is not None}
+            with self._lock:
+                for key, seen_at in seen.items():
+                    if key not in self._left:
+                        self._seen[key] = max(seen_at, self._seen.get(key, seen_at))
+                self._left |= left - set(self._seen)
+                self._joined_users |= joined
+            raise
+
+        return len(touched)
+
+    def flush_if_due(self, conn) -> int:
+        if not self.due():
+            return 0
+        try:
+            return self.flush(conn)
+        except Exception as exc:
+            print(f'presence flush failed, will retry: {exc}')
+            return 0
+
+    def forget_stream(self, conn, stream_id: int) -> None:
+        with self._lock:
+            self._seen = {key: seen_at for key, seen_at in self._seen.items() if key[0] != stream_id}
+            self._left = {key for key in self._left if key[0] != stream_id}
+        with conn.cursor() as cur:
+            cur.execute("DELETE FROM stream_presence WHERE stream_id = %s", (stream_id,))
@@ -0,0 +1,143 @@
+"""
+Business: Подписанные сессионные токены (HMAC) и их проверка без похода в базу
+Args: SESSION_SECRET - ключ подписи, SESSION_TTL - срок жизни токена в секундах,
+      REVOCATION_CACHE_TTL - как часто перечитывать список отозванных токенов; обработчик, уже держащий
+      соединение из пула, передаёт его в authenticate(), чтобы запрос не брал второе
+Returns: issue_token(), verify_token(), authenticate(event, conn) и revoke()
+"""
+
+import base64
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional, Set
+
+import psycopg2
+
+import db
+
+SESSION_TTL_SECONDS = int(os.environ.get('SESSION_TTL', str(7 * 24 * 3600)))
+REVOCATION_CACHE_TTL = float(os.environ.get('REVOCATION_CACHE_TTL', '30'))
+REVOCATION_PRUNE_BATCH = 1000
+
+_revoked: Set[str] = set()
+_revoked_loaded_at = 0.0
+_revoked_lock = threading.Lock()
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).decode().rstrip('=')
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+
+
+def _sign(payload: str) -> str:
+    secret = os.environ.get('SESSION_SECRET', '')
+    if not secret:
+        raise RuntimeError('SESSION_SECRET is not configured')
+    return _b64encode(hmac.new(secret.encode(), payload.encode(), hashlib.sha256).digest())
+
+
+def issue_token(user_id: int, is_premium: bool = False, premium_until: Optional[datetime] = None) -> str:
+    # Срок сессии не зависит от подписки: окончание премиума - отдельный claim prem_until (None - бессрочно),
+    # его сверяют с текущим временем там, где нужен доступ
+    expires_at = int(time.time()) + SESSION_TTL_SECONDS
+    prem_until = None
+    if is_premium and premium_until is not None:
+        if premium_until.tzinfo is None:
+            premium_until = premium_until.replace(tzinfo=timezone.utc)
+        prem_until = int(premium_until.timestamp())
+
+    claims = {'uid': int(user_id), 'exp': expires_at, 'prem': bool(is_premium), 'prem_until': prem_until,
+              'jti': secrets.token_hex(16)}
+    payload = _b64encode(json.dumps(claims, separators=(',', ':')).encode())
+    return f'v1.{payload}.{_sign(payload)}'
+
+
+def _load_revoked(conn) -> Set[str]:
+    # Чужое соединение: читаем в точке сохранения, чтобы ошибка не оборвала транзакцию обработчика
+    with conn.cursor() as cur:
+        cur.execute('SAVEPOINT revoked_sessions_reload')
+        try:
+            cur.execute("SELECT jti FROM revoked_sessions WHERE expires_at > NOW()")
+            jtis = {row[0] for row in cur.fetchall()}
+        except psycopg2.Error:
+            cur.execute('ROLLBACK TO SAVEPOINT revoked_sessions_reload')
+            raise
+        cur.execute('RELEASE SAVEPOINT revoked_sessions_reload')
+    return jtis
+
+
+def _revoked_jtis(conn=None) -> Set[str]:
+    global _revoked, _revoked_loaded_at
+    if time.monotonic() - _revoked_loaded_at < REVOCATION_CACHE_TTL:
+        return _revoked
+
+    with _revoked_lock:
+        if time.monotonic() - _revoked_loaded_at >= REVOCATION_CACHE_TTL:
+            try:
+                if conn is not None:
+                    _revoked = _load_revoked(conn)
+                else:
+                    with db.connection() as own_conn:
+                        _revoked = _load_revoked(own_conn)
+                        own_conn.rollback()
+            except (psycopg2.Error, db.PoolExhausted) as exc:
+                # База недоступна - работаем по прежнему списку до следующей попытки через TTL
+                print(f'revoked sessions reload failed, using cached list: {exc}')
+            _revoked_loaded_at = time.monotonic()
+    return _revoked
+
+
+def verify_token(token: Optional[str], conn=None) -> Optional[Dict[str, Any]]:
+    if not token or not os.environ.get('SESSION_SECRET'):
+        return None
+    try:
+        version, payload, signature = token.split('.')
+        if version != 'v1' or not hmac.compare_digest(signature.encode(), _sign(payload).encode()):
+            return None
+        claims = json.loads(_b64decode(payload))
+    except ValueError:
+        return None
+
+    if not isinstance(claims, dict) or claims.get('exp', 0) < time.time():
+        return None
+    if claims.get('jti') in _revoked_jtis(conn):
+        return None
+    return claims
+
+
+def authenticate(event: Dict[str, Any], conn=None) -> Optional[Dict[str, Any]]:
+    headers = event.get('headers') or {}
+    token = headers.get('X-Auth-Token') or headers.get('x-auth-token')
+    if not token:
+        authorization = headers.get('Authorization') or headers.get('authorization') or ''
+        if authorization.startswith('Bearer '):
+            token = authorization[len('Bearer '):]
+    return verify_token(token, conn)
+
+
+def revoke(conn, claims: Dict[str, Any]) -> None:
+    with conn.cursor() as cur:
+        cur.execute(
+            """INSERT INTO revoked_sessions (jti, user_id, expires_at)
+               VALUES (%s, %s, to_timestamp(%s) AT TIME ZONE 'UTC')
+               ON CONFLICT (jti) DO NOTHING""",
+            (claims['jti'], claims['uid'], claims['exp'])
+        )
+        # Истёкшие записи больше ничего не отзывают: чистим порциями по idx_revoked_sessions_expires_at
+        cur.execute(
+            """DELETE FROM revoked_sessions
+               WHERE jti IN (SELECT jti FROM revoked_sessions WHERE expires_at < NOW() LIMIT %s)""",
+            (REVOCATION_PRUNE_BATCH,)
+        )
+    conn.commit()
+    with _revoked_lock:
+        _revoked.add(claims['jti'])
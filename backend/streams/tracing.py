@@ -0,0 +1,212 @@
+"""
+Business: Трассировка запроса: время SQL-запросов (курсор psycopg2), именованные фазы (db_acquire, s3, smtp,
+          serialize), заголовок Server-Timing и одна JSON-строка лога на запрос с context.request_id
+Args: TRACE_SLOW_QUERY_MS - порог медленного запроса, TRACE_EXPLAIN_SAMPLE - доля медленных SELECT,
+      для которых снимается EXPLAIN (ANALYZE, BUFFERS) (0 - выключено), TRACE_LOG - писать ли строку лога
+Returns: декоратор traced для handler, контекстный менеджер phase(), TracingConnection для psycopg2.connect,
+         instrument_boto() для клиентов boto3 и last() - трасса последнего запроса в потоке
+"""
+
+import functools
+import json
+import os
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+import psycopg2
+import psycopg2.extensions
+
+SLOW_QUERY_MS = float(os.environ.get('TRACE_SLOW_QUERY_MS', '200'))
+EXPLAIN_SAMPLE = float(os.environ.get('TRACE_EXPLAIN_SAMPLE', '0'))
+LOG_ENABLED = os.environ.get('TRACE_LOG', 'true').lower() == 'true'
+MAX_SLOW_QUERIES = 5
+STATEMENT_PREVIEW = 300
+
+_local = threading.local()
+
+
+class Trace:
+    def __init__(self, request_id: str):
+        self.request_id = request_id
+        self.started = time.perf_counter()
+        self.duration_ms = 0.0
+        self.phases: Dict[str, float] = {}
+        self.query_count = 0
+        self.query_ms = 0.0
+        self.rows = 0
+        self.slow_queries: List[Dict[str, Any]] = []
+
+    def add_phase(self, name: str, elapsed_ms: float) -> None:
+        self.phases[name] = self.phases.get(name, 0.0) + elapsed_ms
+
+    def add_query(self, cursor, elapsed_ms: float) -> None:
+        self.query_count += 1
+        self.query_ms += elapsed_ms
+        self.rows += max(cursor.rowcount, 0)
+        if elapsed_ms < SLOW_QUERY_MS or len(self.slow_queries) >= MAX_SLOW_QUERIES:
+            return
+
+        statement = _statement(cursor)
+        slow: Dict[str, Any] = {
+            'ms': round(elapsed_ms, 2),
+            'rows': cursor.rowcount,
+            'statement': re.sub(r'\s+', ' ', statement)[:STATEMENT_PREVIEW],
+        }
+        if EXPLAIN_SAMPLE and random.random() < EXPLAIN_SAMPLE and not cursor.name:
+            plan = _explain(cursor.connection, statement)
+            if plan:
+                slow['plan'] = plan
+        self.slow_queries.append(slow)
+
+    def server_timing(self) -> str:
+        entries = [f'total;dur={self.duration_ms:.1f}',
+                   f'db;dur={self.query_ms:.1f};desc="{self.query_count} queries"']
+        entries.extend(f'{name};dur={elapsed:.1f}' for name, elapsed in self.phases.items())
+        return ', '.join(entries)
+
+    def to_log(self) -> Dict[str, Any]:
+        return {
+            'request_id': self.request_id,
+            'duration_ms': round(self.duration_ms, 2),
+            'queries': self.query_count,
+            'query_ms': round(self.query_ms, 2),
+            'rows': self.rows,
+            'phases': {name: round(elapsed, 2) for name, elapsed in self.phases.items()},
+            'slow_queries': self.slow_queries,
+        }
+
+
+def _statement(cursor) -> str:
+    query = cursor.query
+    if isinstance(query, bytes):
+        return query.decode('utf-8', 'replace')
+    return query or ''
+
+
+def _explain(conn, statement: str) -> Optional[str]:
+    # EXPLAIN ANALYZE выполняет запрос повторно, поэтому только чтение и только внутри точки сохранения
+    if not re.match(r'\s*(SELECT|WITH)\b', statement, re.IGNORECASE):
+        return None
+    if conn.get_transaction_status() not in (psycopg2.extensions.TRANSACTION_STATUS_IDLE,
+                                              psycopg2.extensions.TRANSACTION_STATUS_INTRANS):
+        return None
+    cur = psycopg2.extensions.cursor(conn)
+    try:
+        cur.execute('SAVEPOINT trace_explain')
+        try:
+            cur.execute('EXPLAIN (ANALYZE, BUFFERS) ' + statement)
+            return '\n'.join(row[0] for row in cur.fetchall())
+        finally:
+            cur.execute('ROLLBACK TO SAVEPOINT trace_explain')
+    except psycopg2.Error:
+        return None
+    finally:
+        cur.close()
+
+
+def current() -> Optional[Trace]:
+    return getattr(_local, 'trace', None)
+
+
+def last() -> Optional[Trace]:
+    return getattr(_local, 'last', None)
+
+
+@contextmanager
+def phase(name: str) -> Iterator[None]:
+    trace = current()
+    if trace is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add_phase(name, (time.perf_counter() - started) * 1000)
+
+
+def _tracing(factory: type) -> type:
+    class TracingCursor(factory):
+        def execute(self, query, vars=None):
+            trace = current()
+            if trace is None:
+                return super().execute(query, vars)
+            started = time.perf_counter()
+            try:
+                return super().execute(query, vars)
+            finally:
+                trace.add_query(self, (time.perf_counter() - started) * 1000)
+
+        def executemany(self, query, vars_list):
+            trace = current()
+            if trace is None:
+                return super().executemany(query, vars_list)
+            started = time.perf_counter()
+            try:
+                return super().executemany(query, vars_list)
+            finally:
+                trace.add_query(self, (time.perf_counter() - started) * 1000)
+
+    return TracingCursor
+
+
+_cursor_classes: Dict[type, type] = {}
+_cursor_classes_lock = threading.Lock()
+
+
+class TracingConnection(psycopg2.extensions.connection):
+    def cursor(self, *args, **kwargs):
+        factory = kwargs.get('cursor_factory') or self.cursor_factory or psycopg2.extensions.cursor
+        with _cursor_classes_lock:
+            if factory not in _cursor_classes:
+                _cursor_classes[factory] = _tracing(factory)
+            kwargs['cursor_factory'] = _cursor_classes[factory]
+        return super().cursor(*args, **kwargs)
+
+
+def instrument_boto(client, name: str = 's3') -> None:
+    # Хуки botocore срабатывают в потоке вызова: вызовы из фоновых пулов в трассу запроса не попадают
+    def before(**kwargs) -> None:
+        _local.boto_started = time.perf_counter()
+
+    def after(**kwargs) -> None:
+        trace = current()
+        started = getattr(_local, 'boto_started', None)
+        if trace is not None and started is not None:
+            trace.add_phase(name, (time.perf_counter() - started) * 1000)
+        _local.boto_started = None
+
+    client.meta.events.register('before-call', before)
+    client.meta.events.register('after-call', after)
+
+
+def traced(handler: Callable[[Dict[str, Any], Any], Dict[str, Any]]) -> Callable[[Dict[str, Any], Any], Dict[str, Any]]:
+    @functools.wraps(handler)
+    def wrapper(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+        trace = Trace(getattr(context, 'request_id', '') or '')
+        _local.trace = trace
+        response: Optional[Dict[str, Any]] = None
+        try:
+            response = handler(event, context)
+            return response
+        finally:
+            _local.trace = None
+            _local.last = trace
+            trace.duration_ms = (time.perf_counter() - trace.started) * 1000
+            if isinstance(response, dict):
+                headers = response.setdefault('headers', {})
+                headers['Server-Timing'] = trace.server_timing()
+                headers['Timing-Allow-Origin'] = '*'
+            if LOG_ENABLED:
+                print(json.dumps({
+                    **trace.to_log(),
+                    'function': getattr(context, 'function_name', None),
+                    'method': event.get('httpMethod'),
+                    'status': response.get('statusCode') if isinstance(response, dict) else 500,
+                }, ensure_ascii=False, default=str))
+
+    return wrapper
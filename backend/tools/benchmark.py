@@ -0,0 +1,117 @@
+"""
+Business: Бенчмарк запросов каталога на заполненной базе (см. seed.py): задержки и планы EXPLAIN (ANALYZE, BUFFERS)
+Args: DATABASE_URL из окружения; запуск: python benchmark.py [--iterations N] [--explain] [--search TEXT]
+Returns: печатает JSON с перцентилями по каждому запросу и, с --explain, план выполнения каждого
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from typing import Any, Callable, Dict, List
+from psycopg2.extras import RealDictCursor
+
+# Скрипт лежит в backend/tools и не деплоится; модули берёт из каталога функции videos
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'videos'))
+
+import catalog
+import db
+
+
+def percentile(samples: List[float], q: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def explain(conn, cur) -> str:
+    # cur.query - последний выполненный запрос с подставленными параметрами
+    with conn.cursor() as plan_cur:
+        plan_cur.execute(b'EXPLAIN (ANALYZE, BUFFERS) ' + cur.query)
+        plan = '\n'.join(row[0] for row in plan_cur.fetchall())
+    conn.rollback()
+    return plan
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='CotoVideo catalog benchmark')
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--explain', action='store_true', help='напечатать план каждого запроса')
+    parser.add_argument('--search', default='гайд postgres')
+    args = parser.parse_args()
+
+    with db.connection() as conn:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        cur.execute("SELECT MIN(id) AS low, MAX(id) AS high FROM videos")
+        bounds = cur.fetchone()
+        cur.execute("SELECT MIN(id) AS low, MAX(id) AS high FROM users")
+        users = cur.fetchone()
+        conn.rollback()
+
+        def deep_cursor(video_type: str):
+            cur.execute(
+                """SELECT created_at, id FROM videos WHERE video_type = %s
+                   ORDER BY created_at DESC, id DESC OFFSET 10000 LIMIT 1""",
+                (video_type,)
+            )
+            row = cur.fetchone()
+            return (row['created_at'], row['id']) if row else None
+
+        cur.execute("SELECT user_id FROM watch_history GROUP BY user_id ORDER BY COUNT(*) DESC LIMIT 1")
+        heavy = cur.fetchone()
+        heavy_user = heavy['user_id'] if heavy else users['low']
+
+        video_deep = deep_cursor('video')
+        shorts_deep = deep_cursor('shorts')
+        conn.rollback()
+
+        def random_video() -> int:
+            return random.randint(bounds['low'], bounds['high'])
+
+        def random_user() -> int:
+            return random.randint(users['low'], users['high'])
+
+        cases: Dict[str, Callable[[], Any]] = {
+            'feed_first_page': lambda: catalog.feed(cur, 'video', None, 50),
+            'feed_deep_page': lambda: catalog.feed(cur, 'video', video_deep, 50),
+            'shorts_first_page': lambda: catalog.feed(cur, 'shorts', None, 20),
+            'shorts_deep_page': lambda: catalog.feed(cur, 'shorts', shorts_deep, 20),
+            'get_by_id': lambda: catalog.get(cur, random_video()),
+            'search': lambda: catalog.search(cur, args.search, None, 50),
+            'continue_watching': lambda: catalog.continue_watching(cur, random_user(), None, 20),
+            'continue_watching_heavy': lambda: catalog.continue_watching(cur, heavy_user, None, 20),
+            'toggle_like': lambda: catalog.toggle_like(cur, random_user(), random_video()),
+        }
+
+        report: Dict[str, Dict[str, Any]] = {}
+        for name, case in cases.items():
+            samples = []
+            for _ in range(args.iterations):
+                started = time.perf_counter()
+                try:
+                    case()
+                except Exception:
+                    conn.rollback()
+                    continue
+                samples.append((time.perf_counter() - started) * 1000)
+                # Пишущие запросы не сохраняем, чтобы повторные прогоны шли на тех же данных
+                conn.rollback()
+
+            report[name] = {
+                'iterations': len(samples),
+                'p50_ms': round(percentile(samples, 0.50), 3) if samples else None,
+                'p95_ms': round(percentile(samples, 0.95), 3) if samples else None,
+                'p99_ms': round(percentile(samples, 0.99), 3) if samples else None,
+            }
+            if args.explain and samples:
+                case()
+                report[name]['plan'] = explain(conn, cur)
+
+        cur.close()
+
+    print(json.dumps(report, indent=2, ensure_ascii=False, default=str))
+
+
+if __name__ == '__main__':
+    main()
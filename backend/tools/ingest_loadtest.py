@@ -0,0 +1,149 @@
+"""
+Business: Нагрузочный тест колбэков RTMP-сервера: сотни одновременных публикаций через handler() в процессе
+Args: DATABASE_URL и INGEST_SECRET из окружения; запуск:
+      python ingest_loadtest.py [--publishers N] [--duration S] [--heartbeat-interval S] [--user-id ID]
+Returns: печатает JSON с числом вызовов, ошибками и перцентилями задержки по каждому колбэку
+"""
+
+import argparse
+import json
+import os
+import secrets
+import sys
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, List
+from urllib.parse import urlencode
+
+# Скрипт лежит в backend/tools и не деплоится; модули берёт из каталога функции streams
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'streams'))
+
+import db
+from index import handler
+
+
+class Context:
+    def __init__(self, request_id: str):
+        self.request_id = request_id
+
+
+def callback_event(call: str, stream_key: str) -> Dict[str, object]:
+    return {
+        'httpMethod': 'POST',
+        'headers': {
+            'Content-Type': 'application/x-www-form-urlencoded',
+            'X-Ingest-Secret': os.environ.get('INGEST_SECRET', '')
+        },
+        'queryStringParameters': {},
+        'body': urlencode({'call': call, 'app': 'live', 'name': stream_key, 'addr': '127.0.0.1'})
+    }
+
+
+def create_streams(user_id: int, count: int) -> List[str]:
+    keys = [f'loadtest-{secrets.token_urlsafe(16)}' for _ in range(count)]
+    with db.connection() as conn:
+        cur = conn.cursor()
+        for stream_key in keys:
+            cur.execute(
+                """
+                INSERT INTO streams (user_id, title, stream_key, rtmp_url, is_live)
+                VALUES (%s, %s, %s, %s, false)
+                """,
+                (user_id, 'Нагрузочный тест', stream_key, f'rtmp://localhost/live/{stream_key}')
+            )
+        conn.commit()
+        cur.close()
+    return keys
+
+
+def drop_streams(keys: List[str]) -> None:
+    with db.connection() as conn:
+        cur = conn.cursor()
+        cur.execute("DELETE FROM streams WHERE stream_key = ANY(%s)", (keys,))
+        conn.commit()
+        cur.close()
+
+
+def percentile(samples: List[float], q: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def publisher(stream_key: str, duration: float, interval: float, start: threading.Barrier,
+              latencies: Dict[str, List[float]], errors: Dict[str, int], lock: threading.Lock) -> None:
+    def call(name: str) -> None:
+        started = time.perf_counter()
+        response = handler(callback_event(name, stream_key), Context(f'{name}-{stream_key}'))
+        elapsed = (time.perf_counter() - started) * 1000
+        with lock:
+            latencies[name].append(elapsed)
+            if response['statusCode'] != 200:
+                errors[name] += 1
+
+    start.wait()
+    call('publish')
+    deadline = time.monotonic() + duration
+    # Разносим heartbeat'ы по времени, как это делают независимые энкодеры
+    time.sleep(interval * (hash(stream_key) % 1000) / 1000)
+    while time.monotonic() < deadline:
+        call('update_publish')
+        time.sleep(interval)
+    call('publish_done')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='CotoVideo ingest callbacks load test')
+    parser.add_argument('--publishers', type=int, default=300)
+    parser.add_argument('--duration', type=float, default=60)
+    parser.add_argument('--heartbeat-interval', type=float, default=5)
+    parser.add_argument('--user-id', type=int, default=1)
+    args = parser.parse_args()
+
+    keys = create_streams(args.user_id, args.publishers)
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    errors: Dict[str, int] = defaultdict(int)
+    lock = threading.Lock()
+    start = threading.Barrier(args.publishers)
+
+    threads = [
+        threading.Thread(
+            target=publisher,
+            args=(stream_key, args.duration, args.heartbeat_interval, start, latencies, errors, lock),
+            daemon=True
+        )
+        for stream_key in keys
+    ]
+    began = time.perf_counter()
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        drop_streams(keys)
+    wall = time.perf_counter() - began
+
+    print(json.dumps({
+        'publishers': args.publishers,
+        'wall_seconds': round(wall, 1),
+        'pool': db.stats(),
+        'calls': {
+            name: {
+                'count': len(samples),
+                'errors': errors[name],
+                'per_second': round(len(samples) / wall, 1),
+                'p50_ms': round(percentile(samples, 0.50), 2),
+                'p95_ms': round(percentile(samples, 0.95), 2),
+                'p99_ms': round(percentile(samples, 0.99), 2),
+                'max_ms': round(max(samples), 2) if samples else 0.0
+            }
+            for name, samples in sorted(latencies.items())
+        }
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
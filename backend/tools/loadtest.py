@@ -0,0 +1,205 @@
+"""
+Business: Нагрузочный прогон всех функций по их tests.json: handler() вызывается в процессе на локальной базе,
+          по каждому запросу считаются пропускная способность, перцентили задержки и число SQL-запросов
+Args: DATABASE_URL и секреты функций из окружения, база заполнена через tools/seed.py; запуск:
+      python tools/loadtest.py [--functions videos,video] [--requests N] [--warmup N] [--concurrency N]
+      [--pool thread|process] [--token TOKEN] [--save BASELINE.json] [--compare BASELINE.json] [--tolerance 0.2]
+Returns: печатает JSON с метриками по каждому запросу; с --save пишет его в файл как базовую линию,
+         с --compare печатает изменения относительно базовой линии и завершается с кодом 1 при регрессии
+"""
+
+import argparse
+import importlib
+import json
+import multiprocessing
+import os
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+# Скрипт лежит в backend/tools; функции ищет в соседних каталогах backend
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_handler = None
+_tracing = None
+
+
+class Context:
+    def __init__(self, request_id: str):
+        self.request_id = request_id
+
+
+def load_function(name: str) -> None:
+    # Модули функций называются одинаково (index, db, catalog...), поэтому каждая функция живёт в своём процессе;
+    # число запросов к базе берём из трассы, которую tracing.traced оставляет после каждого вызова
+    global _handler, _tracing
+    os.environ.setdefault('TRACE_LOG', 'false')
+    sys.path.insert(0, os.path.join(BACKEND_DIR, name))
+    _tracing = importlib.import_module('tracing')
+    _handler = importlib.import_module('index').handler
+
+
+def build_event(test: Dict[str, Any], token: Optional[str]) -> Dict[str, Any]:
+    headers = {'Content-Type': 'application/json'}
+    if token:
+        headers['X-Auth-Token'] = token
+    event: Dict[str, Any] = {
+        'httpMethod': test.get('method', 'GET'),
+        'headers': headers,
+        'queryStringParameters': dict(test.get('queryParams') or {}),
+        'body': json.dumps(test['body']) if 'body' in test else '',
+    }
+    if test.get('path'):
+        event['path'] = test['path']
+    return event
+
+
+def call(event: Dict[str, Any], request_id: str) -> Tuple[float, int, int]:
+    started = time.perf_counter()
+    try:
+        status = _handler(event, Context(request_id))['statusCode']
+    except Exception as exc:
+        print(f'{request_id} failed: {exc}', file=sys.stderr)
+        status = 0
+    elapsed = (time.perf_counter() - started) * 1000
+    trace = _tracing.last()
+    return elapsed, trace.query_count if trace else 0, status
+
+
+def run_chunk(test: Dict[str, Any], token: Optional[str], start: int, count: int,
+              threads: int) -> List[Tuple[float, int, int]]:
+    event = build_event(test, token)
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        return list(pool.map(lambda n: call(dict(event), f"{test['name']}-{n}"), range(start, start + count)))
+
+
+def percentile(samples: List[float], q: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def summarize(test: Dict[str, Any], samples: List[Tuple[float, int, int]], wall: float) -> Dict[str, Any]:
+    latencies = [latency for latency, _, _ in samples]
+    queries = [count for _, count, _ in samples]
+    statuses = Counter(status for _, _, status in samples)
+    expected = test.get('expectedStatus')
+    return {
+        'requests': len(samples),
+        'errors': sum(n for status, n in statuses.items() if expected is not None and status != expected),
+        'statuses': {str(status): n for status, n in sorted(statuses.items())},
+        'per_second': round(len(samples) / wall, 1) if wall else 0.0,
+        'p50_ms': round(percentile(latencies, 0.50), 2),
+        'p95_ms': round(percentile(latencies, 0.95), 2),
+        'p99_ms': round(percentile(latencies, 0.99), 2),
+        'max_ms': round(max(latencies), 2) if latencies else 0.0,
+        'queries_per_request': round(sum(queries) / len(queries), 2) if queries else 0.0,
+    }
+
+
+def run_function(name: str, args: argparse.Namespace) -> Dict[str, Dict[str, Any]]:
+    with open(os.path.join(BACKEND_DIR, name, 'tests.json')) as f:
+        tests = json.load(f)['tests']
+
+    # thread: один "тёплый контейнер" обслуживает concurrency запросов сразу и делит с ними кэши и пул;
+    # process: concurrency независимых контейнеров, каждый со своими кэшами и соединениями
+    spawn = multiprocessing.get_context('spawn')
+    processes = args.concurrency if args.pool == 'process' else 1
+    threads = 1 if args.pool == 'process' else args.concurrency
+
+    results: Dict[str, Dict[str, Any]] = {}
+    with spawn.Pool(processes, initializer=load_function, initargs=(name,)) as pool:
+        for test in tests:
+            if args.warmup:
+                pool.starmap(run_chunk, [(test, args.token, 0, args.warmup, threads)] * processes)
+
+            per_process = max(1, args.requests // processes)
+            chunks = [(test, args.token, n * per_process, per_process, threads) for n in range(processes)]
+            started = time.perf_counter()
+            samples = [sample for chunk in pool.starmap(run_chunk, chunks) for sample in chunk]
+            wall = time.perf_counter() - started
+
+            results[f"{name}/{test['name']}"] = summarize(test, samples, wall)
+            print(json.dumps({'endpoint': f"{name}/{test['name']}", **results[f"{name}/{test['name']}"]},
+                             ensure_ascii=False), file=sys.stderr, flush=True)
+    return results
+
+
+def compare(results: Dict[str, Dict[str, Any]], baseline: Dict[str, Dict[str, Any]],
+            tolerance: float) -> Tuple[Dict[str, Dict[str, Any]], List[str]]:
+    changes: Dict[str, Dict[str, Any]] = {}
+    regressions: List[str] = []
+    for endpoint, current in results.items():
+        before = baseline.get(endpoint)
+        if not before:
+            continue
+        change = {}
+        for metric in ('p50_ms', 'p99_ms', 'per_second', 'queries_per_request'):
+            if before.get(metric):
+                change[metric] = f'{(current[metric] - before[metric]) / before[metric] * 100:+.1f}%'
+        changes[endpoint] = change
+
+        if before.get('p99_ms') and current['p99_ms'] > before['p99_ms'] * (1 + tolerance):
+            regressions.append(f"{endpoint}: p99 {before['p99_ms']} -> {current['p99_ms']} ms")
+        if current['queries_per_request'] > before.get('queries_per_request', 0):
+            regressions.append(
+                f"{endpoint}: queries {before.get('queries_per_request', 0)} -> {current['queries_per_request']}"
+            )
+    return changes, regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='CotoVideo functions load test')
+    parser.add_argument('--functions', default='', help='через запятую; по умолчанию все с tests.json')
+    parser.add_argument('--requests', type=int, default=500, help='запросов на каждый тест')
+    parser.add_argument('--warmup', type=int, default=20, help='прогревочных запросов, в метрики не входят')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--pool', choices=('thread', 'process'), default='thread')
+    parser.add_argument('--token', default=None, help='X-Auth-Token для запросов от имени пользователя')
+    parser.add_argument('--save', default=None, help='записать результаты как базовую линию')
+    parser.add_argument('--compare', default=None, help='сравнить с сохранённой базовой линией')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='допустимый рост p99 при сравнении')
+    args = parser.parse_args()
+
+    names = [name for name in args.functions.split(',') if name] or sorted(
+        name for name in os.listdir(BACKEND_DIR)
+        if os.path.isfile(os.path.join(BACKEND_DIR, name, 'tests.json'))
+        and os.path.isfile(os.path.join(BACKEND_DIR, name, 'index.py'))
+    )
+
+    results: Dict[str, Dict[str, Any]] = {}
+    for name in names:
+        results.update(run_function(name, args))
+
+    report: Dict[str, Any] = {
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'settings': {
+            'requests': args.requests,
+            'concurrency': args.concurrency,
+            'pool': args.pool,
+            'signed_in': bool(args.token),
+        },
+        'results': results,
+    }
+
+    regressions: List[str] = []
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        report['changes'], regressions = compare(results, baseline['results'], args.tolerance)
+        report['regressions'] = regressions
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,299 @@
+"""
+Business: Фоновая обработка загруженных видео: длительность, превью и HLS-рендишены
+Args: задачи из таблицы media_jobs; MEDIA_WORKER_CONCURRENCY - число параллельных задач,
+      FFMPEG_THREADS - потоков ffmpeg на задачу; запуск: python tools/media_worker.py [--concurrency N] [--once]
+Returns: обновляет videos.duration, thumbnail_url, hls_url и processing_status
+"""
+
+import argparse
+import json
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+from psycopg2.extras import RealDictCursor
+
+# Скрипт лежит в backend/tools и не деплоится; модули берёт из каталога функции upload
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'upload'))
+
+import db
+from index import get_s3_client
+
+CONCURRENCY = int(os.environ.get('MEDIA_WORKER_CONCURRENCY', '2'))
+FFMPEG_THREADS = os.environ.get('FFMPEG_THREADS', '2')
+POLL_INTERVAL_SECONDS = float(os.environ.get('MEDIA_WORKER_POLL_INTERVAL', '2'))
+STALE_AFTER_MINUTES = int(os.environ.get('MEDIA_WORKER_STALE_AFTER', '30'))
+HLS_SEGMENT_SECONDS = 4
+
+RENDITIONS: List[Tuple[int, int, int]] = [
+    (360, 800_000, 96_000),
+    (720, 2_800_000, 128_000),
+    (1080, 5_000_000, 160_000),
+]
+
+CONTENT_TYPES = {
+    '.m3u8': 'application/vnd.apple.mpegurl',
+    '.ts': 'video/mp2t',
+    '.jpg': 'image/jpeg',
+}
+
+
+def claim_job(worker_id: str) -> Optional[Dict[str, Any]]:
+    with db.connection() as conn:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        cur.execute(
+            """
+            UPDATE media_jobs
+            SET status = 'running', attempts = attempts + 1, locked_at = NOW(), locked_by = %s
+            WHERE id = (
+                SELECT id FROM media_jobs
+                WHERE status = 'pending' AND run_after <= NOW()
+                ORDER BY run_after, id
+                FOR UPDATE SKIP LOCKED
+                LIMIT 1
+            )
+            RETURNING id, video_id, source_key, attempts, max_attempts
+            """,
+            (worker_id,)
+        )
+        job = cur.fetchone()
+        conn.commit()
+        cur.close()
+    return dict(job) if job else None
+
+
+def release_stale_jobs() -> int:
+    # Задачи упавших воркеров: попытки ещё есть - обратно в очередь, исчерпаны - failed вместе с видео,
+    # иначе задача, на которой воркер падает целиком, крутилась бы бесконечно
+    with db.connection() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            """
+            WITH stale AS (
+                UPDATE media_jobs
+                SET status = CASE WHEN attempts >= max_attempts THEN 'failed' ELSE 'pending' END,
+                    locked_at = NULL,
+                    locked_by = NULL,
+                    last_error = COALESCE(last_error, 'worker lost'),
+                    finished_at = CASE WHEN attempts >= max_attempts THEN NOW() END
+                WHERE status = 'running' AND locked_at < NOW() - make_interval(mins => %s)
+                RETURNING video_id, status
+            ), failed AS (
+                UPDATE videos SET processing_status = 'failed'
+                WHERE id IN (SELECT video_id FROM stale WHERE status = 'failed')
+            )
+            SELECT COUNT(*) FROM stale
+            """,
+            (STALE_AFTER_MINUTES,)
+        )
+        released = cur.fetchone()[0]
+        conn.commit()
+        cur.close()
+    return released
+
+
+def probe(source_path: str) -> Dict[str, Any]:
+    output = subprocess.run(
+        [
+            'ffprobe', '-v', 'error',
+            '-select_streams', 'v:0',
+            '-show_entries', 'format=duration:stream=width,height',
+            '-of', 'json',
+            source_path
+        ],
+        check=True, capture_output=True, text=True
+    ).stdout
+    info = json.loads(output)
+    stream = (info.get('streams') or [{}])[0]
+    return {
+        'duration': float(info['format']['duration']),
+        'width': int(stream.get('width') or 0),
+        'height': int(stream.get('height') or 0),
+    }
+
+
+def format_duration(seconds: float) -> str:
+    total = int(round(seconds))
+    hours, rest = divmod(total, 3600)
+    minutes, secs = divmod(rest, 60)
+    if hours:
+        return f'{hours}:{minutes:02d}:{secs:02d}'
+    return f'{minutes}:{secs:02d}'
+
+
+def extract_thumbnail(source_path: str, duration: float, target_path: str) -> None:
+    subprocess.run(
+        [
+            'ffmpeg', '-v', 'error', '-y',
+            '-ss', str(min(1.0, duration / 2)),
+            '-i', source_path,
+            '-frames:v', '1',
+            '-vf', 'scale=640:-2',
+            target_path
+        ],
+        check=True
+    )
+
+
+def render_hls(source_path: str, source_width: int, source_height: int, output_dir: str) -> None:
+    portrait = source_width < source_height
+    short_side = min(source_width, source_height) or RENDITIONS[0][0]
+    long_side = max(source_width, source_height) or short_side * 16 // 9
+    renditions = [r for r in RENDITIONS if r[0] <= max(short_side, RENDITIONS[0][0])]
+    master = ['#EXTM3U', '#EXT-X-VERSION:3']
+
+    for height, video_bitrate, audio_bitrate in renditions:
+        scaled_long = int(round(long_side * height / short_side / 2)) * 2
+        scale = f'{height}:-2' if portrait else f'-2:{height}'
+        resolution = f'{height}x{scaled_long}' if portrait else f'{scaled_long}x{height}'
+        subprocess.run(
+            [
+                'ffmpeg', '-v', 'error', '-y',
+                '-i', source_path,
+                '-threads', FFMPEG_THREADS,
+                '-vf', f'scale={scale}',
+                '-c:v', 'libx264', '-preset', 'veryfast', '-profile:v', 'main',
+                '-b:v', str(video_bitrate),
+                '-maxrate', str(int(video_bitrate * 1.07)),
+                '-bufsize', str(video_bitrate * 2),
+                '-g', str(HLS_SEGMENT_SECONDS * 30), '-sc_threshold', '0',
+                '-c:a', 'aac', '-b:a', str(audio_bitrate), '-ac', '2',
+                '-f', 'hls',
+                '-hls_time', str(HLS_SEGMENT_SECONDS),
+                '-hls_playlist_type', 'vod',
+                '-hls_segment_filename', os.path.join(output_dir, f'{height}p_%04d.ts'),
+                os.path.join(output_dir, f'{height}p.m3u8')
+            ],
+            check=True
+        )
+        master.append(
+            f'#EXT-X-STREAM-INF:BANDWIDTH={video_bitrate + audio_bitrate},RESOLUTION={resolution}'
+        )
+        master.append(f'{height}p.m3u8')
+
+    with open(os.path.join(output_dir, 'master.m3u8'), 'w') as playlist:
+        playlist.write('\n'.join(master) + '\n')
+
+
+def upload_dir(s3_client, bucket: str, local_dir: str, prefix: str) -> None:
+    for name in sorted(os.listdir(local_dir)):
+        extension = os.path.splitext(name)[1]
+        s3_client.upload_file(
+            os.path.join(local_dir, name), bucket, f'{prefix}/{name}',
+            ExtraArgs={'ContentType': CONTENT_TYPES.get(extension, 'application/octet-stream')}
+        )
+
+
+def process(job: Dict[str, Any]) -> None:
+    s3_client = get_s3_client()
+    bucket = os.environ.get('S3_BUCKET', 'cotovideo')
+    endpoint = os.environ.get('S3_ENDPOINT')
+    prefix = f"hls/{job['video_id']}"
+
+    workdir = tempfile.mkdtemp(prefix=f"media-{job['id']}-")
+    try:
+        source_path = os.path.join(workdir, 'source.mp4')
+        output_dir = os.path.join(workdir, 'out')
+        os.makedirs(output_dir)
+
+        s3_client.download_file(bucket, job['source_key'], source_path)
+        info = probe(source_path)
+        extract_thumbnail(source_path, info['duration'], os.path.join(output_dir, 'thumbnail.jpg'))
+        render_hls(source_path, info['width'], info['height'], output_dir)
+        upload_dir(s3_client, bucket, output_dir, prefix)
+
+        with db.connection() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                """
+                UPDATE videos
+                SET duration = %s,
+                    thumbnail_url = %s,
+                    hls_url = %s,
+                    processing_status = 'ready'
+                WHERE id = %s
+                """,
+                (format_duration(info['duration']), f'{endpoint}/{bucket}/{prefix}/thumbnail.jpg',
+                 f'{endpoint}/{bucket}/{prefix}/master.m3u8', job['video_id'])
+            )
+            cur.execute(
+                "UPDATE media_jobs SET status = 'done', finished_at = NOW(), last_error = NULL WHERE id = %s",
+                (job['id'],)
+            )
+            conn.commit()
+            cur.close()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def fail(job: Dict[str, Any], error: Exception) -> None:
+    exhausted = job['attempts'] >= job['max_attempts']
+    with db.connection() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            """
+            UPDATE media_jobs
+            SET status = %s,
+                last_error = %s,
+                locked_at = NULL,
+                locked_by = NULL,
+                run_after = NOW() + make_interval(secs => 30 * power(2, attempts - 1)),
+                finished_at = CASE WHEN %s THEN NOW() END
+            WHERE id = %s
+            """,
+            ('failed' if exhausted else 'pending', str(error)[:2000], exhausted, job['id'])
+        )
+        if exhausted:
+            cur.execute("UPDATE videos SET processing_status = 'failed' WHERE id = %s", (job['video_id'],))
+        conn.commit()
+        cur.close()
+
+
+def work(worker_id: str, stop: threading.Event, once: bool) -> None:
+    while not stop.is_set():
+        # Дешёвый запрос по idx_media_jobs_running: зависшие задачи освобождаются и пока очередь не пустеет
+        release_stale_jobs()
+        job = claim_job(worker_id)
+        if job is None:
+            if once:
+                return
+            stop.wait(POLL_INTERVAL_SECONDS)
+            continue
+
+        try:
+            process(job)
+            print(json.dumps({'worker': worker_id, 'job_id': job['id'], 'status': 'done'}))
+        except Exception as exc:
+            fail(job, exc)
+            print(json.dumps({'worker': worker_id, 'job_id': job['id'], 'status': 'error', 'error': str(exc)}))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='CotoVideo media worker')
+    parser.add_argument('--concurrency', type=int, default=CONCURRENCY)
+    parser.add_argument('--once', action='store_true', help='выйти, когда очередь опустеет')
+    args = parser.parse_args()
+
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+    signal.signal(signal.SIGINT, lambda signum, frame: stop.set())
+
+    hostname = socket.gethostname()
+    threads = [
+        threading.Thread(target=work, args=(f'{hostname}:{os.getpid()}:{n}', stop, args.once), daemon=True)
+        for n in range(args.concurrency)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        while thread.is_alive():
+            thread.join(timeout=1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""
+Business: Бенчмарк размера и стоимости ответа ленты: прежний путь (все колонки, dict и json.dumps) против
+          карточной проекции с JSON из Postgres, плюс сжатие gzip/brotli
+Args: DATABASE_URL из окружения, база заполнена через seed.py; запуск:
+      python payload_benchmark.py [--iterations N] [--limit N] [--type video|shorts]
+Returns: печатает JSON с медианой времени запроса и сериализации, размером тела и сжатых вариантов для каждого пути
+"""
+
+import argparse
+import gzip
+import json
+import os
+import statistics
+import sys
+import time
+from typing import Any, Callable, Dict, List, Tuple
+from psycopg2.extras import RealDictCursor
+
+# Скрипт лежит в backend/tools и не деплоится; модули берёт из каталога функции videos
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'videos'))
+
+import catalog
+import db
+from cache import BROTLI_QUALITY, GZIP_LEVEL, brotli
+
+LEGACY_COLUMNS = ', '.join(f'{expression} AS {name}' for name, expression in catalog.FIELDS.items())
+
+
+def legacy_page(conn, video_type: str, limit: int) -> Tuple[float, Callable[[], str]]:
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    started = time.perf_counter()
+    cur.execute(
+        f"""SELECT {LEGACY_COLUMNS}
+            FROM videos v
+            LEFT JOIN users u ON v.user_id = u.id
+            WHERE v.video_type = %s
+            ORDER BY v.created_at DESC, v.id DESC LIMIT %s""",
+        (video_type, limit + 1)
+    )
+    rows = cur.fetchall()
+    query_ms = (time.perf_counter() - started) * 1000
+    cur.close()
+    return query_ms, lambda: json.dumps({'videos': [dict(row) for row in rows[:limit]], 'next_cursor': None}, default=str)
+
+
+def projected_page(conn, video_type: str, limit: int, fields: Tuple[str, ...]) -> Tuple[float, Callable[[], str]]:
+    cur = conn.cursor()
+    started = time.perf_counter()
+    rows = catalog.feed(cur, video_type, None, limit, fields)
+    query_ms = (time.perf_counter() - started) * 1000
+    cur.close()
+    return query_ms, lambda: catalog.page_json([row[3] for row in rows[:limit]], None)
+
+
+def timed(run: Callable[[], Any]) -> Tuple[float, Any]:
+    started = time.perf_counter()
+    result = run()
+    return (time.perf_counter() - started) * 1000, result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='CotoVideo feed payload benchmark')
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--limit', type=int, default=50)
+    parser.add_argument('--type', default='video', choices=('video', 'shorts'))
+    args = parser.parse_args()
+
+    cases: Dict[str, Callable[[Any], Tuple[float, Callable[[], str]]]] = {
+        'legacy_all_columns': lambda conn: legacy_page(conn, args.type, args.limit),
+        'projected_all_fields': lambda conn: projected_page(conn, args.type, args.limit, catalog.ALL_FIELDS),
+        'projected_card_fields': lambda conn: projected_page(conn, args.type, args.limit, catalog.CARD_FIELDS),
+    }
+
+    report: Dict[str, Dict[str, Any]] = {}
+    with db.connection() as conn:
+        for name, case in cases.items():
+            samples: Dict[str, List[float]] = {'query_ms': [], 'serialize_ms': [], 'gzip_ms': [], 'brotli_ms': []}
+            body = ''
+            for _ in range(args.iterations):
+                query_ms, serialize = case(conn)
+                conn.rollback()
+                serialize_ms, body = timed(serialize)
+                samples['query_ms'].append(query_ms)
+                samples['serialize_ms'].append(serialize_ms)
+                raw = body.encode()
+                samples['gzip_ms'].append(timed(lambda: gzip.compress(raw, GZIP_LEVEL))[0])
+                if brotli is not None:
+                    samples['brotli_ms'].append(timed(lambda: brotli.compress(raw, quality=BROTLI_QUALITY))[0])
+
+            raw = body.encode()
+            report[name] = {
+                **{f'{metric}_p50': round(statistics.median(values), 3) for metric, values in samples.items() if values},
+                'bytes': len(raw),
+                'gzip_bytes': len(gzip.compress(raw, GZIP_LEVEL)),
+            }
+            if brotli is not None:
+                report[name]['brotli_bytes'] = len(brotli.compress(raw, quality=BROTLI_QUALITY))
+
+    legacy, card = report['legacy_all_columns'], report['projected_card_fields']
+    report['card_vs_legacy'] = {
+        'bytes_ratio': round(card['bytes'] / legacy['bytes'], 3),
+        'gzip_bytes_ratio': round(card['gzip_bytes'] / legacy['bytes'], 3),
+        'serialize_speedup': round(legacy['serialize_ms_p50'] / max(card['serialize_ms_p50'], 1e-6), 1),
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""
+Business: Бенчмарк скоринга трендов: векторный score() на NumPy против построчного Python на синтетических видео
+Args: запуск: python ranking_benchmark.py [--videos N] [--repeat N] [--python-sample N]; база не нужна
+Returns: печатает JSON со временем скоринга и выбора топа, для Python - экстраполяцию на весь объём
+"""
+
+import argparse
+import json
+import math
+import os
+import sys
+import time
+
+import numpy as np
+
+# Скрипт лежит в backend/tools и не деплоится; модули берёт из каталога функции videos
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'videos'))
+
+from ranking import GRAVITY, TRENDING_SIZE, WEIGHTS, _top, score
+
+
+def python_score(views: float, likes: float, comments: float, age_hours: float) -> float:
+    signal = WEIGHTS[0] * math.log1p(views) + WEIGHTS[1] * math.log1p(likes) + WEIGHTS[2] * math.log1p(comments)
+    return signal / (max(age_hours, 0.0) + 2.0) ** GRAVITY
+
+
+def best_of(repeat: int, run) -> float:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        run()
+        timings.append((time.perf_counter() - started) * 1000)
+    return min(timings)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='CotoVideo ranking benchmark')
+    parser.add_argument('--videos', type=int, default=1_000_000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--python-sample', type=int, default=100_000)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(42)
+    ids = np.arange(1, args.videos + 1, dtype=np.int64)
+    views = rng.pareto(1.2, args.videos) * 1000
+    likes = views * rng.uniform(0.0, 0.08, args.videos)
+    comments = likes * rng.uniform(0.0, 0.2, args.videos)
+    age_hours = rng.uniform(0, 30 * 24, args.videos)
+
+    numpy_score_ms = best_of(args.repeat, lambda: score(views, likes, comments, age_hours))
+    scores = score(views, likes, comments, age_hours)
+    numpy_top_ms = best_of(args.repeat, lambda: _top(ids, scores, TRENDING_SIZE))
+
+    sample = min(args.python_sample, args.videos)
+    rows = list(zip(views[:sample].tolist(), likes[:sample].tolist(),
+                    comments[:sample].tolist(), age_hours[:sample].tolist()))
+    python_sample_ms = best_of(1, lambda: [python_score(*row) for row in rows])
+    python_score_ms = python_sample_ms * args.videos / sample
+
+    expected = np.array([python_score(*row) for row in rows[:1000]])
+    assert np.allclose(expected, scores[:1000]), 'NumPy и Python дают разные оценки'
+
+    print(json.dumps({
+        'videos': args.videos,
+        'numpy_score_ms': round(numpy_score_ms, 1),
+        'numpy_top_ms': round(numpy_top_ms, 1),
+        'python_score_ms_extrapolated': round(python_score_ms, 1),
+        'speedup': round(python_score_ms / numpy_score_ms, 1)
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,175 @@
+"""
+Business: Наполнение локальной базы объёмом, близким к продакшену, чтобы проверять запросы каталога через EXPLAIN
+Args: DATABASE_URL из окружения; запуск: python seed.py [--users N] [--videos N] [--likes N] [--comments N]
+      [--subscriptions N] [--history N]; строки генерируются на стороне Postgres через generate_series
+Returns: печатает JSON с числом вставленных строк и временем каждого шага
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from typing import Callable, Dict
+
+# Скрипт лежит в backend/tools и не деплоится; модули берёт из каталога функции videos
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'videos'))
+
+import db
+
+USER_ID = "%(user_min)s + floor(random() * %(user_span)s)::int"
+POPULAR_USER_ID = "%(user_min)s + floor(power(random(), 2) * %(user_span)s)::int"
+POPULAR_VIDEO_ID = "%(video_min)s + floor(power(random(), 3) * %(video_span)s)::int"
+
+STEPS = [
+    ('users', """
+        INSERT INTO users (email, password_hash, username, avatar_url, created_at)
+        SELECT 'seed' || g || '-' || %(run)s || '@example.com', 'seed', 'Канал ' || g,
+               'https://api.dicebear.com/7.x/avataaars/svg?seed=' || g,
+               NOW() - random() * INTERVAL '3 years'
+        FROM generate_series(1, %(count)s) AS g
+    """),
+    ('videos', f"""
+        INSERT INTO videos (user_id, title, description, thumbnail_url, video_url, duration, views,
+                            video_type, processing_status, created_at)
+        SELECT {USER_ID},
+               (ARRAY['Обзор', 'Гайд', 'Стрим', 'Подкаст', 'Разбор', 'Влог'])[1 + g %% 6]
+                   || ' ' || (ARRAY['React', 'TypeScript', 'Postgres', 'Python', 'CSS', 'котиков'])[1 + (g / 6) %% 6]
+                   || ' #' || g,
+               'Сгенерированное видео ' || g,
+               'https://images.unsplash.com/photo-1633356122544-f134324a6cee?w=500',
+               'https://example.com/seed/' || %(run)s || '/' || g || '.mp4',
+               (g %% 50) || ':' || lpad((g %% 60)::text, 2, '0'),
+               floor(random() * 1000000)::int,
+               CASE WHEN g %% 4 = 0 THEN 'shorts' ELSE 'video' END,
+               'ready',
+               NOW() - random() * INTERVAL '2 years'
+        FROM generate_series(1, %(count)s) AS g
+    """),
+    ('likes', f"""
+        INSERT INTO likes (user_id, video_id)
+        SELECT {USER_ID}, {POPULAR_VIDEO_ID}
+        FROM generate_series(1, %(count)s) AS g
+        ON CONFLICT DO NOTHING
+    """),
+    ('comments', f"""
+        INSERT INTO comments (user_id, video_id, text, created_at)
+        SELECT {USER_ID}, {POPULAR_VIDEO_ID}, 'Комментарий ' || g, NOW() - random() * INTERVAL '1 year'
+        FROM generate_series(1, %(count)s) AS g
+    """),
+    ('subscriptions', f"""
+        INSERT INTO subscriptions (subscriber_id, channel_id)
+        SELECT s.subscriber_id, s.channel_id
+        FROM (
+            SELECT {USER_ID} AS subscriber_id, {POPULAR_USER_ID} AS channel_id
+            FROM generate_series(1, %(count)s) AS g
+        ) s
+        WHERE s.subscriber_id <> s.channel_id
+        ON CONFLICT DO NOTHING
+    """),
+    ('watch_history', f"""
+        INSERT INTO watch_history (user_id, video_id, watched_at, last_watched_at, views)
+        SELECT h.user_id, h.video_id, date_trunc('day', h.seen_at), MAX(h.seen_at), COUNT(*)
+        FROM (
+            SELECT {POPULAR_USER_ID} AS user_id, {POPULAR_VIDEO_ID} AS video_id,
+                   LOCALTIMESTAMP - random() * INTERVAL '180 days' AS seen_at
+            FROM generate_series(1, %(count)s) AS g
+        ) h
+        GROUP BY 1, 2, 3
+        ON CONFLICT DO NOTHING
+    """),
+]
+
+# Строки одного INSERT получают подряд идущие id, поэтому случайные ссылки берём из диапазона
+RANGES = {
+    'users': ('user', "SELECT MIN(id), MAX(id) FROM users WHERE email LIKE %(pattern)s", 'seed%-{run}@example.com'),
+    'videos': ('video', "SELECT MIN(id), MAX(id) FROM videos WHERE video_url LIKE %(pattern)s", 'https://example.com/seed/{run}/%'),
+}
+
+
+def timed(results: Dict[str, Dict[str, float]], name: str, step: Callable[[], int]) -> None:
+    started = time.perf_counter()
+    rows = step()
+    results[name] = {'rows': rows, 'seconds': round(time.perf_counter() - started, 1)}
+    print(json.dumps({'step': name, **results[name]}), flush=True)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='CotoVideo catalog seed')
+    parser.add_argument('--users', type=int, default=100_000)
+    parser.add_argument('--videos', type=int, default=2_000_000)
+    parser.add_argument('--likes', type=int, default=5_000_000)
+    parser.add_argument('--comments', type=int, default=2_000_000)
+    parser.add_argument('--subscriptions', type=int, default=1_000_000)
+    parser.add_argument('--history', type=int, default=5_000_000)
+    args = parser.parse_args()
+
+    counts = {
+        'users': args.users,
+        'videos': args.videos,
+        'likes': args.likes,
+        'comments': args.comments,
+        'subscriptions': args.subscriptions,
+        'watch_history': args.history,
+    }
+    run = str(int(time.time()))
+    results: Dict[str, Dict[str, float]] = {}
+
+    with db.connection() as conn:
+        cur = conn.cursor()
+        # Поисковые документы строим одним проходом в конце, а не триггером на каждую строку
+        cur.execute("ALTER TABLE videos DISABLE TRIGGER video_search_refresh_trigger")
+        cur.execute("SELECT create_watch_history_partitions(LOCALTIMESTAMP - INTERVAL '180 days', 2)")
+        params: Dict[str, object] = {'run': run, 'user_min': 0, 'user_span': 0, 'video_min': 0, 'video_span': 0}
+
+        try:
+            for name, sql in STEPS:
+                if counts[name] <= 0:
+                    continue
+
+                def step(sql: str = sql, count: int = counts[name]) -> int:
+                    cur.execute(sql, {**params, 'count': count})
+                    conn.commit()
+                    return cur.rowcount
+
+                timed(results, name, step)
+
+                if name in RANGES:
+                    prefix, range_sql, pattern = RANGES[name]
+                    cur.execute(range_sql, {'pattern': pattern.format(run=run)})
+                    low, high = cur.fetchone()
+                    params[f'{prefix}_min'], params[f'{prefix}_span'] = low, high - low + 1
+
+            def search_documents() -> int:
+                cur.execute(
+                    """INSERT INTO video_search (video_id, document)
+                       SELECT v.id, video_search_document(v) FROM videos v
+                       ON CONFLICT (video_id) DO UPDATE SET document = EXCLUDED.document"""
+                )
+                conn.commit()
+                return cur.rowcount
+
+            def counters() -> int:
+                cur.execute("SELECT reconcile_video_counters()")
+                fixed = cur.fetchone()[0]
+                conn.commit()
+                return fixed
+
+            timed(results, 'video_search', search_documents)
+            timed(results, 'counters', counters)
+        finally:
+            conn.rollback()
+            cur.execute("ALTER TABLE videos ENABLE TRIGGER video_search_refresh_trigger")
+            conn.commit()
+
+        conn.autocommit = True
+        for table in ('users', 'videos', 'likes', 'comments', 'subscriptions', 'watch_history', 'video_search'):
+            cur.execute(f'VACUUM ANALYZE {table}')
+        conn.autocommit = False
+        cur.close()
+
+    print(json.dumps({'seeded': results}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -5,13 +5,104 @@ Args: event - HTTP событие с данными видео
 Returns: HTTP ответ с данными загруженного видео
 """
 
+import base64
 import json
+import math
 import os
-import secrets
-from typing import Dict, Any
-import psycopg2
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Optional
+import boto3
+from botocore.exceptions import ClientError
 from psycopg2.extras import RealDictCursor
 
+import db
+from sessions import authenticate
+import tracing
+
+PART_SIZE = int(os.environ.get('UPLOAD_PART_SIZE', str(8 * 1024 * 1024)))
+MAX_PARTS = 10000
+PRESIGNED_URL_TTL = int(os.environ.get('UPLOAD_URL_TTL', '3600'))
+
+_s3_client = None
+_s3_client_lock = threading.Lock()
+_put_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix='s3-put')
+
+def get_s3_client():
+    global _s3_client
+    if _s3_client is None:
+        with _s3_client_lock:
+            if _s3_client is None:
+                _s3_client = boto3.client(
+                    's3',
+                    endpoint_url=os.environ.get('S3_ENDPOINT'),
+                    aws_access_key_id=os.environ.get('S3_ACCESS_KEY'),
+                    aws_secret_access_key=os.environ.get('S3_SECRET_KEY')
+                )
+                tracing.instrument_boto(_s3_client, 's3')
+    return _s3_client
+
+def thumbnail_key_for(video_key: str) -> str:
+    folder, filename = video_key.rsplit('/', 1)
+    return f"{folder}/thumbnails/{filename.rsplit('.', 1)[0]}.jpg"
+
+def create_video(user_id: str, title: str, video_url: str, thumbnail_url: Optional[str], source_key: str) -> Dict[str, Any]:
+    with db.connection() as conn:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        
+        cur.execute(
+            "SELECT id FROM users WHERE id = %s",
+            (user_id,)
+        )
+        user = cur.fetchone()
+        
+        if not user:
+            cur.close()
+            return {
+                'statusCode': 404,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'body': json.dumps({'error': 'Пользователь не найден'})
+            }
+        
+        cur.execute(
+            """INSERT INTO videos
+            (user_id, title, video_url, thumbnail_url, video_type, processing_status)
+            VALUES (%s, %s, %s, %s, %s, 'processing')
+            RETURNING id""",
+            (int(user_id), title, video_url, thumbnail_url, 'shorts')
+        )
+        
+        video_db_id = cur.fetchone()['id']
+        
+        cur.execute(
+            "INSERT INTO media_jobs (video_id, source_key) VALUES (%s, %s)",
+            (video_db_id, source_key)
+        )
+        conn.commit()
+        
+        cur.close()
+        
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': json.dumps({
+                'id': video_db_id,
+                'video_url': video_url,
+                'thumbnail_url': thumbnail_url,
+                'processing_status': 'processing',
+                'message': 'Видео успешно загружено'
+            })
+        }
+
+@tracing.traced
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'GET')
     
@@ -21,15 +112,15 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Auth-Token',
+                'Access-Control-Allow-Headers': 'Content-Type, X-Auth-Token, Authorization',
                 'Access-Control-Max-Age': '86400'
             },
             'body': ''
         }
     
     if method == 'POST':
-        headers = event.get('headers', {})
-        user_id = headers.get('X-User-Id') or headers.get('x-user-id')
+        session = authenticate(event)
+        user_id = str(session['uid']) if session else None
         
         if not user_id:
             return {
@@ -42,7 +133,143 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             }
         
         body_data = json.loads(event.get('body', '{}'))
+        action = body_data.get('action')
         title = body_data.get('title', 'Без названия')
+        
+        s3_client = get_s3_client()
+        
+        bucket = os.environ.get('S3_BUCKET', 'cotovideo')
+        
+        if action == 'create_upload':
+            try:
+                size = int(body_data.get('size') or 0)
+            except (TypeError, ValueError):
+                size = 0
+            
+            if size <= 0:
+                return {
+                    'statusCode': 400,
+                    'headers': {
+                        'Content-Type': 'application/json',
+                        'Access-Control-Allow-Origin': '*'
+                    },
+                    'body': json.dumps({'error': 'Не указан размер файла'})
+                }
+            
+            part_size = max(PART_SIZE, math.ceil(size / MAX_PARTS))
+            part_count = math.ceil(size / part_size)
+            video_key = f'shorts/{user_id}/{uuid.uuid4()}.mp4'
+            
+            upload = s3_client.create_multipart_upload(
+                Bucket=bucket,
+                Key=video_key,
+                ContentType='video/mp4'
+            )
+            upload_id = upload['UploadId']
+            
+            parts = [
+                {
+                    'part_number': part_number,
+                    'url': s3_client.generate_presigned_url(
+                        'upload_part',
+                        Params={
+                            'Bucket': bucket,
+                            'Key': video_key,
+                            'UploadId': upload_id,
+                            'PartNumber': part_number
+                        },
+                        ExpiresIn=PRESIGNED_URL_TTL
+                    )
+                }
+                for part_number in range(1, part_count + 1)
+            ]
+            
+            thumbnail_upload_url = None
+            if body_data.get('thumbnail'):
+                thumbnail_upload_url = s3_client.generate_presigned_url(
+                    'put_object',
+                    Params={
+                        'Bucket': bucket,
+                        'Key': thumbnail_key_for(video_key),
+                        'ContentType': 'image/jpeg'
+                    },
+                    ExpiresIn=PRESIGNED_URL_TTL
+                )
+            
+            return {
+                'statusCode': 200,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'body': json.dumps({
+                    'upload_id': upload_id,
+                    'key': video_key,
+                    'part_size': part_size,
+                    'parts': parts,
+                    'thumbnail_upload_url': thumbnail_upload_url
+                })
+            }
+        
+        if action in ('complete_upload', 'abort_upload'):
+            upload_id = body_data.get('upload_id')
+            video_key = body_data.get('key') or ''
+            
+            if not upload_id or not video_key.startswith(f'shorts/{user_id}/'):
+                return {
+                    'statusCode': 400,
+                    'headers': {
+                        'Content-Type': 'application/json',
+                        'Access-Control-Allow-Origin': '*'
+                    },
+                    'body': json.dumps({'error': 'Загрузка не найдена'})
+                }
+            
+            if action == 'abort_upload':
+                s3_client.abort_multipart_upload(Bucket=bucket, Key=video_key, UploadId=upload_id)
+                return {
+                    'statusCode': 200,
+                    'headers': {
+                        'Content-Type': 'application/json',
+                        'Access-Control-Allow-Origin': '*'
+                    },
+                    'body': json.dumps({'success': True})
+                }
+            
+            try:
+                parts = sorted(
+                    ({'ETag': str(part['etag']), 'PartNumber': int(part['part_number'])} for part in body_data.get('parts') or []),
+                    key=lambda part: part['PartNumber']
+                )
+                s3_client.complete_multipart_upload(
+                    Bucket=bucket,
+                    Key=video_key,
+                    UploadId=upload_id,
+                    MultipartUpload={'Parts': parts}
+                )
+            except (ClientError, KeyError, TypeError, ValueError):
+                return {
+                    'statusCode': 400,
+                    'headers': {
+                        'Content-Type': 'application/json',
+                        'Access-Control-Allow-Origin': '*'
+                    },
+                    'body': json.dumps({'error': 'Не удалось завершить загрузку'})
+                }
+            
+            video_url = f"{os.environ.get('S3_ENDPOINT')}/{bucket}/{video_key}"
+            
+            thumbnail_url = None
+            if body_data.get('thumbnail'):
+                thumbnail_key = thumbnail_key_for(video_key)
+                try:
+                    s3_client.head_object(Bucket=bucket, Key=thumbnail_key)
+                    thumbnail_url = f"{os.environ.get('S3_ENDPOINT')}/{bucket}/{thumbnail_key}"
+                except ClientError:
+                    thumbnail_url = None
+            
+            return create_video(user_id, title, video_url, thumbnail_url, video_key)
+        
         video_base64 = body_data.get('video')
         thumbnail_base64 = body_data.get('thumbnail')
         
@@ -56,91 +283,53 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 'body': json.dumps({'error': 'Видео не найдено'})
             }
         
+        timings: Dict[str, float] = {}
+        started = time.perf_counter()
+        
         video_data = base64.b64decode(video_base64)
+        thumbnail_data = base64.b64decode(thumbnail_base64) if thumbnail_base64 else None
         video_id = str(uuid.uuid4())
         video_key = f'shorts/{video_id}.mp4'
+        thumbnail_key = f'shorts/thumbnails/{video_id}.jpg'
         
-        s3_client = boto3.client(
-            's3',
-            endpoint_url=os.environ.get('S3_ENDPOINT'),
-            aws_access_key_id=os.environ.get('S3_ACCESS_KEY'),
-            aws_secret_access_key=os.environ.get('S3_SECRET_KEY')
-        )
+        timings['decode_ms'] = (time.perf_counter() - started) * 1000
+        started = time.perf_counter()
         
-        bucket = os.environ.get('S3_BUCKET', 'cotovideo')
-        
-        s3_client.put_object(
+        puts = [_put_pool.submit(
+            s3_client.put_object,
             Bucket=bucket,
             Key=video_key,
             Body=video_data,
             ContentType='video/mp4'
-        )
-        
-        video_url = f"{os.environ.get('S3_ENDPOINT')}/{bucket}/{video_key}"
-        
-        thumbnail_url = None
-        if thumbnail_base64:
-            thumbnail_data = base64.b64decode(thumbnail_base64)
-            thumbnail_key = f'shorts/thumbnails/{video_id}.jpg'
-            
-            s3_client.put_object(
+        )]
+        if thumbnail_data is not None:
+            puts.append(_put_pool.submit(
+                s3_client.put_object,
                 Bucket=bucket,
                 Key=thumbnail_key,
                 Body=thumbnail_data,
                 ContentType='image/jpeg'
-            )
-            
-            thumbnail_url = f"{os.environ.get('S3_ENDPOINT')}/{bucket}/{thumbnail_key}"
+            ))
+        for put in puts:
+            put.result()
         
-        conn = psycopg2.connect(os.environ['DATABASE_URL'])
-        cur = conn.cursor(cursor_factory=RealDictCursor)
+        timings['upload_ms'] = (time.perf_counter() - started) * 1000
+        started = time.perf_counter()
         
-        cur.execute(
-            "SELECT username, avatar_url FROM users WHERE id = %s",
-            (user_id,)
-        )
-        user = cur.fetchone()
-        
-        if not user:
-            cur.close()
-            conn.close()
-            return {
-                'statusCode': 404,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'body': json.dumps({'error': 'Пользователь не найден'})
-            }
-        
-        cur.execute(
-            """INSERT INTO videos 
-            (user_id, title, video_url, thumbnail_url, video_type, channel_name, channel_avatar, duration) 
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s) 
-            RETURNING id""",
-            (int(user_id), title, video_url, thumbnail_url, 'shorts', 
-             user['username'], user['avatar_url'], '00:00:30')
-        )
+        video_url = f"{os.environ.get('S3_ENDPOINT')}/{bucket}/{video_key}"
+        thumbnail_url = f"{os.environ.get('S3_ENDPOINT')}/{bucket}/{thumbnail_key}" if thumbnail_data is not None else None
         
-        video_db_id = cur.fetchone()['id']
-        conn.commit()
+        response = create_video(user_id, title, video_url, thumbnail_url, video_key)
         
-        cur.close()
-        conn.close()
+        timings['db_insert_ms'] = (time.perf_counter() - started) * 1000
+        print(json.dumps({
+            'request_id': getattr(context, 'request_id', None),
+            'video_bytes': len(video_data),
+            'thumbnail_bytes': len(thumbnail_data) if thumbnail_data is not None else 0,
+            **{name: round(value, 1) for name, value in timings.items()}
+        }))
         
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({
-                'id': video_db_id,
-                'video_url': video_url,
-                'thumbnail_url': thumbnail_url,
-                'message': 'Видео успешно загружено'
-            })
-        }
+        return response
     
     return {
         'statusCode': 405,
@@ -149,4 +338,4 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'Access-Control-Allow-Origin': '*'
         },
         'body': json.dumps({'error': 'Method not allowed'})
-    }
\ No newline at end of file
+    }
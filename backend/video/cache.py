@@ -0,0 +1,144 @@
+"""
+Business: Кэш сериализованных ответов публичных лент внутри контейнера (TTL + LRU), условные ответы по ETag
+          и сжатие тела brotli/gzip по Accept-Encoding (сжатые варианты кэшируются по ETag); общие кэши получают
+          public только для запросов без учётных данных, Vary включает заголовки авторизации
+Args: FEED_CACHE_TTL - время жизни записи в секундах, FEED_CACHE_MAX_ENTRIES - размер кэша,
+      COMPRESS_MIN_BYTES - тела короче не сжимаются; brotli используется, если пакет установлен
+Returns: объект responses и функции cache_key() / respond() / compress()
+"""
+
+import base64
+import gzip
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+TTL_SECONDS = float(os.environ.get('FEED_CACHE_TTL', '5'))
+MAX_ENTRIES = int(os.environ.get('FEED_CACHE_MAX_ENTRIES', '256'))
+COMPRESS_MIN_BYTES = int(os.environ.get('COMPRESS_MIN_BYTES', '1024'))
+BROTLI_QUALITY = 5
+GZIP_LEVEL = 6
+# Ответ зависит от того, кто спрашивает: CDN и прокси не должны отдавать анонимную копию запросу с токеном
+VARY = 'Accept-Encoding, Authorization, X-Auth-Token'
+
+
+class ResponseCache:
+    def __init__(self, ttl_seconds: float, max_entries: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: 'OrderedDict[str, Tuple[float, str, str]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Tuple[str, str]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, body, etag = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return body, etag
+
+    def put(self, key: str, body: str) -> Tuple[str, str]:
+        etag = '"' + hashlib.sha1(body.encode()).hexdigest() + '"'
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, body, etag)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return body, etag
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+responses = ResponseCache(TTL_SECONDS, MAX_ENTRIES)
+
+
+def cache_key(endpoint: str, params: Dict[str, Any]) -> str:
+    return endpoint + '?' + '&'.join(f'{k}={params[k]}' for k in sorted(params))
+
+
+def _if_none_match(event: Dict[str, Any]) -> str:
+    headers = event.get('headers') or {}
+    return headers.get('If-None-Match') or headers.get('if-none-match') or ''
+
+
+_compressed: 'OrderedDict[Tuple[str, str], str]' = OrderedDict()
+_compressed_lock = threading.Lock()
+
+
+def _has_credentials(event: Dict[str, Any]) -> bool:
+    headers = event.get('headers') or {}
+    return any(headers.get(name) for name in ('Authorization', 'authorization', 'X-Auth-Token', 'x-auth-token'))
+
+
+def _accepted_encoding(event: Dict[str, Any]) -> Optional[str]:
+    headers = event.get('headers') or {}
+    accept = (headers.get('Accept-Encoding') or headers.get('accept-encoding') or '').lower()
+    offered = {part.split(';')[0].strip() for part in accept.split(',')}
+    if brotli is not None and 'br' in offered:
+        return 'br'
+    if 'gzip' in offered:
+        return 'gzip'
+    return None
+
+
+def _encode(body: str, encoding: str) -> str:
+    raw = body.encode()
+    data = brotli.compress(raw, quality=BROTLI_QUALITY) if encoding == 'br' else gzip.compress(raw, GZIP_LEVEL)
+    return base64.b64encode(data).decode()
+
+
+def compress(event: Dict[str, Any], response: Dict[str, Any], etag: Optional[str] = None) -> Dict[str, Any]:
+    body = response.get('body') or ''
+    encoding = _accepted_encoding(event)
+    if not encoding or len(body) < COMPRESS_MIN_BYTES:
+        return response
+
+    # Одно и то же тело из кэша лент сжимаем один раз, а не на каждый запрос
+    key = (etag, encoding) if etag else None
+    encoded = None
+    if key:
+        with _compressed_lock:
+            encoded = _compressed.get(key)
+    if encoded is None:
+        encoded = _encode(body, encoding)
+        if key:
+            with _compressed_lock:
+                _compressed[key] = encoded
+                while len(_compressed) > MAX_ENTRIES * 2:
+                    _compressed.popitem(last=False)
+
+    headers = response.get('headers', {})
+    headers = {**headers, 'Content-Encoding': encoding, 'Vary': headers.get('Vary') or 'Accept-Encoding'}
+    return {**response, 'headers': headers, 'body': encoded, 'isBase64Encoded': True}
+
+
+def respond(event: Dict[str, Any], entry: Tuple[str, str]) -> Dict[str, Any]:
+    body, etag = entry
+    headers = {
+        'Content-Type': 'application/json',
+        'Access-Control-Allow-Origin': '*',
+        'Access-Control-Expose-Headers': 'ETag',
+        'Cache-Control': f'{"private" if _has_credentials(event) else "public"}, max-age={int(responses.ttl_seconds)}',
+        'ETag': etag,
+        'Vary': VARY
+    }
+
+    candidates = [tag.strip().removeprefix('W/') for tag in _if_none_match(event).split(',')]
+    if etag in candidates or '*' in candidates:
+        return {'statusCode': 304, 'headers': headers, 'body': ''}
+
+    return compress(event, {'statusCode': 200, 'headers': headers, 'body': body}, etag)
@@ -0,0 +1,77 @@
+"""
+Business: Комментарии к видео для функций videos и video: страница обсуждения по keyset-курсору
+          (video_id, created_at, id) и публикация комментария вместе с обновлением videos.comments_count
+Args: курсор psycopg2 и параметры запроса; страница читается обычным курсором кортежей, запись - RealDictCursor
+Returns: строки страницы (id, user_id, created_at, JSON комментария) - как строки лент catalog, page_json() и post()
+"""
+
+import json
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from catalog import FeedRow
+
+MAX_TEXT_LENGTH = 2000
+
+COMMENT_DOCUMENT = """(SELECT row_to_json(d) FROM (
+        SELECT c.id, c.video_id, c.user_id, c.text, c.created_at,
+               a.username AS author_name, a.avatar_url AS author_avatar
+    ) d)::text"""
+
+
+def page(cur, video_id: int, cursor: Optional[Tuple[datetime, int]], limit: int) -> List[FeedRow]:
+    # Страница берётся из idx_comments_video_created без сортировки, авторы - одним поиском по users
+    # для уникальных user_id страницы, а не отдельным запросом на каждый комментарий
+    query = """WITH page AS (
+                   SELECT id, video_id, user_id, text, created_at
+                   FROM comments
+                   WHERE video_id = %s"""
+    params: list = [video_id]
+    if cursor:
+        query += " AND (created_at, id) < (%s, %s)"
+        params.extend(cursor)
+    query += f""" ORDER BY created_at DESC, id DESC LIMIT %s
+               ), authors AS (
+                   SELECT id, username, avatar_url FROM users
+                   WHERE id IN (SELECT DISTINCT user_id FROM page)
+               )
+               SELECT c.id, c.user_id, c.created_at, {COMMENT_DOCUMENT}
+               FROM page c
+               LEFT JOIN authors a ON a.id = c.user_id
+               ORDER BY c.created_at DESC, c.id DESC"""
+    params.append(limit + 1)
+
+    cur.execute(query, params)
+    return cur.fetchall()
+
+
+def page_json(documents: List[str], next_cursor: Optional[str]) -> str:
+    return '{"comments":[' + ','.join(documents) + '],"next_cursor":' + json.dumps(next_cursor) + '}'
+
+
+def post(cur, user_id: int, video_id: int, text: str) -> Optional[Tuple[str, int]]:
+    """Возвращает (JSON комментария, новый comments_count) или None, если видео нет."""
+    # Вставка и счётчик в одной инструкции и одной транзакции; расхождения, если появятся,
+    # чинит reconcile_video_counters
+    cur.execute(
+        f"""
+        WITH c AS (
+            INSERT INTO comments (user_id, video_id, text)
+            SELECT %s, v.id, %s FROM videos v WHERE v.id = %s
+            RETURNING id, video_id, user_id, text, created_at
+        ), counted AS (
+            UPDATE videos SET comments_count = comments_count + 1
+            WHERE id = (SELECT video_id FROM c)
+            RETURNING comments_count
+        )
+        SELECT {COMMENT_DOCUMENT} AS comment, counted.comments_count
+        FROM c
+        CROSS JOIN counted
+        LEFT JOIN users a ON a.id = c.user_id
+        """,
+        (user_id, text, video_id)
+    )
+    row = cur.fetchone()
+    if not row:
+        return None
+    return row['comment'], row['comments_count']
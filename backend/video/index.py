@@ -6,11 +6,25 @@ Returns: HTTP ответ с данными видео или результат
 """
 
 import json
-import os
+from datetime import datetime, timezone
 from typing import Dict, Any
-import psycopg2
 from psycopg2.extras import RealDictCursor
 
+import catalog
+import comments
+import db
+import ranking
+from cache import cache_key, compress, respond, responses
+from pagination import (decode_cursor, decode_rank_cursor, encode_cursor, encode_rank_cursor, parse_id, parse_limit,
+                        split_rows)
+from sessions import authenticate
+from views import ViewBuffer
+import tracing
+
+views_buffer = ViewBuffer(catalog.HISTORY_SQL)
+views_buffer.flush_on_shutdown(db.connection)
+
+@tracing.traced
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'GET')
     
@@ -20,175 +34,407 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id',
+                'Access-Control-Allow-Headers': 'Content-Type, X-Auth-Token, Authorization',
                 'Access-Control-Max-Age': '86400'
             },
             'body': ''
         }
     
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    
     if method == 'GET':
-        params = event.get('queryStringParameters') or {}
-        video_id = params.get('id')
-        video_type = params.get('type')
-        search_query = params.get('search')
+        feed_params = event.get('queryStringParameters') or {}
+        viewer = authenticate(event)
+        feed_key = None
+        if not viewer and not feed_params.get('search') and not feed_params.get('id') and feed_params.get('feed') not in ('home', 'continue'):
+            feed_key = cache_key('video', feed_params)
+            cached = responses.get(feed_key)
+            if cached:
+                return respond(event, cached)
+    
+    with db.connection() as conn:
+        views_buffer.flush_if_due(conn)
+        
+        # Ленты читаются кортежами с готовым JSON из Postgres, действия - словарями
+        cur = conn.cursor(cursor_factory=RealDictCursor if method == 'POST' else None)
         
-        if search_query:
-            search_term = f"%{search_query}%"
-            cur.execute(
-                """SELECT v.*, 
-                   (SELECT COUNT(*) FROM video_likes WHERE video_id = v.id) as likes_count,
-                   (SELECT COUNT(*) FROM video_views WHERE video_id = v.id) as views
-                   FROM videos v 
-                   WHERE v.title ILIKE %s OR v.description ILIKE %s OR v.channel_name ILIKE %s
-                   ORDER BY v.created_at DESC 
-                   LIMIT 50""",
-                (search_term, search_term, search_term)
-            )
-            videos = [dict(row) for row in cur.fetchall()]
+        if method == 'GET':
+            params = event.get('queryStringParameters') or {}
+            video_id = params.get('id')
+            video_type = params.get('type')
+            search_query = params.get('search')
             
-            cur.close()
-            conn.close()
+            comments_video = params.get('comments')
+            if comments_video:
+                limit = parse_limit(params.get('limit'), 20, 50)
+                
+                try:
+                    cursor = decode_cursor(params.get('cursor'))
+                except ValueError:
+                    cur.close()
+                    return {
+                        'statusCode': 400,
+                        'headers': {
+                            'Content-Type': 'application/json',
+                            'Access-Control-Allow-Origin': '*'
+                        },
+                        'body': json.dumps({'error': 'Неверный курсор'})
+                    }
+                
+                comments_video = parse_id(comments_video)
+                if comments_video is None:
+                    cur.close()
+                    return {
+                        'statusCode': 400,
+                        'headers': {
+                            'Content-Type': 'application/json',
+                            'Access-Control-Allow-Origin': '*'
+                        },
+                        'body': json.dumps({'error': 'Неверный id видео'})
+                    }
+                
+                rows = comments.page(cur, comments_video, cursor, limit)
+                page, next_cursor = split_rows(rows, limit, encode_cursor)
+                
+                cur.close()
+                
+                with tracing.phase('serialize'):
+                    body = comments.page_json([row[3] for row in page], next_cursor)
+                if feed_key is None:
+                    return compress(event, {
+                        'statusCode': 200,
+                        'headers': {
+                            'Content-Type': 'application/json',
+                            'Access-Control-Allow-Origin': '*',
+                            'Cache-Control': 'private, no-store'
+                        },
+                        'body': body
+                    })
+                return respond(event, responses.put(feed_key, body))
             
-            return {
-                'statusCode': 200,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'body': json.dumps({'videos': videos})
-            }
-        
-        if video_id:
-            cur.execute(
-                """SELECT v.*, 
-                   (SELECT COUNT(*) FROM video_likes WHERE video_id = v.id) as likes_count,
-                   (SELECT COUNT(*) FROM video_views WHERE video_id = v.id) as views
-                   FROM videos v WHERE v.id = %s""",
-                (video_id,)
-            )
-            video = cur.fetchone()
+            if search_query:
+                limit = parse_limit(params.get('limit'), 50, 50)
+                
+                try:
+                    cursor = decode_rank_cursor(params.get('cursor'))
+                except ValueError:
+                    cur.close()
+                    return {
+                        'statusCode': 400,
+                        'headers': {
+                            'Content-Type': 'application/json',
+                            'Access-Control-Allow-Origin': '*'
+                        },
+                        'body': json.dumps({'error': 'Неверный курсор'})
+                    }
+                
+                try:
+                    fields = catalog.parse_fields(params.get('fields'))
+                except ValueError:
+                    cur.close()
+                    return {
+                        'statusCode': 400,
+                        'headers': {
+                            'Content-Type': 'application/json',
+                            'Access-Control-Allow-Origin': '*'
+                        },
+                        'body': json.dumps({'error': 'Неизвестное поле в fields'})
+                    }
+                
+                rows = catalog.search(cur, search_query, cursor, limit, fields)
+                page, next_cursor = split_rows(rows, limit, encode_rank_cursor)
+                if viewer:
+                    documents = catalog.hydrate_viewer_state(cur, viewer['uid'], page)
+                else:
+                    documents = [row[3] for row in page]
+                
+                cur.close()
+                
+                return compress(event, {
+                    'statusCode': 200,
+                    'headers': {
+                        'Content-Type': 'application/json',
+                        'Access-Control-Allow-Origin': '*'
+                    },
+                    'body': catalog.page_json(documents, next_cursor)
+                })
             
-            cur.close()
-            conn.close()
+            if video_id:
+                video_id = parse_id(video_id)
+                if video_id is None:
+                    cur.close()
+                    return {
+                        'statusCode': 400,
+                        'headers': {
+                            'Content-Type': 'application/json',
+                            'Access-Control-Allow-Origin': '*'
+                        },
+                        'body': json.dumps({'error': 'Неверный id видео'})
+                    }
+                
+                video = catalog.get(cur, video_id)
+                if video:
+                    document = catalog.hydrate_viewer_state(cur, viewer['uid'], [video])[0] if viewer else video[3]
+                    viewer_state = ''
+                    if viewer:
+                        viewer_state = ',"viewer":{"is_premium":' + json.dumps(catalog.is_premium(cur, viewer)) + '}'
+                
+                cur.close()
+                
+                if video:
+                    return {
+                        'statusCode': 200,
+                        'headers': {
+                            'Content-Type': 'application/json',
+                            'Access-Control-Allow-Origin': '*'
+                        },
+                        'body': '{"video":' + document + viewer_state + '}'
+                    }
+                else:
+                    return {
+                        'statusCode': 404,
+                        'headers': {
+                            'Content-Type': 'application/json',
+                            'Access-Control-Allow-Origin': '*'
+                        },
+                        'body': json.dumps({'error': 'Видео не найдено'})
+                    }
             
-            if video:
+            limit = parse_limit(params.get('limit'), 50, 50)
+            feed = params.get('feed', 'recent')
+            if feed == 'home' and not viewer:
+                feed = 'trending'
+            ranked = feed in ('trending', 'home')
+            
+            if feed == 'continue' and not viewer:
+                cur.close()
                 return {
-                    'statusCode': 200,
+                    'statusCode': 401,
                     'headers': {
                         'Content-Type': 'application/json',
                         'Access-Control-Allow-Origin': '*'
                     },
-                    'body': json.dumps({'video': dict(video)})
+                    'body': json.dumps({'error': 'Необходима авторизация'})
                 }
-            else:
+            
+            try:
+                cursor = (decode_rank_cursor if ranked else decode_cursor)(params.get('cursor'))
+            except ValueError:
+                cur.close()
                 return {
-                    'statusCode': 404,
+                    'statusCode': 400,
                     'headers': {
                         'Content-Type': 'application/json',
                         'Access-Control-Allow-Origin': '*'
                     },
-                    'body': json.dumps({'error': 'Видео не найдено'})
+                    'body': json.dumps({'error': 'Неверный курсор'})
                 }
-        
-        if video_type == 'shorts':
-            query = """SELECT v.*, 
-                       (SELECT COUNT(*) FROM video_likes WHERE video_id = v.id) as likes_count,
-                       (SELECT COUNT(*) FROM video_views WHERE video_id = v.id) as comments_count
-                       FROM videos v 
-                       WHERE v.video_type = 'shorts'
-                       ORDER BY v.created_at DESC 
-                       LIMIT 50"""
-        else:
-            query = """SELECT v.*, 
-                       (SELECT COUNT(*) FROM video_likes WHERE video_id = v.id) as likes_count,
-                       (SELECT COUNT(*) FROM video_views WHERE video_id = v.id) as views
-                       FROM videos v 
-                       WHERE v.video_type = 'video' OR v.video_type IS NULL
-                       ORDER BY v.created_at DESC 
-                       LIMIT 50"""
-        
-        cur.execute(query)
-        videos = [dict(row) for row in cur.fetchall()]
-        
-        cur.close()
-        conn.close()
-        
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({'videos': videos})
-        }
-    
-    if method == 'POST':
-        body_data = json.loads(event.get('body', '{}'))
-        action = body_data.get('action')
-        
-        if action == 'like':
-            video_id = body_data.get('video_id')
-            user_id = body_data.get('user_id', 1)
             
-            cur.execute(
-                "SELECT * FROM video_likes WHERE video_id = %s AND user_id = %s",
-                (video_id, user_id)
-            )
-            existing = cur.fetchone()
+            try:
+                fields = catalog.parse_fields(params.get('fields'), catalog.HISTORY_FIELDS if feed == 'continue' else None)
+            except ValueError:
+                cur.close()
+                return {
+                    'statusCode': 400,
+                    'headers': {
+                        'Content-Type': 'application/json',
+                        'Access-Control-Allow-Origin': '*'
+                    },
+                    'body': json.dumps({'error': 'Неизвестное поле в fields'})
+                }
+            
+            kind = 'shorts' if video_type == 'shorts' else 'video'
+            if feed == 'continue':
+                rows = catalog.continue_watching(cur, viewer['uid'], cursor, limit, fields)
+            elif feed == 'home':
+                rows = ranking.home_feed(cur, viewer['uid'], kind, cursor, limit, fields)
+            elif feed == 'trending':
+                rows = ranking.trending(cur, kind, cursor, limit, fields)
+            else:
+                rows = catalog.feed(cur, kind, cursor, limit, fields)
             
-            if existing:
-                cur.execute(
-                    "DELETE FROM video_likes WHERE video_id = %s AND user_id = %s",
-                    (video_id, user_id)
-                )
-                liked = False
+            page, next_cursor = split_rows(rows, limit, encode_rank_cursor if ranked else encode_cursor)
+            if viewer:
+                documents = catalog.hydrate_viewer_state(cur, viewer['uid'], page)
             else:
-                cur.execute(
-                    "INSERT INTO video_likes (video_id, user_id) VALUES (%s, %s)",
-                    (video_id, user_id)
-                )
-                liked = True
+                documents = [row[3] for row in page]
             
-            conn.commit()
             cur.close()
-            conn.close()
             
-            return {
-                'statusCode': 200,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'body': json.dumps({'success': True, 'liked': liked})
-            }
+            with tracing.phase('serialize'):
+                body = catalog.page_json(documents, next_cursor)
+            if feed_key is None:
+                return compress(event, {
+                    'statusCode': 200,
+                    'headers': {
+                        'Content-Type': 'application/json',
+                        'Access-Control-Allow-Origin': '*',
+                        'Cache-Control': 'private, no-store'
+                    },
+                    'body': body
+                })
+            return respond(event, responses.put(feed_key, body))
         
-        elif action == 'view':
-            video_id = body_data.get('video_id')
-            user_id = body_data.get('user_id', 1)
+        if method == 'POST':
+            body_data = json.loads(event.get('body', '{}'))
+            action = body_data.get('action')
+            session = authenticate(event, conn)
+            user_id = session['uid'] if session else None
             
-            cur.execute(
-                "INSERT INTO video_views (video_id, user_id) VALUES (%s, %s)",
-                (video_id, user_id)
-            )
-            conn.commit()
+            if action == 'batch':
+                try:
+                    rows = catalog.collapse_actions(user_id, body_data.get('actions'))
+                except ValueError:
+                    cur.close()
+                    return {
+                        'statusCode': 400,
+                        'headers': {
+                            'Content-Type': 'application/json',
+                            'Access-Control-Allow-Origin': '*'
+                        },
+                        'body': json.dumps({'error': 'Неверный список действий'})
+                    }
+                
+                if not user_id and any(liked is not None for _, _, liked, _ in rows):
+                    cur.close()
+                    return {
+                        'statusCode': 401,
+                        'headers': {
+                            'Content-Type': 'application/json',
+                            'Access-Control-Allow-Origin': '*'
+                        },
+                        'body': json.dumps({'error': 'Необходима авторизация'})
+                    }
+                
+                results = catalog.apply_actions(cur, rows)
+                conn.commit()
+                cur.close()
+                
+                return {
+                    'statusCode': 200,
+                    'headers': {
+                        'Content-Type': 'application/json',
+                        'Access-Control-Allow-Origin': '*'
+                    },
+                    'body': json.dumps({'success': True, 'videos': results})
+                }
             
-            cur.close()
-            conn.close()
+            if action == 'comment':
+                text = str(body_data.get('text') or '').strip()
+                
+                if not user_id:
+                    cur.close()
+                    return {
+                        'statusCode': 401,
+                        'headers': {
+                            'Content-Type': 'application/json',
+                            'Access-Control-Allow-Origin': '*'
+                        },
+                        'body': json.dumps({'error': 'Необходима авторизация'})
+                    }
+                
+                comment_video = parse_id(body_data.get('video_id'))
+                if not text or len(text) > comments.MAX_TEXT_LENGTH or comment_video is None:
+                    cur.close()
+                    return {
+                        'statusCode': 400,
+                        'headers': {
+                            'Content-Type': 'application/json',
+                            'Access-Control-Allow-Origin': '*'
+                        },
+                        'body': json.dumps({'error': 'Неверные данные комментария'})
+                    }
+                
+                posted = comments.post(cur, user_id, comment_video, text)
+                conn.commit()
+                cur.close()
+                
+                if not posted:
+                    return {
+                        'statusCode': 404,
+                        'headers': {
+                            'Content-Type': 'application/json',
+                            'Access-Control-Allow-Origin': '*'
+                        },
+                        'body': json.dumps({'error': 'Видео не найдено'})
+                    }
+                
+                comment, comments_count = posted
+                return {
+                    'statusCode': 200,
+                    'headers': {
+                        'Content-Type': 'application/json',
+                        'Access-Control-Allow-Origin': '*'
+                    },
+                    'body': '{"success":true,"comment":' + comment + ',"comments_count":' + json.dumps(comments_count) + '}'
+                }
             
-            return {
-                'statusCode': 200,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'body': json.dumps({'success': True})
-            }
-    
-    cur.close()
-    conn.close()
+            if action == 'like':
+                video_id = parse_id(body_data.get('video_id'))
+                
+                if not user_id:
+                    cur.close()
+                    return {
+                        'statusCode': 401,
+                        'headers': {
+                            'Content-Type': 'application/json',
+                            'Access-Control-Allow-Origin': '*'
+                        },
+                        'body': json.dumps({'error': 'Необходима авторизация'})
+                    }
+                
+                if video_id is None:
+                    cur.close()
+                    return {
+                        'statusCode': 400,
+                        'headers': {
+                            'Content-Type': 'application/json',
+                            'Access-Control-Allow-Origin': '*'
+                        },
+                        'body': json.dumps({'error': 'Неверный id видео'})
+                    }
+                
+                liked, likes_count = catalog.toggle_like(cur, user_id, video_id)
+                conn.commit()
+                cur.close()
+                
+                return {
+                    'statusCode': 200,
+                    'headers': {
+                        'Content-Type': 'application/json',
+                        'Access-Control-Allow-Origin': '*'
+                    },
+                    'body': json.dumps({'success': True, 'liked': liked, 'likes': likes_count or 0})
+                }
+            
+            elif action == 'view':
+                video_id = parse_id(body_data.get('video_id'))
+                
+                if video_id is None:
+                    cur.close()
+                    return {
+                        'statusCode': 400,
+                        'headers': {
+                            'Content-Type': 'application/json',
+                            'Access-Control-Allow-Origin': '*'
+                        },
+                        'body': json.dumps({'error': 'Неверный id видео'})
+                    }
+                
+                history_row = (user_id, video_id, datetime.now(timezone.utc)) if user_id else None
+                views_buffer.record(video_id, history_row)
+                views_buffer.flush_if_due(conn)
+                
+                cur.close()
+                
+                return {
+                    'statusCode': 200,
+                    'headers': {
+                        'Content-Type': 'application/json',
+                        'Access-Control-Allow-Origin': '*'
+                    },
+                    'body': json.dumps({'success': True})
+                }
+        
+        cur.close()
     
     return {
         'statusCode': 405,
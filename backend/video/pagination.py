@@ -0,0 +1,83 @@
+"""
+Business: Непрозрачный курсор для keyset-пагинации лент по (created_at, id)
+Args: created_at и id последней строки страницы / строка курсора из запроса
+Returns: строку курсора или пару (created_at, id); split_page() и split_rows() делят выборку limit + 1
+         на страницу и курсор следующей для строк-словарей и строк-кортежей; parse_id() - id из запроса
+"""
+
+import base64
+import json
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+def encode_cursor(created_at: datetime, row_id: int) -> str:
+    raw = json.dumps([created_at.isoformat(), row_id], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(token: Optional[str]) -> Optional[Tuple[datetime, int]]:
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        created_at, row_id = json.loads(raw)
+        return datetime.fromisoformat(created_at), int(row_id)
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor')
+
+
+MAX_ID = 2 ** 31 - 1
+
+
+def parse_id(value: Any) -> Optional[int]:
+    # id в таблицах - int4: всё, что не влезает, отсекаем до запроса, иначе Postgres ответит ошибкой
+    if isinstance(value, bool):
+        return None
+    try:
+        parsed = int(value)
+    except (TypeError, ValueError):
+        return None
+    return parsed if 0 < parsed <= MAX_ID else None
+
+
+def parse_limit(value: Optional[str], default: int, maximum: int) -> int:
+    try:
+        limit = int(value) if value else default
+    except ValueError:
+        limit = default
+    return max(1, min(limit, maximum))
+
+
+def split_page(rows: List[Dict[str, Any]], limit: int) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    page = rows[:limit]
+    if len(rows) <= limit or not page:
+        return page, None
+    last = page[-1]
+    return page, encode_cursor(last['created_at'], last['id'])
+
+
+def encode_rank_cursor(rank: float, row_id: int) -> str:
+    raw = json.dumps([rank, row_id], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_rank_cursor(token: Optional[str]) -> Optional[Tuple[float, int]]:
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        rank, row_id = json.loads(raw)
+        return float(rank), int(row_id)
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor')
+
+
+def split_rows(rows: List[Tuple[Any, ...]], limit: int,
+               encode: Callable[[Any, int], str]) -> Tuple[List[Tuple[Any, ...]], Optional[str]]:
+    # Строки-кортежи (id, ..., ключ сортировки, ...): курсор из ключа сортировки (третья колонка) и id
+    page = rows[:limit]
+    if len(rows) <= limit or not page:
+        return page, None
+    last = page[-1]
+    return page, encode(last[2], last[0])
@@ -0,0 +1,248 @@
+"""
+Business: Ранжирование лент: таблица video_trending (просмотры, лайки и комментарии с затуханием по возрасту)
+          и персональная главная - свежие видео подписок вперемешку с трендами; скоринг векторный на NumPy
+Args: TRENDING_WINDOW_DAYS - за сколько дней брать кандидатов, TRENDING_SIZE - сколько видео каждого типа хранить,
+      HOME_FEED_TTL - сколько секунд держать посчитанную главную пользователя в памяти контейнера;
+      ручной пересчёт трендов: python ranking.py
+Returns: score(), refresh_trending(), trending(), home_feed()
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from psycopg2.extras import execute_values
+
+import catalog
+import db
+
+TRENDING_WINDOW_DAYS = int(os.environ.get('TRENDING_WINDOW_DAYS', '30'))
+TRENDING_SIZE = int(os.environ.get('TRENDING_SIZE', '1000'))
+HOME_FEED_TTL = float(os.environ.get('HOME_FEED_TTL', '60'))
+HOME_FEED_MAX_USERS = int(os.environ.get('HOME_FEED_MAX_USERS', '2000'))
+HOME_CANDIDATES = 500
+SUBSCRIPTION_WINDOW_DAYS = 30
+SUBSCRIPTION_BOOST = 1.5
+WATCHED_WINDOW_DAYS = 7
+BATCH_SIZE = 50_000
+
+# Вес сигнала и скорость затухания: score = (wv*ln(1+views) + wl*ln(1+likes) + wc*ln(1+comments)) / (age_h + 2)^gravity
+WEIGHTS = np.array([1.0, 4.0, 6.0])
+GRAVITY = 1.5
+
+
+def score(views: np.ndarray, likes: np.ndarray, comments: np.ndarray, age_hours: np.ndarray) -> np.ndarray:
+    signals = np.log1p(np.stack([views, likes, comments]).astype(np.float64))
+    return (WEIGHTS @ signals) / np.power(np.maximum(age_hours, 0.0) + 2.0, GRAVITY)
+
+
+def _age_hours(created_at: List[datetime], now: datetime) -> np.ndarray:
+    stamps = np.array([c.timestamp() for c in created_at], dtype=np.float64)
+    return (now.timestamp() - stamps) / 3600.0
+
+
+def _top(ids: np.ndarray, scores: np.ndarray, size: int) -> Tuple[np.ndarray, np.ndarray]:
+    if len(scores) > size:
+        keep = np.argpartition(-scores, size - 1)[:size]
+        ids, scores = ids[keep], scores[keep]
+    order = np.lexsort((-ids, -scores))
+    return ids[order], scores[order]
+
+
+def refresh_trending(conn) -> int:
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    best: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+
+    # Именованный курсор читает кандидатов с сервера пачками, в памяти держим только текущую пачку и топ
+    with conn.cursor(name='trending_candidates') as cur:
+        cur.itersize = BATCH_SIZE
+        cur.execute(
+            # Счётчики в старых строках бывают NULL: в float64 это NaN, и такое видео выпало бы из сравнения
+            """SELECT id, video_type, COALESCE(views, 0), COALESCE(likes_count, 0), COALESCE(comments_count, 0), created_at
+               FROM videos
+               WHERE created_at > NOW() - make_interval(days => %s)
+                 AND processing_status IS DISTINCT FROM 'failed'""",
+            (TRENDING_WINDOW_DAYS,)
+        )
+        while True:
+            rows = cur.fetchmany(BATCH_SIZE)
+            if not rows:
+                break
+            ids, types, views, likes, comments, created_at = zip(*rows)
+            ids = np.array(ids, dtype=np.int64)
+            types = np.array(types)
+            scores = score(
+                np.array(views, dtype=np.float64),
+                np.array(likes, dtype=np.float64),
+                np.array(comments, dtype=np.float64),
+                _age_hours(list(created_at), now)
+            )
+            for video_type in np.unique(types):
+                mask = types == video_type
+                batch_ids, batch_scores = ids[mask], scores[mask]
+                if video_type in best:
+                    batch_ids = np.concatenate([best[video_type][0], batch_ids])
+                    batch_scores = np.concatenate([best[video_type][1], batch_scores])
+                best[str(video_type)] = _top(batch_ids, batch_scores, TRENDING_SIZE)
+
+    rows = [
+        (int(video_id), video_type, float(value))
+        for video_type, (ids, scores) in best.items()
+        for video_id, value in zip(ids, scores)
+    ]
+    with conn.cursor() as cur:
+        cur.execute("DELETE FROM video_trending")
+        if rows:
+            execute_values(
+                cur,
+                "INSERT INTO video_trending (video_id, video_type, score) VALUES %s",
+                rows,
+                page_size=1000
+            )
+    conn.commit()
+    return len(rows)
+
+
+def trending(cur, video_type: str, cursor: Optional[Tuple[float, int]], limit: int,
+             fields: Tuple[str, ...] = catalog.CARD_FIELDS) -> List[catalog.FeedRow]:
+    query = f"""SELECT t.video_id, v.user_id, t.score, {catalog.document(fields)}
+                FROM video_trending t
+                JOIN videos v ON v.id = t.video_id
+                LEFT JOIN users u ON v.user_id = u.id
+                WHERE t.video_type = %s"""
+    params: list = [video_type]
+    if cursor:
+        query += " AND (t.score, t.video_id) < (%s, %s)"
+        params.extend(cursor)
+    query += " ORDER BY t.score DESC, t.video_id DESC LIMIT %s"
+    params.append(limit + 1)
+
+    cur.execute(query, params)
+    return cur.fetchall()
+
+
+class HomeFeedCache:
+    def __init__(self, ttl_seconds: float, max_users: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_users = max_users
+        self._entries: 'OrderedDict[Tuple[int, str], Tuple[float, List[Tuple[float, int]]]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Tuple[int, str]) -> Optional[List[Tuple[float, int]]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, ranked = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return ranked
+
+    def put(self, key: Tuple[int, str], ranked: List[Tuple[float, int]]) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, ranked)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_users:
+                self._entries.popitem(last=False)
+
+
+home_feeds = HomeFeedCache(HOME_FEED_TTL, HOME_FEED_MAX_USERS)
+
+
+def _rank_home(cur, user_id: int, video_type: str) -> List[Tuple[float, int]]:
+    cur.execute(
+        """
+        WITH subscribed AS (
+            SELECT v.id, v.views, v.likes_count, v.comments_count, v.created_at, true AS subscribed
+            FROM subscriptions s
+            CROSS JOIN LATERAL (
+                SELECT id, views, likes_count, comments_count, created_at
+                FROM videos
+                WHERE user_id = s.channel_id
+                  AND video_type = %(video_type)s
+                  AND created_at > NOW() - make_interval(days => %(window)s)
+                ORDER BY created_at DESC, id DESC
+                LIMIT 20
+            ) v
+            WHERE s.subscriber_id = %(user_id)s
+            ORDER BY v.created_at DESC
+            LIMIT %(candidates)s
+        ), trending AS (
+            SELECT v.id, v.views, v.likes_count, v.comments_count, v.created_at, false AS subscribed
+            FROM video_trending t
+            JOIN videos v ON v.id = t.video_id
+            WHERE t.video_type = %(video_type)s
+            ORDER BY t.score DESC, t.video_id DESC
+            LIMIT %(candidates)s
+        )
+        SELECT DISTINCT ON (c.id) c.id, c.views, c.likes_count, c.comments_count, c.created_at, c.subscribed
+        FROM (SELECT * FROM subscribed UNION ALL SELECT * FROM trending) c
+        WHERE NOT EXISTS (
+            SELECT 1 FROM watch_history h
+            WHERE h.user_id = %(user_id)s
+              AND h.video_id = c.id
+              AND h.watched_at > NOW() - make_interval(days => %(watched)s)
+        )
+        ORDER BY c.id, c.subscribed DESC
+        """,
+        {
+            'user_id': user_id,
+            'video_type': video_type,
+            'window': SUBSCRIPTION_WINDOW_DAYS,
+            'watched': WATCHED_WINDOW_DAYS,
+            'candidates': HOME_CANDIDATES,
+        }
+    )
+    rows = cur.fetchall()
+    if not rows:
+        return []
+
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    ids, views, likes, comments, created_at, subscribed = zip(*rows)
+    ids = np.array(ids, dtype=np.int64)
+    scores = score(
+        np.array([value or 0 for value in views], dtype=np.float64),
+        np.array(likes, dtype=np.float64),
+        np.array(comments, dtype=np.float64),
+        _age_hours(list(created_at), now)
+    )
+    scores = np.where(subscribed, scores * SUBSCRIPTION_BOOST, scores)
+    ids, scores = _top(ids, scores, len(ids))
+    return [(float(value), int(video_id)) for value, video_id in zip(scores, ids)]
+
+
+def home_feed(cur, user_id: int, video_type: str, cursor: Optional[Tuple[float, int]], limit: int,
+              fields: Tuple[str, ...] = catalog.CARD_FIELDS) -> List[catalog.FeedRow]:
+    ranked = home_feeds.get((user_id, video_type))
+    if ranked is None:
+        ranked = _rank_home(cur, user_id, video_type)
+        home_feeds.put((user_id, video_type), ranked)
+
+    if cursor:
+        ranked = [entry for entry in ranked if entry < cursor]
+    page = ranked[:limit + 1]
+    if not page:
+        return []
+
+    cur.execute(
+        f"""SELECT v.id, v.user_id, {catalog.document(fields)}
+            FROM videos v
+            LEFT JOIN users u ON v.user_id = u.id
+            WHERE v.id = ANY(%s)""",
+        ([video_id for _, video_id in page],)
+    )
+    by_id = {row[0]: row for row in cur.fetchall()}
+    return [(video_id, by_id[video_id][1], value, by_id[video_id][2]) for value, video_id in page if video_id in by_id]
+
+
+if __name__ == '__main__':
+    started = time.perf_counter()
+    with db.connection() as conn:
+        stored = refresh_trending(conn)
+    print(f'video_trending: {stored} rows in {time.perf_counter() - started:.1f}s')
@@ -0,0 +1,119 @@
+"""
+Business: Буферизация просмотров в памяти контейнера и пакетная запись в базу
+Args: VIEW_FLUSH_INTERVAL - максимум секунд между сбросами буфера,
+      VIEW_FLUSH_MAX_EVENTS - максимум просмотров в буфере до принудительного сброса
+Returns: класс ViewBuffer; при потере контейнера теряется не больше одного окна буфера;
+         история просмотров пишется в точке сохранения и при ошибке отбрасывается, не задерживая счётчики
+"""
+
+import atexit
+import os
+import signal
+import threading
+import time
+from collections import Counter
+from typing import Any, Callable, List, Optional, Tuple
+import psycopg2
+from psycopg2.extras import execute_values
+
+FLUSH_INTERVAL_SECONDS = float(os.environ.get('VIEW_FLUSH_INTERVAL', '10'))
+MAX_EVENTS = int(os.environ.get('VIEW_FLUSH_MAX_EVENTS', '200'))
+
+
+class ViewBuffer:
+    def __init__(self, history_sql: str):
+        self.history_sql = history_sql
+        self._counts: Counter = Counter()
+        self._history: List[Tuple[Any, ...]] = []
+        self._events = 0
+        self._oldest_at = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, video_id: int, history_row: Optional[Tuple[Any, ...]]) -> None:
+        with self._lock:
+            if not self._events:
+                self._oldest_at = time.monotonic()
+            self._counts[int(video_id)] += 1
+            if history_row is not None:
+                self._history.append(history_row)
+            self._events += 1
+
+    def due(self) -> bool:
+        with self._lock:
+            if not self._events:
+                return False
+            return self._events >= MAX_EVENTS or time.monotonic() - self._oldest_at >= FLUSH_INTERVAL_SECONDS
+
+    def flush(self, conn) -> int:
+        with self._lock:
+            counts, history, events = self._counts, self._history, self._events
+            self._counts, self._history, self._events = Counter(), [], 0
+        if not events:
+            return 0
+
+        try:
+            with conn.cursor() as cur:
+                execute_values(
+                    cur,
+                    """UPDATE videos SET views = videos.views + d.n
+                       FROM (VALUES %s) AS d(id, n)
+                       WHERE videos.id = d.id""",
+                    sorted(counts.items())
+                )
+                if history:
+                    # Пачку истории, которую база не принимает, назад в очередь не возвращаем:
+                    # иначе она ломала бы каждый следующий сброс вместе со счётчиками просмотров
+                    cur.execute('SAVEPOINT view_history')
+                    try:
+                        execute_values(cur, self.history_sql, history, page_size=500)
+                    except psycopg2.Error as exc:
+                        cur.execute('ROLLBACK TO SAVEPOINT view_history')
+                        print(f'view buffer dropped {len(history)} history rows: {exc}')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            self._restore(counts, history, events)
+            raise
+
+        return events
+
+    def flush_if_due(self, conn) -> int:
+        if not self.due():
+            return 0
+        try:
+            return self.flush(conn)
+        except Exception as exc:
+            print(f'view buffer flush failed, will retry: {exc}')
+            return 0
+
+    def _restore(self, counts: Counter, history: List[Tuple[Any, ...]], events: int) -> None:
+        with self._lock:
+            if not self._events:
+                self._oldest_at = time.monotonic()
+            self._counts.update(counts)
+            self._history[:0] = history[-MAX_EVENTS:]
+            self._events += events
+
+    def flush_on_shutdown(self, connection: Callable) -> None:
+        def _flush() -> None:
+            try:
+                with connection() as conn:
+                    self.flush(conn)
+            except Exception as exc:
+                print(f'view buffer flush on shutdown failed: {exc}')
+
+        atexit.register(_flush)
+
+        try:
+            previous = signal.getsignal(signal.SIGTERM)
+
+            def _on_sigterm(signum, frame):
+                _flush()
+                if callable(previous):
+                    previous(signum, frame)
+                else:
+                    raise SystemExit(0)
+
+            signal.signal(signal.SIGTERM, _on_sigterm)
+        except ValueError:
+            pass
@@ -0,0 +1,436 @@
+"""
+Business: Общий доступ к данным каталога для функций videos и video: ленты, карточка видео, поиск, лайки,
+          пакетное применение действий, флаги зрителя (лайкнул, в избранном, подписан) и история просмотров
+Args: курсор и параметры запроса; оба обработчика читают одни таблицы через одни индексы;
+      чтение лент - обычным курсором кортежей, запись - RealDictCursor;
+      SUBSCRIPTION_CACHE_TTL - сколько секунд держать подписки пользователя в памяти контейнера,
+      ENTITLEMENT_CACHE_TTL - сколько секунд держать срок премиум-подписки пользователя,
+      WATCH_HISTORY_RETENTION_MONTHS - сколько полных месяцев истории хранить
+Returns: строки лент (id, user_id, ключ сортировки, JSON видео) - JSON собирает Postgres по набору полей fields,
+         так что ответ склеивается из готовых строк без промежуточных dict и json.dumps
+"""
+
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+from psycopg2.extras import execute_values
+
+from pagination import parse_id
+
+FIELDS = {
+    'id': 'v.id',
+    'user_id': 'v.user_id',
+    'title': 'v.title',
+    'description': 'v.description',
+    'thumbnail_url': 'v.thumbnail_url',
+    'video_url': 'v.video_url',
+    'hls_url': 'v.hls_url',
+    'duration': 'v.duration',
+    'views': 'v.views',
+    'likes_count': 'v.likes_count',
+    'comments_count': 'v.comments_count',
+    'video_type': 'v.video_type',
+    'is_short': 'v.is_short',
+    'processing_status': 'v.processing_status',
+    'created_at': 'v.created_at',
+    'channel_name': 'u.username',
+    'channel_avatar': 'u.avatar_url',
+}
+HISTORY_FIELDS = {
+    'last_watched_at': 'h.last_watched_at',
+    'watch_count': 'h.views',
+}
+# Ровно то, что рисуют карточки VideoCard и ShortCard; остальное - через fields=
+CARD_FIELDS = ('id', 'user_id', 'title', 'thumbnail_url', 'duration', 'views', 'likes_count', 'comments_count',
+               'video_type', 'created_at', 'channel_name', 'channel_avatar')
+ALL_FIELDS = tuple(FIELDS)
+
+# Строка ленты: (id, user_id, ключ сортировки для курсора, JSON видео)
+FeedRow = Tuple[int, Optional[int], Any, str]
+
+# Повторные просмотры видео за сутки складываются в одну строку; GROUP BY убирает дубли внутри пачки,
+# иначе ON CONFLICT DO UPDATE не сможет дважды обновить одну строку, ORDER BY фиксирует порядок блокировок.
+# Просмотры удалённых видео и пользователей отбрасываются соединением, а не ошибкой внешнего ключа
+HISTORY_SQL = """
+    INSERT INTO watch_history AS h (user_id, video_id, watched_at, last_watched_at, views)
+    SELECT i.user_id::int, i.video_id::int, date_trunc('day', i.watched_at::timestamp),
+           MAX(i.watched_at::timestamp), COUNT(*)
+    FROM (VALUES %s) AS i(user_id, video_id, watched_at)
+    JOIN videos v ON v.id = i.video_id::int
+    JOIN users u ON u.id = i.user_id::int
+    GROUP BY 1, 2, 3
+    ORDER BY 1, 2, 3
+    ON CONFLICT (user_id, video_id, watched_at) DO UPDATE
+    SET views = h.views + EXCLUDED.views,
+        last_watched_at = GREATEST(h.last_watched_at, EXCLUDED.last_watched_at)
+"""
+
+HISTORY_RETENTION_MONTHS = int(os.environ.get('WATCH_HISTORY_RETENTION_MONTHS', '12'))
+HISTORY_PARTITIONS_AHEAD = 2
+
+SUBSCRIPTION_CACHE_TTL = float(os.environ.get('SUBSCRIPTION_CACHE_TTL', '60'))
+SUBSCRIPTION_CACHE_MAX_USERS = int(os.environ.get('SUBSCRIPTION_CACHE_MAX_USERS', '5000'))
+ENTITLEMENT_CACHE_TTL = float(os.environ.get('ENTITLEMENT_CACHE_TTL', '60'))
+ENTITLEMENT_CACHE_MAX_USERS = int(os.environ.get('ENTITLEMENT_CACHE_MAX_USERS', '10000'))
+
+
+def parse_fields(value: Optional[str], extra: Optional[Dict[str, str]] = None) -> Tuple[str, ...]:
+    if not value:
+        return CARD_FIELDS + tuple(extra or ())
+    names = [name.strip() for name in value.split(',') if name.strip()]
+    if not names or any(name not in FIELDS and name not in (extra or {}) for name in names):
+        raise ValueError('Unknown field')
+    return tuple(dict.fromkeys(['id'] + names))
+
+
+def document(fields: Tuple[str, ...], extra: Optional[Dict[str, str]] = None) -> str:
+    # row_to_json даёт компактный JSON без пробелов; имена полей проверены parse_fields
+    expressions = {**FIELDS, **(extra or {})}
+    columns = ', '.join(f'{expressions[name]} AS {name}' for name in fields)
+    return f'(SELECT row_to_json(d) FROM (SELECT {columns}) d)::text'
+
+
+def page_json(documents: List[str], next_cursor: Optional[str]) -> str:
+    return '{"videos":[' + ','.join(documents) + '],"next_cursor":' + json.dumps(next_cursor) + '}'
+
+
+def feed(cur, video_type: str, cursor: Optional[Tuple[datetime, int]], limit: int,
+         fields: Tuple[str, ...] = CARD_FIELDS) -> List[FeedRow]:
+    query = f"""SELECT v.id, v.user_id, v.created_at, {document(fields)}
+                FROM videos v
+                LEFT JOIN users u ON v.user_id = u.id
+                WHERE v.video_type = %s"""
+    params: list = [video_type]
+    if cursor:
+        query += " AND (v.created_at, v.id) < (%s, %s)"
+        params.extend(cursor)
+    query += " ORDER BY v.created_at DESC, v.id DESC LIMIT %s"
+    params.append(limit + 1)
+
+    cur.execute(query, params)
+    return cur.fetchall()
+
+
+def get(cur, video_id: int, fields: Tuple[str, ...] = ALL_FIELDS) -> Optional[FeedRow]:
+    cur.execute(
+        f"""SELECT v.id, v.user_id, v.created_at, {document(fields)}
+            FROM videos v
+            LEFT JOIN users u ON v.user_id = u.id
+            WHERE v.id = %s""",
+        (video_id,)
+    )
+    return cur.fetchone()
+
+
+def to_prefix_tsquery(text: str) -> Optional[str]:
+    words = re.findall(r'\w+', text.lower())[:8]
+    if not words:
+        return None
+    return ' & '.join(words[:-1] + [words[-1] + ':*'])
+
+
+def search(cur, text: str, cursor: Optional[Tuple[float, int]], limit: int,
+           fields: Tuple[str, ...] = CARD_FIELDS) -> List[FeedRow]:
+    tsquery = to_prefix_tsquery(text)
+    if not tsquery:
+        return []
+
+    query = f"""WITH matches AS (
+                    SELECT s.video_id, ts_rank(s.document, q.query) AS text_rank
+                    FROM video_search s, to_tsquery('russian', %(tsquery)s) AS q(query)
+                    WHERE s.document @@ q.query
+                    UNION ALL
+                    SELECT v.id, 0 FROM videos v WHERE %(text)s <%% v.title
+                ), ranked AS (
+                    SELECT v.id, v.user_id, (m.text_rank + word_similarity(%(text)s, v.title))::float8 AS rank
+                    FROM (SELECT video_id, MAX(text_rank) AS text_rank FROM matches GROUP BY video_id) m
+                    JOIN videos v ON v.id = m.video_id
+                ), page AS (
+                    SELECT * FROM ranked"""
+    params: Dict[str, Any] = {'text': text, 'tsquery': tsquery, 'limit': limit + 1}
+    if cursor:
+        query += " WHERE (rank, id) < (%(rank)s, %(id)s)"
+        params['rank'], params['id'] = cursor
+    # JSON собираем только для строк страницы, а не для всех совпадений
+    query += f""" ORDER BY rank DESC, id DESC LIMIT %(limit)s
+                )
+                SELECT p.id, p.user_id, p.rank, {document(fields)}
+                FROM page p
+                JOIN videos v ON v.id = p.id
+                LEFT JOIN users u ON v.user_id = u.id
+                ORDER BY p.rank DESC, p.id DESC"""
+
+    cur.execute(query, params)
+    return cur.fetchall()
+
+
+def continue_watching(cur, user_id: int, cursor: Optional[Tuple[datetime, int]], limit: int,
+                      fields: Tuple[str, ...] = CARD_FIELDS + tuple(HISTORY_FIELDS)) -> List[FeedRow]:
+    # Каждое видео один раз - по последнему дню просмотра; более поздний день ищется по первичному ключу
+    query = f"""SELECT h.video_id, v.user_id, h.last_watched_at, {document(fields, HISTORY_FIELDS)}
+                FROM watch_history h
+                JOIN videos v ON v.id = h.video_id
+                LEFT JOIN users u ON v.user_id = u.id
+                WHERE h.user_id = %s
+                  AND NOT EXISTS (
+                      SELECT 1 FROM watch_history n
+                      WHERE n.user_id = h.user_id AND n.video_id = h.video_id AND n.watched_at > h.watched_at
+                  )"""
+    params: list = [user_id]
+    if cursor:
+        query += " AND (h.last_watched_at, h.video_id) < (%s, %s)"
+        params.extend(cursor)
+    query += " ORDER BY h.last_watched_at DESC, h.video_id DESC LIMIT %s"
+    params.append(limit + 1)
+
+    cur.execute(query, params)
+    return cur.fetchall()
+
+
+def maintain_history(cur) -> Tuple[int, int]:
+    # DETACH берёт эксклюзивную блокировку родителя: не ждём долго, следующий запуск cron повторит
+    cur.execute("SET LOCAL lock_timeout = '5s'")
+    cur.execute(
+        """SELECT create_watch_history_partitions(LOCALTIMESTAMP, %s) AS created,
+                  drop_watch_history_partitions(%s) AS dropped""",
+        (HISTORY_PARTITIONS_AHEAD, HISTORY_RETENTION_MONTHS)
+    )
+    row = cur.fetchone()
+    return row['created'], row['dropped']
+
+
+def like(cur, user_id: int, video_id: int) -> Optional[int]:
+    cur.execute(
+        """
+        WITH inserted AS (
+            INSERT INTO likes (user_id, video_id) VALUES (%s, %s)
+            ON CONFLICT DO NOTHING
+            RETURNING video_id
+        )
+        UPDATE videos SET likes_count = likes_count + (SELECT COUNT(*) FROM inserted)
+        WHERE id = %s
+        RETURNING likes_count
+        """,
+        (user_id, video_id, video_id)
+    )
+    row = cur.fetchone()
+    return row['likes_count'] if row else None
+
+
+def unlike(cur, user_id: int, video_id: int) -> Optional[int]:
+    cur.execute(
+        """
+        WITH deleted AS (
+            DELETE FROM likes WHERE user_id = %s AND video_id = %s
+            RETURNING video_id
+        )
+        UPDATE videos SET likes_count = GREATEST(likes_count - (SELECT COUNT(*) FROM deleted), 0)
+        WHERE id = %s
+        RETURNING likes_count
+        """,
+        (user_id, video_id, video_id)
+    )
+    row = cur.fetchone()
+    return row['likes_count'] if row else None
+
+
+def toggle_like(cur, user_id: int, video_id: int) -> Tuple[bool, Optional[int]]:
+    cur.execute(
+        """
+        WITH deleted AS (
+            DELETE FROM likes WHERE user_id = %(user_id)s AND video_id = %(video_id)s
+            RETURNING video_id
+        ), inserted AS (
+            INSERT INTO likes (user_id, video_id)
+            SELECT %(user_id)s, %(video_id)s
+            WHERE NOT EXISTS (SELECT 1 FROM deleted)
+            ON CONFLICT DO NOTHING
+            RETURNING video_id
+        )
+        UPDATE videos
+        SET likes_count = GREATEST(likes_count + (SELECT COUNT(*) FROM inserted) - (SELECT COUNT(*) FROM deleted), 0)
+        WHERE id = %(video_id)s
+        RETURNING likes_count, NOT EXISTS (SELECT 1 FROM deleted) AS liked
+        """,
+        {'user_id': user_id, 'video_id': video_id}
+    )
+    row = cur.fetchone()
+    if not row:
+        return False, None
+    return row['liked'], row['likes_count']
+
+
+BATCH_MAX_ACTIONS = 100
+BATCH_ACTION_TYPES = ('like', 'unlike', 'view')
+
+
+def collapse_actions(user_id: Optional[int], actions: Any) -> List[Tuple[Optional[int], int, Optional[bool], int]]:
+    if not isinstance(actions, list) or not actions or len(actions) > BATCH_MAX_ACTIONS:
+        raise ValueError('Invalid actions')
+
+    # Для каждого видео: итоговое состояние лайка (последнее действие побеждает) и число просмотров
+    liked: Dict[int, Optional[bool]] = {}
+    views: Dict[int, int] = {}
+    for item in actions:
+        if not isinstance(item, dict) or item.get('type') not in BATCH_ACTION_TYPES:
+            raise ValueError('Invalid action')
+        video_id = parse_id(item.get('video_id'))
+        if video_id is None:
+            raise ValueError('Invalid video_id')
+
+        liked.setdefault(video_id, None)
+        views.setdefault(video_id, 0)
+        if item['type'] == 'view':
+            views[video_id] += 1
+        else:
+            liked[video_id] = item['type'] == 'like'
+
+    return [(user_id, video_id, liked[video_id], views[video_id]) for video_id in sorted(liked)]
+
+
+def apply_actions(cur, rows: List[Tuple[Optional[int], int, Optional[bool], int]]) -> List[Dict[str, Any]]:
+    # Один оператор на весь пакет; строки отсортированы по video_id, чтобы блокировки брались в одном порядке
+    results = execute_values(
+        cur,
+        """
+        WITH input (user_id, video_id, liked, views) AS (VALUES %s),
+        known AS (
+            SELECT i.* FROM input i JOIN videos v ON v.id = i.video_id
+        ), inserted AS (
+            INSERT INTO likes (user_id, video_id)
+            SELECT user_id, video_id FROM known WHERE liked AND user_id IS NOT NULL
+            ON CONFLICT DO NOTHING
+            RETURNING video_id
+        ), deleted AS (
+            DELETE FROM likes l
+            USING known k
+            WHERE k.liked = false AND l.user_id = k.user_id AND l.video_id = k.video_id
+            RETURNING l.video_id
+        ), history AS (
+            INSERT INTO watch_history AS h (user_id, video_id, watched_at, last_watched_at, views)
+            SELECT user_id, video_id, date_trunc('day', LOCALTIMESTAMP), LOCALTIMESTAMP, views
+            FROM known WHERE views > 0 AND user_id IS NOT NULL
+            ON CONFLICT (user_id, video_id, watched_at) DO UPDATE
+            SET views = h.views + EXCLUDED.views, last_watched_at = EXCLUDED.last_watched_at
+        ), delta AS (
+            SELECT k.video_id, k.liked, k.views,
+                   (SELECT COUNT(*) FROM inserted i WHERE i.video_id = k.video_id)
+                   - (SELECT COUNT(*) FROM deleted d WHERE d.video_id = k.video_id) AS likes
+            FROM known k
+        )
+        UPDATE videos v
+        SET likes_count = GREATEST(v.likes_count + d.likes, 0),
+            views = v.views + d.views
+        FROM delta d
+        WHERE v.id = d.video_id
+        RETURNING v.id AS video_id, v.likes_count, v.views, d.liked
+        """,
+        rows,
+        template='(%s::int, %s::int, %s::boolean, %s::int)',
+        page_size=len(rows),
+        fetch=True
+    )
+    return sorted((dict(row) for row in results), key=lambda row: row['video_id'])
+
+
+class UserCache:
+    def __init__(self, ttl_seconds: float, max_users: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_users = max_users
+        self._entries: 'OrderedDict[int, Tuple[float, Any]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id: int) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[user_id]
+                return None
+            self._entries.move_to_end(user_id)
+            return value
+
+    def put(self, user_id: int, value: Any) -> None:
+        with self._lock:
+            self._entries[user_id] = (time.monotonic() + self.ttl_seconds, value)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_users:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id: int) -> None:
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+
+subscriptions = UserCache(SUBSCRIPTION_CACHE_TTL, SUBSCRIPTION_CACHE_MAX_USERS)
+# Срок премиума (epoch секунды, 0 - нет подписки); продление из функции payments видно после TTL
+entitlements = UserCache(ENTITLEMENT_CACHE_TTL, ENTITLEMENT_CACHE_MAX_USERS)
+
+
+def is_premium(cur, claims: Dict[str, Any]) -> bool:
+    # prem_until в токене - срок подписки на момент входа; после него (или без prem) смотрим в базу,
+    # подписку могли продлить после выдачи токена
+    if claims.get('prem') and (claims.get('prem_until') is None or claims['prem_until'] > time.time()):
+        return True
+
+    user_id = claims['uid']
+    premium_until = entitlements.get(user_id)
+    if premium_until is None:
+        cur.execute(
+            """
+            SELECT CASE
+                WHEN NOT COALESCE(is_premium, FALSE) THEN 0
+                WHEN premium_until IS NULL THEN 'Infinity'::float8
+                ELSE EXTRACT(EPOCH FROM premium_until)::float8
+            END
+            FROM users WHERE id = %s
+            """,
+            (user_id,)
+        )
+        row = cur.fetchone()
+        premium_until = float(row[0]) if row else 0.0
+        entitlements.put(user_id, premium_until)
+    return premium_until > time.time()
+
+
+def hydrate_viewer_state(cur, user_id: int, rows: List[FeedRow]) -> List[str]:
+    if not rows:
+        return []
+
+    channels = subscriptions.get(user_id)
+    cur.execute(
+        """
+        SELECT
+            ARRAY(SELECT video_id FROM likes
+                  WHERE user_id = %(user_id)s AND video_id = ANY(%(video_ids)s)) AS liked,
+            ARRAY(SELECT video_id FROM favorites
+                  WHERE user_id = %(user_id)s AND video_id = ANY(%(video_ids)s)) AS favorited,
+            CASE WHEN %(load_subscriptions)s THEN
+                ARRAY(SELECT channel_id FROM subscriptions WHERE subscriber_id = %(user_id)s)
+            END AS subscribed
+        """,
+        {
+            'user_id': user_id,
+            'video_ids': [row[0] for row in rows],
+            'load_subscriptions': channels is None,
+        }
+    )
+    liked, favorited, subscribed = cur.fetchone()
+    if channels is None:
+        channels = frozenset(subscribed)
+        subscriptions.put(user_id, channels)
+
+    liked, favorited = set(liked), set(favorited)
+    # JSON строки - всегда объект от row_to_json, флаги дописываем перед закрывающей скобкой
+    return [
+        f'{row[3][:-1]},"is_liked":{json.dumps(row[0] in liked)},"is_favorited":{json.dumps(row[0] in favorited)},'
+        f'"is_subscribed":{json.dumps(row[1] in channels)}}}'
+        for row in rows
+    ]
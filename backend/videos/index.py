@@ -7,10 +7,26 @@ Returns: HTTP ответ со списком видео или результа
 
 import json
 import os
+import secrets
+from datetime import datetime, timezone
 from typing import Dict, Any
-import psycopg2
 from psycopg2.extras import RealDictCursor
 
+import catalog
+import comments
+import db
+import ranking
+from cache import cache_key, compress, respond, responses
+from pagination import (decode_cursor, decode_rank_cursor, encode_cursor, encode_rank_cursor, parse_id, parse_limit,
+                        split_rows)
+from sessions import authenticate
+from views import ViewBuffer
+import tracing
+
+views_buffer = ViewBuffer(catalog.HISTORY_SQL)
+views_buffer.flush_on_shutdown(db.connection)
+
+@tracing.traced
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'GET')
     
@@ -20,104 +36,394 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id',
+                'Access-Control-Allow-Headers': 'Content-Type, X-Auth-Token, Authorization',
                 'Access-Control-Max-Age': '86400'
             },
             'body': ''
         }
     
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    
     if method == 'GET':
-        params = event.get('queryStringParameters', {}) or {}
-        video_type = params.get('type', 'all')
-        
-        if video_type == 'shorts':
-            query = """
-                SELECT v.*, u.username as channel_name, u.avatar_url as channel_avatar,
-                       (SELECT COUNT(*) FROM likes WHERE video_id = v.id) as likes_count,
-                       (SELECT COUNT(*) FROM comments WHERE video_id = v.id) as comments_count
-                FROM videos v
-                LEFT JOIN users u ON v.user_id = u.id
-                WHERE v.is_short = true
-                ORDER BY v.created_at DESC
-                LIMIT 20
-            """
-        else:
-            query = """
-                SELECT v.*, u.username as channel_name, u.avatar_url as channel_avatar,
-                       (SELECT COUNT(*) FROM likes WHERE video_id = v.id) as likes_count,
-                       (SELECT COUNT(*) FROM comments WHERE video_id = v.id) as comments_count
-                FROM videos v
-                LEFT JOIN users u ON v.user_id = u.id
-                WHERE v.is_short = false
-                ORDER BY v.created_at DESC
-                LIMIT 50
-            """
-        
-        cur.execute(query)
-        videos = [dict(row) for row in cur.fetchall()]
-        
-        cur.close()
-        conn.close()
-        
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({'videos': videos}, default=str)
-        }
+        feed_params = event.get('queryStringParameters') or {}
+        viewer = authenticate(event)
+        feed_key = None
+        if not viewer and feed_params.get('feed') not in ('home', 'continue'):
+            feed_key = cache_key('videos', feed_params)
+            cached = responses.get(feed_key)
+            if cached:
+                return respond(event, cached)
     
-    elif method == 'POST':
-        body_data = json.loads(event.get('body', '{}'))
-        action = body_data.get('action')
-        video_id = body_data.get('video_id')
-        user_id = body_data.get('user_id')
+    with db.connection() as conn:
+        views_buffer.flush_if_due(conn)
+        
+        # Ленты читаются кортежами с готовым JSON из Postgres, действия - словарями
+        cur = conn.cursor(cursor_factory=RealDictCursor if method == 'POST' else None)
         
-        if action == 'like':
-            cur.execute(
-                "INSERT INTO likes (user_id, video_id) VALUES (%s, %s) ON CONFLICT DO NOTHING",
-                (user_id, video_id)
-            )
-            conn.commit()
+        if method == 'GET':
+            params = event.get('queryStringParameters', {}) or {}
+            comments_video = params.get('comments')
+            if comments_video:
+                limit = parse_limit(params.get('limit'), 20, 50)
+                
+                try:
+                    cursor = decode_cursor(params.get('cursor'))
+                except ValueError:
+                    cur.close()
+                    return {
+                        'statusCode': 400,
+                        'headers': {
+                            'Content-Type': 'application/json',
+                            'Access-Control-Allow-Origin': '*'
+                        },
+                        'body': json.dumps({'error': 'Неверный курсор'})
+                    }
+                
+                comments_video = parse_id(comments_video)
+                if comments_video is None:
+                    cur.close()
+                    return {
+                        'statusCode': 400,
+                        'headers': {
+                            'Content-Type': 'application/json',
+                            'Access-Control-Allow-Origin': '*'
+                        },
+                        'body': json.dumps({'error': 'Неверный id видео'})
+                    }
+                
+                rows = comments.page(cur, comments_video, cursor, limit)
+                page, next_cursor = split_rows(rows, limit, encode_cursor)
+                
+                cur.close()
+                
+                with tracing.phase('serialize'):
+                    body = comments.page_json([row[3] for row in page], next_cursor)
+                if feed_key is None:
+                    return compress(event, {
+                        'statusCode': 200,
+                        'headers': {
+                            'Content-Type': 'application/json',
+                            'Access-Control-Allow-Origin': '*',
+                            'Cache-Control': 'private, no-store'
+                        },
+                        'body': body
+                    })
+                return respond(event, responses.put(feed_key, body))
+            
+            video_type = params.get('type', 'all')
+            is_short = video_type == 'shorts'
+            limit = parse_limit(params.get('limit'), 20 if is_short else 50, 50)
+            feed = params.get('feed', 'recent')
+            if feed == 'home' and not viewer:
+                feed = 'trending'
+            ranked = feed in ('trending', 'home')
+            
+            if feed == 'continue' and not viewer:
+                cur.close()
+                return {
+                    'statusCode': 401,
+                    'headers': {
+                        'Content-Type': 'application/json',
+                        'Access-Control-Allow-Origin': '*'
+                    },
+                    'body': json.dumps({'error': 'Необходима авторизация'})
+                }
             
-            cur.execute("SELECT COUNT(*) as count FROM likes WHERE video_id = %s", (video_id,))
-            likes_count = cur.fetchone()['count']
+            try:
+                cursor = (decode_rank_cursor if ranked else decode_cursor)(params.get('cursor'))
+            except ValueError:
+                cur.close()
+                return {
+                    'statusCode': 400,
+                    'headers': {
+                        'Content-Type': 'application/json',
+                        'Access-Control-Allow-Origin': '*'
+                    },
+                    'body': json.dumps({'error': 'Неверный курсор'})
+                }
+            
+            try:
+                fields = catalog.parse_fields(params.get('fields'), catalog.HISTORY_FIELDS if feed == 'continue' else None)
+            except ValueError:
+                cur.close()
+                return {
+                    'statusCode': 400,
+                    'headers': {
+                        'Content-Type': 'application/json',
+                        'Access-Control-Allow-Origin': '*'
+                    },
+                    'body': json.dumps({'error': 'Неизвестное поле в fields'})
+                }
+            
+            kind = 'shorts' if is_short else 'video'
+            if feed == 'continue':
+                rows = catalog.continue_watching(cur, viewer['uid'], cursor, limit, fields)
+            elif feed == 'home':
+                rows = ranking.home_feed(cur, viewer['uid'], kind, cursor, limit, fields)
+            elif feed == 'trending':
+                rows = ranking.trending(cur, kind, cursor, limit, fields)
+            else:
+                rows = catalog.feed(cur, kind, cursor, limit, fields)
+            
+            page, next_cursor = split_rows(rows, limit, encode_rank_cursor if ranked else encode_cursor)
+            if viewer:
+                documents = catalog.hydrate_viewer_state(cur, viewer['uid'], page)
+            else:
+                documents = [row[3] for row in page]
             
             cur.close()
-            conn.close()
-            
-            return {
-                'statusCode': 200,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'body': json.dumps({'likes': likes_count})
-            }
+            
+            with tracing.phase('serialize'):
+                body = catalog.page_json(documents, next_cursor)
+            if feed_key is None:
+                return compress(event, {
+                    'statusCode': 200,
+                    'headers': {
+                        'Content-Type': 'application/json',
+                        'Access-Control-Allow-Origin': '*',
+                        'Cache-Control': 'private, no-store'
+                    },
+                    'body': body
+                })
+            return respond(event, responses.put(feed_key, body))
         
-        elif action == 'view':
-            cur.execute("UPDATE videos SET views = views + 1 WHERE id = %s", (video_id,))
-            cur.execute("INSERT INTO watch_history (user_id, video_id) VALUES (%s, %s)", (user_id, video_id))
-            conn.commit()
+        elif method == 'POST':
+            body_data = json.loads(event.get('body', '{}'))
+            action = body_data.get('action')
+            video_id = body_data.get('video_id')
+            session = authenticate(event, conn)
+            user_id = session['uid'] if session else None
             
-            cur.close()
-            conn.close()
-            
-            return {
-                'statusCode': 200,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'body': json.dumps({'success': True})
-            }
-    
-    cur.close()
-    conn.close()
+            if action == 'comment':
+                text = str(body_data.get('text') or '').strip()
+                
+                if not user_id:
+                    cur.close()
+                    return {
+                        'statusCode': 401,
+                        'headers': {
+                            'Content-Type': 'application/json',
+                            'Access-Control-Allow-Origin': '*'
+                        },
+                        'body': json.dumps({'error': 'Необходима авторизация'})
+                    }
+                
+                comment_video = parse_id(body_data.get('video_id'))
+                if not text or len(text) > comments.MAX_TEXT_LENGTH or comment_video is None:
+                    cur.close()
+                    return {
+                        'statusCode': 400,
+                        'headers': {
+                            'Content-Type': 'application/json',
+                            'Access-Control-Allow-Origin': '*'
+                        },
+                        'body': json.dumps({'error': 'Неверные данные комментария'})
+                    }
+                
+                posted = comments.post(cur, user_id, comment_video, text)
+                conn.commit()
+                cur.close()
+                
+                if not posted:
+                    return {
+                        'statusCode': 404,
+                        'headers': {
+                            'Content-Type': 'application/json',
+                            'Access-Control-Allow-Origin': '*'
+                        },
+                        'body': json.dumps({'error': 'Видео не найдено'})
+                    }
+                
+                comment, comments_count = posted
+                return {
+                    'statusCode': 200,
+                    'headers': {
+                        'Content-Type': 'application/json',
+                        'Access-Control-Allow-Origin': '*'
+                    },
+                    'body': '{"success":true,"comment":' + comment + ',"comments_count":' + json.dumps(comments_count) + '}'
+                }
+            
+            if action == 'batch':
+                try:
+                    rows = catalog.collapse_actions(user_id, body_data.get('actions'))
+                except ValueError:
+                    cur.close()
+                    return {
+                        'statusCode': 400,
+                        'headers': {
+                            'Content-Type': 'application/json',
+                            'Access-Control-Allow-Origin': '*'
+                        },
+                        'body': json.dumps({'error': 'Неверный список действий'})
+                    }
+                
+                if not user_id and any(liked is not None for _, _, liked, _ in rows):
+                    cur.close()
+                    return {
+                        'statusCode': 401,
+                        'headers': {
+                            'Content-Type': 'application/json',
+                            'Access-Control-Allow-Origin': '*'
+                        },
+                        'body': json.dumps({'error': 'Необходима авторизация'})
+                    }
+                
+                results = catalog.apply_actions(cur, rows)
+                conn.commit()
+                cur.close()
+                
+                return {
+                    'statusCode': 200,
+                    'headers': {
+                        'Content-Type': 'application/json',
+                        'Access-Control-Allow-Origin': '*'
+                    },
+                    'body': json.dumps({'success': True, 'videos': results})
+                }
+            
+            if action in ('like', 'unlike') and not user_id:
+                cur.close()
+                return {
+                    'statusCode': 401,
+                    'headers': {
+                        'Content-Type': 'application/json',
+                        'Access-Control-Allow-Origin': '*'
+                    },
+                    'body': json.dumps({'error': 'Необходима авторизация'})
+                }
+            
+            if action in ('like', 'unlike'):
+                video_id = parse_id(video_id)
+                if video_id is None:
+                    cur.close()
+                    return {
+                        'statusCode': 400,
+                        'headers': {
+                            'Content-Type': 'application/json',
+                            'Access-Control-Allow-Origin': '*'
+                        },
+                        'body': json.dumps({'error': 'Неверный id видео'})
+                    }
+            
+            if action == 'like':
+                likes_count = catalog.like(cur, user_id, video_id) or 0
+                conn.commit()
+                
+                cur.close()
+                
+                return {
+                    'statusCode': 200,
+                    'headers': {
+                        'Content-Type': 'application/json',
+                        'Access-Control-Allow-Origin': '*'
+                    },
+                    'body': json.dumps({'likes': likes_count})
+                }
+            
+            elif action == 'unlike':
+                likes_count = catalog.unlike(cur, user_id, video_id) or 0
+                conn.commit()
+                
+                cur.close()
+                
+                return {
+                    'statusCode': 200,
+                    'headers': {
+                        'Content-Type': 'application/json',
+                        'Access-Control-Allow-Origin': '*'
+                    },
+                    'body': json.dumps({'likes': likes_count})
+                }
+            
+            elif action in ('reconcile_counters', 'refresh_trending', 'maintain_history'):
+                headers = event.get('headers') or {}
+                provided_secret = headers.get('X-Cron-Secret') or headers.get('x-cron-secret') or ''
+                cron_secret = os.environ.get('CRON_SECRET', '')
+                
+                if not cron_secret or not secrets.compare_digest(provided_secret, cron_secret):
+                    cur.close()
+                    return {
+                        'statusCode': 403,
+                        'headers': {
+                            'Content-Type': 'application/json',
+                            'Access-Control-Allow-Origin': '*'
+                        },
+                        'body': json.dumps({'error': 'Доступ запрещён'})
+                    }
+                
+                if action == 'refresh_trending':
+                    cur.close()
+                    stored = ranking.refresh_trending(conn)
+                    responses.clear()
+                    
+                    return {
+                        'statusCode': 200,
+                        'headers': {
+                            'Content-Type': 'application/json',
+                            'Access-Control-Allow-Origin': '*'
+                        },
+                        'body': json.dumps({'success': True, 'trending': stored})
+                    }
+                
+                if action == 'maintain_history':
+                    created, dropped = catalog.maintain_history(cur)
+                    conn.commit()
+                    
+                    cur.close()
+                    
+                    return {
+                        'statusCode': 200,
+                        'headers': {
+                            'Content-Type': 'application/json',
+                            'Access-Control-Allow-Origin': '*'
+                        },
+                        'body': json.dumps({'success': True, 'created': created, 'dropped': dropped})
+                    }
+                
+                cur.execute("SELECT reconcile_video_counters() as fixed")
+                fixed = cur.fetchone()['fixed']
+                conn.commit()
+                
+                cur.close()
+                
+                return {
+                    'statusCode': 200,
+                    'headers': {
+                        'Content-Type': 'application/json',
+                        'Access-Control-Allow-Origin': '*'
+                    },
+                    'body': json.dumps({'success': True, 'fixed': fixed})
+                }
+            
+            elif action == 'view':
+                video_id = parse_id(video_id)
+                
+                if video_id is None:
+                    cur.close()
+                    return {
+                        'statusCode': 400,
+                        'headers': {
+                            'Content-Type': 'application/json',
+                            'Access-Control-Allow-Origin': '*'
+                        },
+                        'body': json.dumps({'error': 'Неверный id видео'})
+                    }
+                
+                history_row = (user_id, video_id, datetime.now(timezone.utc)) if user_id else None
+                views_buffer.record(video_id, history_row)
+                views_buffer.flush_if_due(conn)
+                
+                cur.close()
+                
+                return {
+                    'statusCode': 200,
+                    'headers': {
+                        'Content-Type': 'application/json',
+                        'Access-Control-Allow-Origin': '*'
+                    },
+                    'body': json.dumps({'success': True})
+                }
+        
+        cur.close()
     
     return {
         'statusCode': 405,
@@ -0,0 +1,34 @@
+-- Денормализованные счётчики вместо COUNT(*) на каждую строку ленты
+ALTER TABLE videos ADD COLUMN IF NOT EXISTS likes_count INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE videos ADD COLUMN IF NOT EXISTS comments_count INTEGER NOT NULL DEFAULT 0;
+
+-- Сверка счётчиков с исходными таблицами, возвращает число исправленных видео
+CREATE OR REPLACE FUNCTION reconcile_video_counters() RETURNS INTEGER AS $$
+DECLARE
+    fixed INTEGER;
+    likes_source TEXT := 'SELECT video_id FROM likes';
+BEGIN
+    -- Лайки из API video хранятся в video_likes, если такая таблица есть
+    IF to_regclass('video_likes') IS NOT NULL THEN
+        likes_source := likes_source || ' UNION ALL SELECT video_id FROM video_likes';
+    END IF;
+
+    EXECUTE '
+        UPDATE videos v
+        SET likes_count = COALESCE(l.cnt, 0),
+            comments_count = COALESCE(c.cnt, 0)
+        FROM videos base
+        LEFT JOIN (SELECT video_id, COUNT(*)::INTEGER AS cnt FROM (' || likes_source || ') src GROUP BY video_id) l
+               ON l.video_id = base.id
+        LEFT JOIN (SELECT video_id, COUNT(*)::INTEGER AS cnt FROM comments GROUP BY video_id) c
+               ON c.video_id = base.id
+        WHERE v.id = base.id
+          AND (v.likes_count, v.comments_count) IS DISTINCT FROM (COALESCE(l.cnt, 0), COALESCE(c.cnt, 0))';
+    GET DIAGNOSTICS fixed = ROW_COUNT;
+
+    RETURN fixed;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Первичное заполнение
+SELECT reconcile_video_counters();
@@ -0,0 +1,9 @@
+-- Тип видео, который использует API video; заполняем по is_short для старых строк
+ALTER TABLE videos ADD COLUMN IF NOT EXISTS video_type VARCHAR(20);
+UPDATE videos SET video_type = CASE WHEN is_short THEN 'shorts' ELSE 'video' END WHERE video_type IS NULL;
+ALTER TABLE videos ALTER COLUMN video_type SET DEFAULT 'video';
+ALTER TABLE videos ALTER COLUMN video_type SET NOT NULL;
+
+-- Индексы для keyset-пагинации лент: каждая страница - один проход по диапазону индекса
+CREATE INDEX IF NOT EXISTS idx_videos_short_feed ON videos(is_short, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_videos_type_feed ON videos(video_type, created_at DESC, id DESC);
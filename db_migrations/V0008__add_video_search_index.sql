@@ -0,0 +1,38 @@
+-- Полнотекстовый поиск по видео: взвешенный tsvector + триграммы для опечаток
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+ALTER TABLE videos ADD COLUMN IF NOT EXISTS channel_name VARCHAR(100);
+
+-- Вектор хранится отдельно, чтобы не раздувать строки videos и ответы лент
+CREATE TABLE IF NOT EXISTS video_search (
+    video_id INTEGER PRIMARY KEY REFERENCES videos(id) ON DELETE CASCADE,
+    document TSVECTOR NOT NULL
+);
+
+CREATE OR REPLACE FUNCTION video_search_document(v videos) RETURNS TSVECTOR AS $$
+    SELECT setweight(to_tsvector('russian', COALESCE(v.title, '')), 'A') ||
+           setweight(to_tsvector('russian', COALESCE(v.channel_name, (SELECT username FROM users WHERE id = v.user_id), '')), 'B') ||
+           setweight(to_tsvector('russian', COALESCE(v.description, '')), 'C');
+$$ LANGUAGE sql STABLE;
+
+CREATE OR REPLACE FUNCTION video_search_refresh() RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO video_search (video_id, document)
+    VALUES (NEW.id, video_search_document(NEW))
+    ON CONFLICT (video_id) DO UPDATE SET document = EXCLUDED.document;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS video_search_refresh_trigger ON videos;
+CREATE TRIGGER video_search_refresh_trigger
+    AFTER INSERT OR UPDATE OF title, description, channel_name, user_id ON videos
+    FOR EACH ROW EXECUTE FUNCTION video_search_refresh();
+
+-- Заполнение для существующих видео
+INSERT INTO video_search (video_id, document)
+SELECT v.id, video_search_document(v) FROM videos v
+ON CONFLICT (video_id) DO UPDATE SET document = EXCLUDED.document;
+
+CREATE INDEX IF NOT EXISTS idx_video_search_document ON video_search USING GIN (document);
+CREATE INDEX IF NOT EXISTS idx_videos_title_trgm ON videos USING GIN (title gin_trgm_ops);
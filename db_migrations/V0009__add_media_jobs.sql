@@ -0,0 +1,23 @@
+-- Состояние обработки видео и ссылка на HLS-плейлист
+ALTER TABLE videos ADD COLUMN IF NOT EXISTS processing_status VARCHAR(20) NOT NULL DEFAULT 'ready';
+ALTER TABLE videos ADD COLUMN IF NOT EXISTS hls_url TEXT;
+
+-- Очередь фоновой обработки медиа (воркеры забирают задачи через FOR UPDATE SKIP LOCKED)
+CREATE TABLE IF NOT EXISTS media_jobs (
+    id BIGSERIAL PRIMARY KEY,
+    video_id INTEGER NOT NULL REFERENCES videos(id) ON DELETE CASCADE,
+    source_key TEXT NOT NULL,
+    status VARCHAR(20) NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL DEFAULT 3,
+    run_after TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    locked_at TIMESTAMP,
+    locked_by VARCHAR(100),
+    last_error TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    finished_at TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_media_jobs_pending ON media_jobs(run_after, id) WHERE status = 'pending';
+CREATE INDEX IF NOT EXISTS idx_media_jobs_running ON media_jobs(locked_at) WHERE status = 'running';
+CREATE INDEX IF NOT EXISTS idx_media_jobs_video_id ON media_jobs(video_id);
@@ -0,0 +1,10 @@
+-- Общие token bucket для входа и сброса пароля (по email и IP)
+CREATE TABLE IF NOT EXISTS auth_rate_limits (
+    bucket_key VARCHAR(320) PRIMARY KEY,
+    tokens REAL NOT NULL,
+    capacity REAL NOT NULL,
+    refill_per_second REAL NOT NULL,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_auth_rate_limits_updated_at ON auth_rate_limits(updated_at);
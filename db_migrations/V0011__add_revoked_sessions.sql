@@ -0,0 +1,9 @@
+-- Отозванные сессионные токены (проверка подписи идёт без базы, список кэшируется в контейнерах)
+CREATE TABLE IF NOT EXISTS revoked_sessions (
+    jti VARCHAR(64) PRIMARY KEY,
+    user_id INTEGER REFERENCES users(id),
+    expires_at TIMESTAMP NOT NULL,
+    revoked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_revoked_sessions_expires_at ON revoked_sessions(expires_at);
@@ -0,0 +1,10 @@
+-- Присутствие зрителей: нежурналируемая таблица, пишется пачками из буфера функции streams
+-- Содержимое теряется при сбое сервера — это допустимо, зрители перезапишут его heartbeat'ами
+CREATE UNLOGGED TABLE IF NOT EXISTS stream_presence (
+    stream_id INTEGER NOT NULL,
+    viewer_key VARCHAR(64) NOT NULL,
+    last_seen TIMESTAMP NOT NULL,
+    PRIMARY KEY (stream_id, viewer_key)
+);
+
+CREATE INDEX IF NOT EXISTS idx_stream_presence_last_seen ON stream_presence(last_seen);
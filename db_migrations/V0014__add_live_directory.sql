@@ -0,0 +1,27 @@
+-- Частичный индекс по живым трансляциям вместо малоселективного индекса по флагу is_live
+CREATE INDEX IF NOT EXISTS idx_streams_live_started ON streams(started_at DESC, id DESC) WHERE is_live = true;
+DROP INDEX IF EXISTS idx_streams_is_live;
+
+-- Каталог "сейчас в эфире": только поля карточки, без stream_key и без JOIN users на каждый запрос.
+-- Обновляется функцией streams при start/stop и при сбросе счётчиков зрителей
+CREATE TABLE IF NOT EXISTS live_streams (
+    stream_id INTEGER PRIMARY KEY REFERENCES streams(id) ON DELETE CASCADE,
+    user_id INTEGER,
+    title VARCHAR(500) NOT NULL,
+    thumbnail_url TEXT,
+    channel_name VARCHAR(255),
+    channel_avatar TEXT,
+    viewers_count INTEGER NOT NULL DEFAULT 0,
+    started_at TIMESTAMP NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_live_streams_recent ON live_streams(started_at DESC, stream_id DESC);
+CREATE INDEX IF NOT EXISTS idx_live_streams_viewers ON live_streams(viewers_count DESC, stream_id DESC);
+
+INSERT INTO live_streams (stream_id, user_id, title, thumbnail_url, channel_name, channel_avatar, viewers_count, started_at)
+SELECT s.id, s.user_id, s.title, s.thumbnail_url, u.username, u.avatar_url, COALESCE(s.viewers_count, 0),
+       COALESCE(s.started_at, s.created_at)
+FROM streams s
+LEFT JOIN users u ON s.user_id = u.id
+WHERE s.is_live = true
+ON CONFLICT (stream_id) DO NOTHING;
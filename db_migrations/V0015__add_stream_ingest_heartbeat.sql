@@ -0,0 +1,2 @@
+-- Последний heartbeat от RTMP-сервера: по нему функция streams снимает зависшие эфиры
+ALTER TABLE streams ADD COLUMN IF NOT EXISTS last_heartbeat_at TIMESTAMP;
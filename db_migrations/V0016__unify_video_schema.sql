@@ -0,0 +1,118 @@
+-- Единая модель видео для функций videos, video и upload.
+-- Лайки живут в likes, история просмотров в watch_history, тип видео в video_type,
+-- имя и аватар канала берутся из users, а не копируются в videos
+
+-- Лайки из API video (video_likes) переносим в likes
+DO $$
+BEGIN
+    IF to_regclass('video_likes') IS NOT NULL THEN
+        INSERT INTO likes (user_id, video_id, created_at)
+        SELECT l.user_id, l.video_id,
+               COALESCE((to_jsonb(l) ->> 'created_at')::timestamp, CURRENT_TIMESTAMP)
+        FROM video_likes l
+        WHERE l.user_id IS NOT NULL AND l.video_id IS NOT NULL
+        ON CONFLICT (user_id, video_id) DO NOTHING;
+        DROP TABLE video_likes;
+    END IF;
+END $$;
+
+-- Просмотры из API video (video_views) переносим в watch_history, анонимные просмотры уже учтены в videos.views
+DO $$
+BEGIN
+    IF to_regclass('video_views') IS NOT NULL THEN
+        INSERT INTO watch_history (user_id, video_id, watched_at)
+        SELECT v.user_id, v.video_id,
+               COALESCE((to_jsonb(v) ->> 'viewed_at')::timestamp,
+                        (to_jsonb(v) ->> 'created_at')::timestamp,
+                        CURRENT_TIMESTAMP)
+        FROM video_views v
+        WHERE v.user_id IS NOT NULL AND v.video_id IS NOT NULL;
+        DROP TABLE video_views;
+    END IF;
+END $$;
+
+-- is_short больше не хранится отдельно, а вычисляется из video_type
+DO $$
+BEGIN
+    IF EXISTS (
+        SELECT 1 FROM information_schema.columns
+        WHERE table_name = 'videos' AND column_name = 'is_short' AND is_generated = 'NEVER'
+    ) THEN
+        ALTER TABLE videos DROP COLUMN is_short;
+        ALTER TABLE videos ADD COLUMN is_short BOOLEAN GENERATED ALWAYS AS (video_type = 'shorts') STORED;
+    END IF;
+END $$;
+
+-- Поисковый документ строится по имени из users; при смене имени пересобираем документы канала
+CREATE OR REPLACE FUNCTION video_search_document(v videos) RETURNS TSVECTOR AS $$
+    SELECT setweight(to_tsvector('russian', COALESCE(v.title, '')), 'A') ||
+           setweight(to_tsvector('russian', COALESCE((SELECT username FROM users WHERE id = v.user_id), '')), 'B') ||
+           setweight(to_tsvector('russian', COALESCE(v.description, '')), 'C');
+$$ LANGUAGE sql STABLE;
+
+DROP TRIGGER IF EXISTS video_search_refresh_trigger ON videos;
+ALTER TABLE videos DROP COLUMN IF EXISTS channel_name;
+ALTER TABLE videos DROP COLUMN IF EXISTS channel_avatar;
+
+CREATE TRIGGER video_search_refresh_trigger
+    AFTER INSERT OR UPDATE OF title, description, user_id ON videos
+    FOR EACH ROW EXECUTE FUNCTION video_search_refresh();
+
+CREATE OR REPLACE FUNCTION video_search_refresh_channel() RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE video_search s
+    SET document = video_search_document(v)
+    FROM videos v
+    WHERE v.user_id = NEW.id AND s.video_id = v.id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS video_search_refresh_channel_trigger ON users;
+CREATE TRIGGER video_search_refresh_channel_trigger
+    AFTER UPDATE OF username ON users
+    FOR EACH ROW WHEN (OLD.username IS DISTINCT FROM NEW.username)
+    EXECUTE FUNCTION video_search_refresh_channel();
+
+INSERT INTO video_search (video_id, document)
+SELECT v.id, video_search_document(v) FROM videos v
+ON CONFLICT (video_id) DO UPDATE SET document = EXCLUDED.document;
+
+-- Сверка счётчиков теперь смотрит только в likes и comments
+CREATE OR REPLACE FUNCTION reconcile_video_counters() RETURNS INTEGER AS $$
+DECLARE
+    fixed INTEGER;
+BEGIN
+    UPDATE videos v
+    SET likes_count = COALESCE(l.cnt, 0),
+        comments_count = COALESCE(c.cnt, 0)
+    FROM videos base
+    LEFT JOIN (SELECT video_id, COUNT(*)::INTEGER AS cnt FROM likes GROUP BY video_id) l
+           ON l.video_id = base.id
+    LEFT JOIN (SELECT video_id, COUNT(*)::INTEGER AS cnt FROM comments GROUP BY video_id) c
+           ON c.video_id = base.id
+    WHERE v.id = base.id
+      AND (v.likes_count, v.comments_count) IS DISTINCT FROM (COALESCE(l.cnt, 0), COALESCE(c.cnt, 0));
+    GET DIAGNOSTICS fixed = ROW_COUNT;
+
+    RETURN fixed;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT reconcile_video_counters();
+
+-- Индексы под реальные пути доступа:
+-- ленты обеих функций идут по idx_videos_type_feed (video_type, created_at DESC, id DESC),
+-- страница канала - по автору в том же порядке, история - по пользователю от новых к старым
+CREATE INDEX IF NOT EXISTS idx_videos_user_feed ON videos(user_id, created_at DESC, id DESC);
+DROP INDEX IF EXISTS idx_videos_user_id;
+
+CREATE INDEX IF NOT EXISTS idx_watch_history_user_recent ON watch_history(user_id, watched_at DESC);
+DROP INDEX IF EXISTS idx_watch_history_user_id;
+
+-- UNIQUE(user_id, video_id) уже обслуживает поиск по пользователю
+DROP INDEX IF EXISTS idx_favorites_user_id;
+
+ANALYZE videos;
+ANALYZE likes;
+ANALYZE watch_history;
@@ -0,0 +1,9 @@
+-- Тренды: пересчитываются периодически (действие refresh_trending функции videos), лента читает готовый порядок
+CREATE TABLE IF NOT EXISTS video_trending (
+    video_id INTEGER PRIMARY KEY REFERENCES videos(id) ON DELETE CASCADE,
+    video_type VARCHAR(20) NOT NULL,
+    score DOUBLE PRECISION NOT NULL,
+    refreshed_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_video_trending_rank ON video_trending(video_type, score DESC, video_id DESC);
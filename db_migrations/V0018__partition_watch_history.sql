@@ -0,0 +1,96 @@
+-- История просмотров: помесячные секции по watched_at, повторные просмотры видео за сутки
+-- складываются в одну строку со счётчиком views; watched_at - начало суток, last_watched_at - последний просмотр.
+-- Секции на будущие месяцы создаёт и старые удаляет действие maintain_history функции videos
+
+-- Старую таблицу переименовываем вместе с первичным ключом, чтобы имя индекса освободилось для новой
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_class WHERE relname = 'watch_history' AND relkind = 'r') THEN
+        ALTER TABLE watch_history RENAME TO watch_history_legacy;
+        ALTER TABLE watch_history_legacy RENAME CONSTRAINT watch_history_pkey TO watch_history_legacy_pkey;
+    END IF;
+END $$;
+
+CREATE TABLE IF NOT EXISTS watch_history (
+    user_id INTEGER NOT NULL REFERENCES users(id),
+    video_id INTEGER NOT NULL REFERENCES videos(id),
+    watched_at TIMESTAMP NOT NULL DEFAULT date_trunc('day', LOCALTIMESTAMP),
+    last_watched_at TIMESTAMP NOT NULL DEFAULT LOCALTIMESTAMP,
+    views INTEGER NOT NULL DEFAULT 1,
+    PRIMARY KEY (user_id, video_id, watched_at)
+) PARTITION BY RANGE (watched_at);
+
+-- "Продолжить просмотр": последние видео пользователя, Merge Append по секциям с LIMIT
+CREATE INDEX IF NOT EXISTS idx_watch_history_user_last ON watch_history(user_id, last_watched_at DESC, video_id DESC);
+-- Сканы по времени: строки в секцию пишутся по порядку watched_at, BRIN почти ничего не весит
+CREATE INDEX IF NOT EXISTS idx_watch_history_watched_brin ON watch_history USING brin(watched_at);
+
+-- Создание секций watch_history_pYYYYMM с месяца since до текущего месяца + months_ahead
+CREATE OR REPLACE FUNCTION create_watch_history_partitions(since TIMESTAMP, months_ahead INTEGER)
+RETURNS INTEGER AS $$
+DECLARE
+    month_start TIMESTAMP := date_trunc('month', since);
+    last_month TIMESTAMP := date_trunc('month', LOCALTIMESTAMP) + make_interval(months => months_ahead);
+    partition_name TEXT;
+    created INTEGER := 0;
+BEGIN
+    WHILE month_start <= last_month LOOP
+        partition_name := 'watch_history_p' || to_char(month_start, 'YYYYMM');
+        IF to_regclass(partition_name) IS NULL THEN
+            EXECUTE format(
+                'CREATE TABLE %I PARTITION OF watch_history FOR VALUES FROM (%L) TO (%L)',
+                partition_name, month_start, month_start + INTERVAL '1 month'
+            );
+            created := created + 1;
+        END IF;
+        month_start := month_start + INTERVAL '1 month';
+    END LOOP;
+    RETURN created;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Удаление секций старше keep_months полных месяцев: отсоединяем и удаляем целиком, без DELETE и VACUUM
+CREATE OR REPLACE FUNCTION drop_watch_history_partitions(keep_months INTEGER)
+RETURNS INTEGER AS $$
+DECLARE
+    cutoff TIMESTAMP := date_trunc('month', LOCALTIMESTAMP) - make_interval(months => keep_months);
+    partition_name TEXT;
+    dropped INTEGER := 0;
+BEGIN
+    FOR partition_name IN
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'watch_history'::regclass
+          AND c.relname ~ '^watch_history_p[0-9]{6}$'
+          AND to_date(substring(c.relname FROM '[0-9]{6}$'), 'YYYYMM') < cutoff
+        ORDER BY c.relname
+    LOOP
+        EXECUTE format('ALTER TABLE watch_history DETACH PARTITION %I', partition_name);
+        EXECUTE format('DROP TABLE %I', partition_name);
+        dropped := dropped + 1;
+    END LOOP;
+    RETURN dropped;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Переносим старую историю, схлопывая просмотры одного видео за сутки
+DO $$
+BEGIN
+    IF to_regclass('watch_history_legacy') IS NOT NULL THEN
+        PERFORM create_watch_history_partitions(
+            COALESCE((SELECT MIN(watched_at) FROM watch_history_legacy), LOCALTIMESTAMP), 2
+        );
+        INSERT INTO watch_history (user_id, video_id, watched_at, last_watched_at, views)
+        SELECT user_id, video_id, date_trunc('day', watched_at), MAX(watched_at), COUNT(*)
+        FROM watch_history_legacy
+        WHERE user_id IS NOT NULL AND video_id IS NOT NULL AND watched_at IS NOT NULL
+        GROUP BY user_id, video_id, date_trunc('day', watched_at)
+        ON CONFLICT DO NOTHING;
+        DROP TABLE watch_history_legacy;
+    ELSE
+        PERFORM create_watch_history_partitions(LOCALTIMESTAMP, 2);
+    END IF;
+END $$;
+
+ANALYZE watch_history;
@@ -0,0 +1,7 @@
+-- Платежи: когда вебхук последний раз менял статус (pending -> succeeded/canceled)
+ALTER TABLE payments ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP;
+
+-- Снятие истёкших подписок (действие expire_premium функции payments) читает только премиум-пользователей:
+-- частичный индекс по premium_until вместо индекса по всем пользователям
+CREATE INDEX IF NOT EXISTS idx_users_premium_until ON users(premium_until) WHERE is_premium;
+DROP INDEX IF EXISTS idx_users_premium;
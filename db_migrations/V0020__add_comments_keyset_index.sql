@@ -0,0 +1,10 @@
+-- Комментарии: страница обсуждения по (video_id, created_at DESC, id DESC) читается прямо из индекса,
+-- без сортировки всех комментариев видео; keyset-курсору нужен created_at без NULL
+UPDATE comments SET created_at = CURRENT_TIMESTAMP WHERE created_at IS NULL;
+ALTER TABLE comments ALTER COLUMN created_at SET NOT NULL;
+
+CREATE INDEX IF NOT EXISTS idx_comments_video_created ON comments(video_id, created_at DESC, id DESC);
+-- Старый индекс по video_id - префикс нового, сверке счётчиков хватает нового
+DROP INDEX IF EXISTS idx_comments_video_id;
+
+ANALYZE comments;
@@ -0,0 +1,65 @@
+-- История просмотров: секции на будущие месяцы создаёт действие maintain_history функции videos,
+-- его нужно запускать по расписанию (cron с X-Cron-Secret, хотя бы раз в месяц). Если cron не работал
+-- дольше, чем заготовлено секций вперёд, строки попадают в секцию по умолчанию, а не в ошибку вставки
+CREATE TABLE IF NOT EXISTS watch_history_default PARTITION OF watch_history DEFAULT;
+
+-- Новая секция забирает свои строки из секции по умолчанию: ATTACH не пройдёт, пока они там лежат
+CREATE OR REPLACE FUNCTION create_watch_history_partitions(since TIMESTAMP, months_ahead INTEGER)
+RETURNS INTEGER AS $$
+DECLARE
+    month_start TIMESTAMP := date_trunc('month', since);
+    last_month TIMESTAMP := date_trunc('month', LOCALTIMESTAMP) + make_interval(months => months_ahead);
+    partition_name TEXT;
+    created INTEGER := 0;
+BEGIN
+    WHILE month_start <= last_month LOOP
+        partition_name := 'watch_history_p' || to_char(month_start, 'YYYYMM');
+        IF to_regclass(partition_name) IS NULL THEN
+            EXECUTE format(
+                'CREATE TABLE %I (LIKE watch_history INCLUDING DEFAULTS INCLUDING CONSTRAINTS)',
+                partition_name
+            );
+            EXECUTE format(
+                'WITH moved AS (
+                     DELETE FROM watch_history_default WHERE watched_at >= %L AND watched_at < %L RETURNING *
+                 )
+                 INSERT INTO %I SELECT * FROM moved',
+                month_start, month_start + INTERVAL '1 month', partition_name
+            );
+            EXECUTE format(
+                'ALTER TABLE watch_history ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                partition_name, month_start, month_start + INTERVAL '1 month'
+            );
+            created := created + 1;
+        END IF;
+        month_start := month_start + INTERVAL '1 month';
+    END LOOP;
+    RETURN created;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Удаление секций старше keep_months полных месяцев; из секции по умолчанию старые строки удаляются DELETE
+CREATE OR REPLACE FUNCTION drop_watch_history_partitions(keep_months INTEGER)
+RETURNS INTEGER AS $$
+DECLARE
+    cutoff TIMESTAMP := date_trunc('month', LOCALTIMESTAMP) - make_interval(months => keep_months);
+    partition_name TEXT;
+    dropped INTEGER := 0;
+BEGIN
+    FOR partition_name IN
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'watch_history'::regclass
+          AND c.relname ~ '^watch_history_p[0-9]{6}$'
+          AND to_date(substring(c.relname FROM '[0-9]{6}$'), 'YYYYMM') < cutoff
+        ORDER BY c.relname
+    LOOP
+        EXECUTE format('ALTER TABLE watch_history DETACH PARTITION %I', partition_name);
+        EXECUTE format('DROP TABLE %I', partition_name);
+        dropped := dropped + 1;
+    END LOOP;
+    DELETE FROM watch_history_default WHERE watched_at < cutoff;
+    RETURN dropped;
+END;
+$$ LANGUAGE plpgsql;
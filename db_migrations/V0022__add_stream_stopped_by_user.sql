@@ -0,0 +1,2 @@
+-- Эфир, остановленный автором (action=stop), нельзя возобновить колбэком publish в окне переподключения
+ALTER TABLE streams ADD COLUMN IF NOT EXISTS stopped_by_user BOOLEAN NOT NULL DEFAULT false;
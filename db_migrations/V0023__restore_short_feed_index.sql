@@ -0,0 +1,5 @@
+-- V0016 пересоздал is_short как вычисляемый столбец, и вместе со старым столбцом пропал idx_videos_short_feed из V0007.
+-- Ленты API идут по idx_videos_type_feed, а запросам с фильтром по is_short возвращаем keyset-проход по индексу
+CREATE INDEX IF NOT EXISTS idx_videos_short_feed ON videos(is_short, created_at DESC, id DESC);
+
+ANALYZE videos;
@@ -18,6 +18,8 @@ export interface Video {
   description?: string;
   thumbnail_url: string;
   video_url?: string;
+  hls_url?: string;
+  processing_status?: 'processing' | 'ready' | 'failed';
   duration: string;
   views: number;
   is_short: boolean;
@@ -26,6 +28,21 @@ export interface Video {
   channel_avatar?: string;
   likes_count: number;
   comments_count: number;
+  is_liked?: boolean;
+  is_favorited?: boolean;
+  is_subscribed?: boolean;
+  last_watched_at?: string;
+  watch_count?: number;
+}
+
+export interface Comment {
+  id: number;
+  video_id: number;
+  user_id: number;
+  text: string;
+  created_at: string;
+  author_name: string;
+  author_avatar?: string;
 }
 
 export interface Stream {
@@ -41,6 +58,18 @@ export interface Stream {
   started_at: string;
 }
 
+const authHeaders = (): Record<string, string> => {
+  const token = localStorage.getItem('cotovideo_token');
+  return token
+    ? { 'Content-Type': 'application/json', 'X-Auth-Token': token }
+    : { 'Content-Type': 'application/json' };
+};
+
+const viewerHeaders = (): Record<string, string> => {
+  const token = localStorage.getItem('cotovideo_token');
+  return token ? { 'X-Auth-Token': token } : {};
+};
+
 export const api = {
   async register(email: string, password: string, username?: string) {
     const response = await fetch(API_URLS.auth, {
@@ -78,32 +107,76 @@ export const api = {
     return response.json();
   },
 
-  async searchVideos(query: string): Promise<{ videos: Video[] }> {
-    const response = await fetch(`${API_URLS.videos}?search=${encodeURIComponent(query)}`);
+  async searchVideos(query: string, cursor?: string | null): Promise<{ videos: Video[]; next_cursor: string | null }> {
+    const params = new URLSearchParams({ search: query });
+    if (cursor) params.set('cursor', cursor);
+    const response = await fetch(`${API_URLS.videos}?${params.toString()}`, { headers: viewerHeaders() });
+    return response.json();
+  },
+
+  async getVideos(
+    type: 'all' | 'shorts' = 'all',
+    cursor?: string | null,
+    feed: 'recent' | 'trending' | 'home' = 'recent',
+  ): Promise<{ videos: Video[]; next_cursor: string | null }> {
+    const params = new URLSearchParams();
+    if (type === 'shorts') params.set('type', 'shorts');
+    if (feed !== 'recent') params.set('feed', feed);
+    if (cursor) params.set('cursor', cursor);
+    const query = params.toString();
+    const url = query ? `${API_URLS.videos}?${query}` : API_URLS.videos;
+    const response = await fetch(url, { headers: viewerHeaders() });
     return response.json();
   },
 
-  async getVideos(type: 'all' | 'shorts' = 'all'): Promise<{ videos: Video[] }> {
-    const url = type === 'shorts' 
-      ? `${API_URLS.videos}?type=shorts`
-      : API_URLS.videos;
-    const response = await fetch(url);
+  async getContinueWatching(cursor?: string | null): Promise<{ videos: Video[]; next_cursor: string | null }> {
+    const params = new URLSearchParams({ feed: 'continue' });
+    if (cursor) params.set('cursor', cursor);
+    const response = await fetch(`${API_URLS.videos}?${params.toString()}`, { headers: viewerHeaders() });
     return response.json();
   },
 
   async likeVideo(videoId: number, userId?: number) {
     const response = await fetch(API_URLS.videos, {
       method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
+      headers: authHeaders(),
       body: JSON.stringify({ action: 'like', video_id: videoId, user_id: userId || 1 }),
     });
     return response.json();
   },
 
+  async applyActions(actions: { type: 'like' | 'unlike' | 'view'; video_id: number }[]): Promise<{
+    success: boolean;
+    videos: { video_id: number; likes_count: number; views: number; liked: boolean | null }[];
+  }> {
+    const response = await fetch(API_URLS.videos, {
+      method: 'POST',
+      headers: authHeaders(),
+      body: JSON.stringify({ action: 'batch', actions }),
+    });
+    return response.json();
+  },
+
+  async getComments(videoId: number, cursor?: string | null): Promise<{ comments: Comment[]; next_cursor: string | null }> {
+    const params = new URLSearchParams({ comments: String(videoId) });
+    if (cursor) params.set('cursor', cursor);
+    const response = await fetch(`${API_URLS.videos}?${params.toString()}`, { headers: viewerHeaders() });
+    return response.json();
+  },
+
+  async postComment(videoId: number, text: string): Promise<{ success: boolean; comment: Comment; comments_count: number }> {
+    const response = await fetch(API_URLS.videos, {
+      method: 'POST',
+      headers: authHeaders(),
+      body: JSON.stringify({ action: 'comment', video_id: videoId, text }),
+    });
+    return response.json();
+  },
+
   async recordView(videoId: number, userId: number) {
     const response = await fetch(API_URLS.videos, {
       method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
+      headers: authHeaders(),
       body: JSON.stringify({ action: 'view', video_id: videoId, user_id: userId }),
     });
     return response.json();
@@ -112,7 +185,7 @@ export const api = {
   async uploadVideo(userId: number, title: string, description: string, thumbnailUrl: string, videoUrl: string, duration: string, isShort: boolean = false) {
     const response = await fetch(API_URLS.upload, {
       method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
+      headers: authHeaders(),
       body: JSON.stringify({
         user_id: userId,
         title,
@@ -126,15 +199,19 @@ export const api = {
     return response.json();
   },
 
-  async getStreams(): Promise<{ streams: Stream[] }> {
-    const response = await fetch(API_URLS.streams);
+  async getStreams(sort: 'recent' | 'viewers' = 'recent', cursor?: string | null): Promise<{ streams: Stream[]; next_cursor: string | null }> {
+    const params = new URLSearchParams();
+    if (sort === 'viewers') params.set('sort', 'viewers');
+    if (cursor) params.set('cursor', cursor);
+    const query = params.toString();
+    const response = await fetch(query ? `${API_URLS.streams}?${query}` : API_URLS.streams);
     return response.json();
   },
 
   async startStream(userId: number, title: string, description?: string) {
     const response = await fetch(API_URLS.streams, {
       method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
+      headers: authHeaders(),
       body: JSON.stringify({ action: 'start', user_id: userId, title, description }),
     });
     return response.json();
@@ -143,40 +220,108 @@ export const api = {
   async stopStream(streamId: number) {
     const response = await fetch(API_URLS.streams, {
       method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
+      headers: authHeaders(),
       body: JSON.stringify({ action: 'stop', stream_id: streamId }),
     });
     return response.json();
   },
 
-  async joinStream(streamId: number, userId: number) {
+  async joinStream(streamId: number, viewerId?: string): Promise<{ success: boolean; viewer_id: string | null; heartbeat_interval: number }> {
     const response = await fetch(API_URLS.streams, {
       method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
-      body: JSON.stringify({ action: 'join', stream_id: streamId, user_id: userId }),
+      headers: authHeaders(),
+      body: JSON.stringify({ action: 'join', stream_id: streamId, viewer_id: viewerId }),
+    });
+    return response.json();
+  },
+
+  async heartbeatStream(streamId: number, viewerId?: string) {
+    const response = await fetch(API_URLS.streams, {
+      method: 'POST',
+      headers: authHeaders(),
+      body: JSON.stringify({ action: 'heartbeat', stream_id: streamId, viewer_id: viewerId }),
+    });
+    return response.json();
+  },
+
+  async leaveStream(streamId: number, viewerId?: string) {
+    const response = await fetch(API_URLS.streams, {
+      method: 'POST',
+      headers: authHeaders(),
+      body: JSON.stringify({ action: 'leave', stream_id: streamId, viewer_id: viewerId }),
+      keepalive: true,
     });
     return response.json();
   },
 
   async getVideo(videoId: number): Promise<{ video: Video }> {
-    const response = await fetch(`${API_URLS.videos}?id=${videoId}`);
+    const response = await fetch(`${API_URLS.videos}?id=${videoId}`, { headers: viewerHeaders() });
     return response.json();
   },
 
   async uploadShort(userId: number, title: string, videoFile: File, thumbnailFile?: File) {
-    const videoBase64 = await this.fileToBase64(videoFile);
-    const thumbnailBase64 = thumbnailFile ? await this.fileToBase64(thumbnailFile) : null;
+    const headers = authHeaders();
+
+    const initResponse = await fetch(API_URLS.upload, {
+      method: 'POST',
+      headers,
+      body: JSON.stringify({
+        action: 'create_upload',
+        title,
+        size: videoFile.size,
+        thumbnail: Boolean(thumbnailFile),
+      }),
+    });
+    const upload = await initResponse.json();
+    if (upload.error) return upload;
+
+    const parts: { part_number: number; url: string }[] = upload.parts;
+    const uploaded: { part_number: number; etag: string }[] = [];
+    let next = 0;
+
+    const uploadNextPart = async (): Promise<void> => {
+      while (next < parts.length) {
+        const part = parts[next++];
+        const start = (part.part_number - 1) * upload.part_size;
+        const response = await fetch(part.url, {
+          method: 'PUT',
+          body: videoFile.slice(start, start + upload.part_size),
+        });
+        if (!response.ok) throw new Error(`Part ${part.part_number} failed`);
+        uploaded.push({ part_number: part.part_number, etag: response.headers.get('ETag') || '' });
+      }
+    };
+
+    try {
+      await Promise.all([
+        ...Array.from({ length: Math.min(4, parts.length) }, uploadNextPart),
+        thumbnailFile && upload.thumbnail_upload_url
+          ? fetch(upload.thumbnail_upload_url, {
+              method: 'PUT',
+              headers: { 'Content-Type': 'image/jpeg' },
+              body: thumbnailFile,
+            })
+          : Promise.resolve(),
+      ]);
+    } catch (error) {
+      await fetch(API_URLS.upload, {
+        method: 'POST',
+        headers,
+        body: JSON.stringify({ action: 'abort_upload', upload_id: upload.upload_id, key: upload.key }),
+      });
+      throw error;
+    }
 
     const response = await fetch(API_URLS.upload, {
       method: 'POST',
-      headers: {
-        'Content-Type': 'application/json',
-        'X-User-Id': String(userId),
-      },
+      headers,
       body: JSON.stringify({
+        action: 'complete_upload',
         title,
-        video: videoBase64,
-        thumbnail: thumbnailBase64,
+        upload_id: upload.upload_id,
+        key: upload.key,
+        parts: uploaded,
+        thumbnail: Boolean(thumbnailFile),
       }),
     });
     return response.json();
@@ -28,6 +28,7 @@ export default function Index() {
   const [currentUser, setCurrentUser] = useState<User | null>(null);
   const [videos, setVideos] = useState<Video[]>([]);
   const [shorts, setShorts] = useState<Video[]>([]);
+  const [history, setHistory] = useState<Video[]>([]);
   const [streams, setStreams] = useState<Stream[]>([]);
   const [loading, setLoading] = useState(false);
   const { toast } = useToast();
@@ -66,6 +67,22 @@ export default function Index() {
     }
   };
 
+  useEffect(() => {
+    if (activeTab === 'history' && currentUser) {
+      loadHistory();
+    }
+  }, [activeTab, currentUser]);
+
+  const loadHistory = async () => {
+    try {
+      const data = await api.getContinueWatching();
+      setHistory(data.videos || []);
+    } catch (error) {
+      setHistory([]);
+      console.error('Failed to load history');
+    }
+  };
+
   const loadStreams = async () => {
     try {
       const data = await api.getStreams();
@@ -317,7 +334,7 @@ export default function Index() {
           <div className="p-6">
             <h2 className="text-2xl font-bold mb-6">История просмотров</h2>
             <div className="max-w-4xl">
-              {videos.map((video) => (
+              {history.map((video) => (
                 <div key={video.id} className="flex gap-4 mb-4 p-3 hover:bg-muted rounded-lg transition-colors">
                   <div className="relative w-48 aspect-video rounded-lg overflow-hidden bg-muted flex-shrink-0">
                     <img src={video.thumbnail_url} alt={video.title} className="w-full h-full object-cover" />